@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+
+"""
+Copyright 2020, Bloomberg Finance L.P.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import argparse
+import base64
+import copy
+import datetime
+import hashlib
+import http.client
+import json
+import os
+import queue
+import re
+import ssl
+import sys
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding
+
+# the filter plugin is installed next to this script, fall back to the one
+# of the common role when run from a checkout
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [here, os.path.join(here, '..', '..', 'common',
+                                   'filter_plugins')]
+
+from util import update_chef_node_host_vars  # noqa: E402
+
+SEARCH_ROWS = 1000
+
+
+class ChefError(Exception):
+    pass
+
+
+class ConnectionPool(object):
+
+    """at most size kept alive connections to the chef server"""
+
+    def __init__(self, url, size, ssl_context):
+        self.url = urllib.parse.urlsplit(url)
+        self.ssl_context = ssl_context
+        self.connections = queue.LifoQueue()
+
+        for _ in range(size):
+            self.connections.put(None)
+
+    def connect(self):
+        if self.url.scheme == 'https':
+            return http.client.HTTPSConnection(self.url.netloc,
+                                               context=self.ssl_context)
+
+        return http.client.HTTPConnection(self.url.netloc)
+
+    @contextmanager
+    def connection(self, fresh=False):
+        conn = self.connections.get()
+
+        try:
+            if conn is not None and fresh:
+                conn.close()
+                conn = None
+            if conn is None:
+                conn = self.connect()
+            yield conn
+        except Exception:
+            if conn is not None:
+                conn.close()
+            conn = None
+            raise
+        finally:
+            self.connections.put(conn)
+
+    def close(self):
+        while not self.connections.empty():
+            conn = self.connections.get()
+            if conn is not None:
+                conn.close()
+
+
+class ChefServer(object):
+
+    """
+    chef server api client signing its requests the way knife does
+    (version 1.3 of the chef authentication protocol)
+    """
+
+    def __init__(self, url, client_name, client_key, pool_size=8,
+                 trusted_certs=None):
+        self.url = url.rstrip('/')
+        self.path = urllib.parse.urlsplit(self.url).path
+        self.client_name = client_name
+
+        with open(client_key, 'rb') as f:
+            self.key = serialization.load_pem_private_key(
+                f.read(), password=None, backend=default_backend())
+
+        ssl_context = ssl.create_default_context()
+
+        if trusted_certs and os.path.isdir(trusted_certs):
+            for name in sorted(os.listdir(trusted_certs)):
+                ssl_context.load_verify_locations(
+                    cafile=os.path.join(trusted_certs, name))
+
+        self.pool = ConnectionPool(self.url, pool_size, ssl_context)
+
+    def sign(self, method, path, body):
+        timestamp = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+        content_hash = base64.b64encode(hashlib.sha256(body).digest())
+        content_hash = content_hash.decode()
+
+        # the signed path has neither repeated nor trailing slashes
+        path = re.sub('/+', '/', path)
+        if len(path) > 1:
+            path = path.rstrip('/')
+
+        canonical = '\n'.join([
+            'Method:{}'.format(method.upper()),
+            'Path:{}'.format(path),
+            'X-Ops-Content-Hash:{}'.format(content_hash),
+            'X-Ops-Sign:version=1.3',
+            'X-Ops-Timestamp:{}'.format(timestamp),
+            'X-Ops-UserId:{}'.format(self.client_name),
+            'X-Ops-Server-API-Version:1',
+        ])
+
+        signature = self.key.sign(canonical.encode(), padding.PKCS1v15(),
+                                  hashes.SHA256())
+        signature = base64.b64encode(signature).decode()
+
+        headers = {
+            'X-Ops-Sign': 'algorithm=sha256;version=1.3',
+            'X-Ops-Userid': self.client_name,
+            'X-Ops-Timestamp': timestamp,
+            'X-Ops-Content-Hash': content_hash,
+            'X-Ops-Server-API-Version': '1',
+        }
+
+        for i in range(0, len(signature), 60):
+            header = 'X-Ops-Authorization-{}'.format(i // 60 + 1)
+            headers[header] = signature[i:i + 60]
+
+        return headers
+
+    def request(self, method, path, body=None):
+        """send a request and return the response status and json body"""
+        body = b'' if body is None else json.dumps(body).encode()
+        path = self.path + path
+        url_path, _, _ = path.partition('?')
+
+        headers = self.sign(method, url_path, body)
+        headers['Accept'] = 'application/json'
+        headers['Content-Type'] = 'application/json'
+
+        # a kept alive connection may have been closed by the server in the
+        # meantime, the request is retried once on a new connection
+        for fresh in [False, True]:
+            try:
+                with self.pool.connection(fresh=fresh) as conn:
+                    conn.request(method, path, body=body, headers=headers)
+                    response = conn.getresponse()
+                    data = response.read()
+                break
+            except (http.client.RemoteDisconnected, BrokenPipeError,
+                    ConnectionResetError):
+                if fresh:
+                    raise
+
+        if response.status >= 400:
+            msg = "{} {} failed with {}: {}"
+            msg = msg.format(method, path, response.status,
+                             data.decode(errors='replace'))
+            raise ChefError(msg)
+
+        return response.status, json.loads(data.decode()) if data else None
+
+    def search_nodes(self):
+        """return every node by name, paging through the search results"""
+        nodes = {}
+        start = 0
+
+        while True:
+            query = urllib.parse.urlencode({'q': '*:*', 'start': start,
+                                            'rows': SEARCH_ROWS})
+            _, data = self.request('GET', '/search/node?' + query)
+
+            for node in data['rows']:
+                nodes[node['name']] = node
+
+            start += len(data['rows'])
+
+            if not data['rows'] or start >= data['total']:
+                return nodes
+
+    def node(self, name):
+        return self.request('GET', '/nodes/{}'.format(name))[1]
+
+    def save_node(self, node):
+        self.request('PUT', '/nodes/{}'.format(node['name']), node)
+
+
+def updated_node(node, hostvars):
+    """return the node with the host vars applied or None if unchanged"""
+    updated = update_chef_node_host_vars(copy.deepcopy(node), hostvars)
+    return updated if updated != node else None
+
+
+def sync_node(server, name, hostvars):
+
+    """
+    apply the host vars to the node as stored by the chef server, not to
+    the search index which may lag behind e.g. a run list just set, and
+    save it if changed
+    """
+
+    node = updated_node(server.node(name), hostvars)
+
+    if node is not None:
+        server.save_node(node)
+
+    return node is not None
+
+
+def sync_nodes(server, host_vars, workers=8):
+
+    """
+    find the nodes whose host vars differ with a single search, then fetch,
+    update and save those nodes, returning the names of the saved nodes
+    """
+
+    nodes = server.search_nodes()
+
+    # nodes registered moments ago may not be indexed by search yet
+    candidates = sorted(
+        name for name, hostvars in host_vars.items()
+        if name not in nodes or updated_node(nodes[name], hostvars))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        saved = executor.map(sync_node, [server] * len(candidates),
+                             candidates,
+                             [host_vars[name] for name in candidates])
+
+        return [name for name, changed in zip(candidates, saved) if changed]
+
+
+def main():
+
+    desc = "Update the host vars of chef nodes in bulk"
+    parser = argparse.ArgumentParser(description=desc)
+
+    parser.add_argument(
+        "host_vars",
+        help="Path to the json host vars of each node by node name",
+        metavar="FILE",
+    )
+
+    parser.add_argument(
+        "--server-url",
+        required=True,
+        help="Chef server url, including the organization",
+    )
+
+    parser.add_argument(
+        "--client-name",
+        required=True,
+        help="Name of the client authenticating with the chef server",
+    )
+
+    parser.add_argument(
+        "--client-key",
+        required=True,
+        help="Path to the private key of the client",
+        metavar="FILE",
+    )
+
+    parser.add_argument(
+        "--trusted-certs",
+        default="/etc/chef/trusted_certs",
+        help="Directory of the certificates to trust "
+             "(default: %(default)s)",
+        metavar="DIR",
+    )
+
+    parser.add_argument(
+        "--workers",
+        default=8,
+        type=int,
+        help="Number of connections to the chef server "
+             "(default: %(default)s)",
+    )
+
+    args = parser.parse_args()
+
+    try:
+        with open(args.host_vars) as f:
+            host_vars = json.load(f)
+
+        server = ChefServer(args.server_url, args.client_name,
+                            args.client_key, pool_size=args.workers,
+                            trusted_certs=args.trusted_certs)
+
+        try:
+            changed = sync_nodes(server, host_vars, workers=args.workers)
+        finally:
+            server.pool.close()
+
+        print(json.dumps({'changed': changed}))
+
+    except (OSError, KeyError, ValueError, ChefError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -21,6 +21,27 @@ __metaclass__ = type
 import ipaddress
 
 
+# databag ids -> position of the first databag with each id
+_databag_indexes = {}
+
+# password, region and auth url -> osadmin environment
+_osadmin_environments = {}
+
+
+def memoize(cache, key, build, size=64):
+    """
+    return the value cached under key, building it first if needed. the
+    keys are made of the values the result depends on, never of the
+    identity of the templated objects ansible renders anew on every use
+    """
+    if key not in cache:
+        if len(cache) >= size:
+            cache.clear()
+        cache[key] = build()
+
+    return cache[key]
+
+
 def primary_ip(a, *args, **kw):
     for transit in a:
         if 'primary' in transit and transit['primary'] is True:
@@ -33,24 +54,43 @@ def transit_interfaces(a, *args, **kw):
     interfaces = []
     ansible_facts = args[0]
 
+    # the facts are indexed once per call rather than scanned per transit
+    index = interface_index(ansible_facts)
+
     for transit in a:
         interface = find_interface(facts=ansible_facts,
-                                   macaddress=transit['mac'])
+                                   macaddress=transit['mac'], index=index)
         transit['name'] = interface['device']
         interfaces.append(transit)
 
     return interfaces
 
 
-def find_interface(facts, macaddress):
+def interface_index(facts):
 
-    interfaces = facts['interfaces']
+    index = {}
 
-    for interface in interfaces:
+    for interface in facts['interfaces']:
         if interface == 'lo':
             continue
-        if facts.get(interface, {}).get('macaddress', None) == macaddress:
-            return facts[interface]
+        macaddress = facts.get(interface, {}).get('macaddress', None)
+        if macaddress is not None:
+            # the first interface with a given mac wins (e.g. a physical
+            # interface over the vlans and bonds that share its mac)
+            index.setdefault(macaddress, interface)
+
+    return index
+
+
+def find_interface(facts, macaddress, index=None):
+
+    if index is None:
+        index = interface_index(facts)
+
+    interface = index.get(macaddress)
+
+    if interface is not None:
+        return facts[interface]
 
     raise ValueError("could not find interface with mac: " + macaddress)
 
@@ -83,43 +123,90 @@ def update_chef_node_host_vars(a, *args, **kw):
     return node_details
 
 
+def file_asset_index(a, *args, **kw):
+
+    assets = a
+    index = {}
+
+    for asset in assets:
+        if asset['name'] in index:
+            raise ValueError("duplicate asset {}".format(asset['name']))
+        index[asset['name']] = asset
+
+    return index
+
+
 def find_asset(a, *args, **kw):
 
     asset_to_find = a
     assets = args[0]
 
-    for asset in assets:
-        if asset['name'] == asset_to_find:
+    # accept either an index built with the file_asset_index filter or the
+    # list of assets, which is searched for the first match
+    if isinstance(assets, dict):
+        asset = assets.get(asset_to_find)
+
+        if asset is not None:
             return asset
+    else:
+        for asset in assets:
+            if asset['name'] == asset_to_find:
+                return asset
 
     raise ValueError("could not find {}".format(asset_to_find))
 
 
+def find_databag(databags, databag_id):
+
+    # only the ids make the key, the databags themselves hold large
+    # certificate blobs that are never read
+    ids = tuple(databag['id'] for databag in databags)
+
+    def build():
+        index = {}
+        for position, i in enumerate(ids):
+            index.setdefault(i, position)
+        return index
+
+    position = memoize(_databag_indexes, ids, build).get(databag_id)
+
+    if position is None:
+        raise ValueError("could not find databag {}".format(databag_id))
+
+    return databags[position]
+
+
 def osadmin(a, *args, **kw):
 
     cloud_vars = a
     chef = cloud_vars['chef']
     cloud = cloud_vars['cloud']
 
-    databags = chef['databags']
-    config = [databag for databag in databags if databag['id'] == 'config'][0]
+    config = find_databag(chef['databags'], 'config')
 
     os_username = 'admin'
     os_password = config['openstack'][os_username]['password']
     os_region_name = cloud['region']
     os_auth_url = "https://{}:35357/v3".format(cloud['fqdn'])
 
-    return {
-        'OS_PROJECT_DOMAIN_ID': 'default',
-        'OS_USER_DOMAIN_ID': 'default',
-        'OS_PROJECT_NAME': 'admin',
-        'OS_USERNAME': os_username,
-        'OS_PASSWORD': os_password,
-        'OS_AUTH_URL': os_auth_url,
-        'OS_REGION_NAME': os_region_name,
-        'OS_IDENTITY_API_VERSION': 3,
-        'OS_VOLUME_API_VERSION': 3
-    }
+    def build():
+        return {
+            'OS_PROJECT_DOMAIN_ID': 'default',
+            'OS_USER_DOMAIN_ID': 'default',
+            'OS_PROJECT_NAME': 'admin',
+            'OS_USERNAME': os_username,
+            'OS_PASSWORD': os_password,
+            'OS_AUTH_URL': os_auth_url,
+            'OS_REGION_NAME': os_region_name,
+            'OS_IDENTITY_API_VERSION': 3,
+            'OS_VOLUME_API_VERSION': 3
+        }
+
+    key = (os_password, os_region_name, os_auth_url)
+
+    # a copy, so that a task changing its environment does not change the
+    # environment of the other tasks
+    return dict(memoize(_osadmin_environments, key, build))
 
 
 class FilterModule(object):
@@ -128,6 +215,7 @@ class FilterModule(object):
         'primary_ip': primary_ip,
         'transit_interfaces': transit_interfaces,
         'update_chef_node_host_vars': update_chef_node_host_vars,
+        'file_asset_index': file_asset_index,
         'find_asset': find_asset,
         'osadmin': osadmin
     }
@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+
+"""
+Copyright 2020, Bloomberg Finance L.P.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import argparse
+import json
+import lzma
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+# the session module of the bcpc cookbook is installed next to this script,
+# fall back to the cookbook when run from a checkout
+here = os.path.dirname(os.path.realpath(__file__))
+sys.path[:0] = [here, os.path.join(here, '..', '..', '..', '..', '..', 'chef',
+                                   'cookbooks', 'bcpc', 'files', 'default',
+                                   'openstack')]
+
+from openstack_session import OpenStackError, OpenStackSession  # noqa: E402
+
+CHUNK_SIZE = 1024 * 1024
+
+# compression formats images can be decompressed from
+COMPRESSION_FORMATS = [None, 'xz']
+
+
+class Glance(object):
+
+    def __init__(self, session):
+        self.session = session
+        self.url = session.endpoint('image')
+
+    def list_images(self):
+        """return all images by name, following the pagination links"""
+        images = {}
+        url = '{}/v2/images?limit=1000'.format(self.url)
+
+        while url:
+            _, _, data = self.session.request('GET', url)
+
+            for image in data['images']:
+                images.setdefault(image['name'], image)
+
+            url = data.get('next')
+
+            if url:
+                url = urllib.parse.urljoin(self.url + '/', url.lstrip('/'))
+
+        return images
+
+    def create_image(self, name, disk_format):
+        body = {
+            'name': name,
+            'disk_format': disk_format,
+            'container_format': 'bare',
+            'visibility': 'public',
+        }
+
+        url = '{}/v2/images'.format(self.url)
+        _, _, data = self.session.request('POST', url, body=body)
+
+        return data['id']
+
+    def upload(self, image_id, chunks):
+        url = '{}/v2/images/{}/file'.format(self.url, image_id)
+        headers = {'Content-Type': 'application/octet-stream'}
+        self.session.request('PUT', url, body=chunks, headers=headers)
+
+    def delete_image(self, image_id):
+        url = '{}/v2/images/{}'.format(self.url, image_id)
+        self.session.request('DELETE', url)
+
+
+class Stage(object):
+
+    """bytes produced and time spent by one stage of an image import"""
+
+    def __init__(self, name):
+        self.name = name
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def add(self, size, seconds):
+        self.bytes += size
+        self.seconds += seconds
+
+    def __str__(self):
+        mb = self.bytes / 1000000.0
+        throughput = mb / self.seconds if self.seconds > 0 else 0.0
+        return "{}: {:.1f} MB in {:.2f}s ({:.1f} MB/s)".format(
+            self.name, mb, self.seconds, throughput)
+
+
+def read_chunks(path, stage):
+    with open(path, 'rb') as f:
+        while True:
+            start = time.perf_counter()
+            chunk = f.read(CHUNK_SIZE)
+            stage.add(len(chunk), time.perf_counter() - start)
+
+            if not chunk:
+                break
+
+            yield chunk
+
+
+def decompress_chunks(chunks, stage):
+    """
+    decompress a stream of xz chunks, never holding more than a chunk of
+    decompressed data at a time. a truncated stream raises an LZMAError
+    """
+    decompressor = lzma.LZMADecompressor()
+
+    for data in chunks:
+        while True:
+            # an xz file may hold several concatenated streams
+            if decompressor.eof:
+                data = decompressor.unused_data + data
+                decompressor = lzma.LZMADecompressor()
+
+            start = time.perf_counter()
+            chunk = decompressor.decompress(data, CHUNK_SIZE)
+            stage.add(len(chunk), time.perf_counter() - start)
+
+            if chunk:
+                yield chunk
+
+            data = b''
+
+            if decompressor.needs_input and not decompressor.eof:
+                break
+            if decompressor.eof and not decompressor.unused_data:
+                break
+
+    if not decompressor.eof:
+        raise lzma.LZMAError("Compressed data ended before the "
+                             "end-of-stream marker was reached")
+
+
+def write_chunks(chunks, path):
+    with open(path, 'wb') as f:
+        for chunk in chunks:
+            f.write(chunk)
+
+
+def convert_image(path, raw, stage):
+    start = time.perf_counter()
+    subprocess.check_call(['qemu-img', 'convert', '-f', 'qcow2',
+                           '-O', 'raw', path, raw])
+    stage.add(os.path.getsize(raw), time.perf_counter() - start)
+
+
+def load_manifest(path):
+    """
+    load the images to import. the manifest holds the cloud images and the
+    file asset index they refer to, e.g.
+    {"images": [{"file_asset": "cirros", "type": "qcow2"}],
+     "assets": {"cirros": {"filename": "cirros-0.4.0-x86_64-disk.img"}}}
+    """
+    with open(path) as f:
+        manifest = json.load(f)
+
+    images = []
+
+    for image in manifest['images']:
+        asset = manifest['assets'][image['file_asset']]
+        images.append({
+            'name': image['file_asset'],
+            'type': image['type'],
+            'compression': image.get('compression') or None,
+            'filename': asset['filename'],
+        })
+
+    return images
+
+
+def supported_images(images):
+    """
+    drop the images compressed in a format there is no handler for, with a
+    warning, so that a single unsupported image does not fail the import
+    """
+    supported = []
+
+    for image in images:
+        if image['compression'] not in COMPRESSION_FORMATS:
+            msg = "skipping {}: no handler for {} compression format"
+            print(msg.format(image['name'], image['compression']),
+                  file=sys.stderr)
+            continue
+
+        supported.append(image)
+
+    return supported
+
+
+def missing_images(glance, images):
+    existing = glance.list_images()
+    return [image for image in images if image['name'] not in existing]
+
+
+def image_chunks(image, image_dir, work_dir, stages):
+    """
+    return the raw image data as a stream of chunks. raw images are
+    decompressed on the fly while they are uploaded. qcow2 images are
+    converted with qemu-img, which needs random access to the image, so
+    only those are (decompressed and) written to the work dir first
+    """
+    compression = image['compression']
+
+    if compression not in COMPRESSION_FORMATS:
+        msg = "no handler for {} compression format"
+        raise OpenStackError(msg.format(compression))
+
+    read = Stage('read')
+    stages.append(read)
+    chunks = read_chunks(os.path.join(image_dir, image['filename']), read)
+
+    if compression == 'xz':
+        decompress = Stage('decompress')
+        stages.append(decompress)
+        chunks = decompress_chunks(chunks, decompress)
+
+    if image['type'] != 'qcow2':
+        return chunks
+
+    path = os.path.join(image_dir, image['filename'])
+
+    if compression is not None:
+        path = os.path.join(work_dir, image['name'] + '.qcow2')
+        write_chunks(chunks, path)
+
+    raw = os.path.join(work_dir, image['name'] + '.raw')
+    convert = Stage('convert')
+    stages.append(convert)
+    convert_image(path, raw, convert)
+
+    # the compressed qcow2 image is not needed anymore once converted
+    if compression is not None:
+        os.unlink(path)
+
+    read_raw = Stage('read raw')
+    stages.append(read_raw)
+
+    return read_chunks(raw, read_raw)
+
+
+def import_image(glance, image, image_dir):
+    """
+    import an image into glance. the image is deleted again if its data
+    could not be uploaded, an image left queued would be taken as present
+    by the next run
+    """
+    work_dir = tempfile.mkdtemp(dir=image_dir)
+    stages = []
+    image_id = None
+
+    try:
+        chunks = image_chunks(image, image_dir, work_dir, stages)
+        image_id = glance.create_image(image['name'], 'raw')
+
+        # the chunks are produced while they are uploaded, so the time spent
+        # producing them is not counted towards the upload
+        upload = Stage('upload')
+        produced = sum(stage.seconds for stage in stages)
+        start = time.perf_counter()
+
+        sizes = []
+        glance.upload(image_id, (sizes.append(len(chunk)) or chunk
+                                 for chunk in chunks))
+
+        produced = sum(stage.seconds for stage in stages) - produced
+        upload.add(sum(sizes), time.perf_counter() - start - produced)
+        stages.append(upload)
+    except Exception:
+        if image_id is not None:
+            delete_image(glance, image['name'], image_id)
+        raise
+    finally:
+        shutil.rmtree(work_dir)
+
+    return image['name'], image_id, stages
+
+
+def delete_image(glance, name, image_id):
+    try:
+        glance.delete_image(image_id)
+    except (OSError, OpenStackError) as e:
+        msg = "failed to delete the incomplete image {} ({}): {}"
+        print(msg.format(name, image_id, e), file=sys.stderr)
+
+
+def main():
+
+    desc = "Import missing cloud images into glance"
+    parser = argparse.ArgumentParser(description=desc)
+
+    parser.add_argument(
+        "action",
+        choices=["missing", "import"],
+        help="list the names of the missing images as json or import them",
+    )
+
+    parser.add_argument(
+        "manifest",
+        help="Path to the json manifest of the cloud images",
+        metavar="FILE",
+    )
+
+    parser.add_argument(
+        "--image-dir",
+        default="/var/tmp",
+        help="Directory holding the image files (default: %(default)s)",
+        metavar="DIR",
+    )
+
+    parser.add_argument(
+        "--workers",
+        default=4,
+        type=int,
+        help="Number of images imported concurrently (default: %(default)s)",
+    )
+
+    args = parser.parse_args()
+
+    try:
+        images = supported_images(load_manifest(args.manifest))
+
+        session = OpenStackSession()
+        session.authenticate()
+        glance = Glance(session)
+
+        missing = missing_images(glance, images)
+
+        if args.action == 'missing':
+            print(json.dumps([image['name'] for image in missing]))
+            return
+
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            futures = [executor.submit(import_image, glance, image,
+                                       args.image_dir)
+                       for image in missing]
+
+            for future in futures:
+                name, image_id, stages = future.result()
+                print("imported {} as {}".format(name, image_id))
+
+                for stage in stages:
+                    print("  {}".format(stage))
+
+    except (OSError, KeyError, OpenStackError, lzma.LZMAError,
+            subprocess.CalledProcessError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
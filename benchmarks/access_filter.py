@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+
+# Copyright 2020, Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark the cinder AccessFilter against stub cinder modules, no
+OpenStack installation needed
+
+usage: benchmarks/access_filter.py [--pools 200] [--private-types 150]
+                                   [--projects 5000] [--access-rows 50000]
+                                   [--candidates 200]
+"""
+
+import argparse
+import importlib.util
+import logging
+import os
+import random
+import sys
+import time
+import types
+import uuid
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+access_filter_file = os.path.join(root, 'chef', 'cookbooks', 'bcpc', 'files',
+                                  'default', 'cinder', 'access_filter.py')
+
+
+class StubDatabase(object):
+
+    """volume types and access rows served the way the cinder db api does"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+        self.types = {}
+        self.access = {}
+
+    def call(self):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def get_all_types(self, admin_context):
+        self.call()
+        return dict(self.types)
+
+    def volume_type_access_get_all(self, admin_context, volume_type_id):
+        self.call()
+        return self.access.get(volume_type_id, [])
+
+
+class AccessRow(object):
+
+    def __init__(self, volume_type_id, project_id):
+        self.volume_type_id = volume_type_id
+        self.project_id = project_id
+
+
+class RequestContext(object):
+
+    def __init__(self, project_id):
+        self.project_id = project_id
+        self.request_id = 'req-{}'.format(uuid.uuid4())
+
+
+class BackendState(object):
+
+    def __init__(self, pool_name):
+        self.pool_name = pool_name
+
+
+class StubOpt(object):
+
+    def __init__(self, name, default=None, **kwargs):
+        self.name = name
+        self.default = default
+
+
+class StubConfig(object):
+
+    """oslo.config options registered with their default values"""
+
+    def register_opts(self, opts, group):
+        setattr(self, group, types.SimpleNamespace(
+            **{opt.name: opt.default for opt in opts}))
+
+
+def install_stubs(database):
+
+    """
+    register stub cinder, oslo_config and oslo_log modules, providing only
+    what the AccessFilter imports, before it is loaded
+    """
+
+    modules = {}
+
+    for name in ['cinder', 'cinder.context', 'cinder.db', 'cinder.scheduler',
+                 'cinder.scheduler.filters', 'cinder.volume',
+                 'cinder.volume.volume_types', 'oslo_config',
+                 'oslo_config.cfg', 'oslo_log', 'oslo_log.log']:
+        modules[name] = types.ModuleType(name)
+
+    cfg = modules['oslo_config.cfg']
+    cfg.CONF = StubConfig()
+    cfg.FloatOpt = cfg.IntOpt = cfg.StrOpt = StubOpt
+
+    modules['cinder.context'].get_admin_context = lambda: 'admin-context'
+    modules['cinder.db'].volume_type_access_get_all = \
+        database.volume_type_access_get_all
+    modules['cinder.scheduler.filters'].BaseBackendFilter = object
+    modules['cinder.volume.volume_types'].get_all_types = \
+        database.get_all_types
+    modules['oslo_log.log'].getLogger = logging.getLogger
+
+    for name, module in modules.items():
+        if '.' in name:
+            parent, child = name.rsplit('.', 1)
+            setattr(modules[parent], child, module)
+
+    sys.modules.update(modules)
+
+
+def load_access_filter():
+    spec = importlib.util.spec_from_file_location('access_filter',
+                                                  access_filter_file)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def populate(database, pools, private_types, projects, access_rows, seed):
+
+    """
+    the first private_types pools are private volume types, the others are
+    public. the access rows grant random projects random private types
+    """
+
+    rng = random.Random(seed)
+
+    for i in range(pools):
+        private = i < private_types
+        name = '{}-{}'.format('private' if private else 'public', i)
+        database.types[name] = {'id': i, 'name': name,
+                                'is_public': not private}
+
+    project_ids = ['{:032x}'.format(rng.getrandbits(128))
+                   for _ in range(projects)]
+
+    granted = set()
+    while len(granted) < min(access_rows, private_types * projects):
+        granted.add((rng.randrange(private_types), rng.choice(project_ids)))
+
+    for volume_type_id, project_id in granted:
+        database.access.setdefault(volume_type_id, []).append(
+            AccessRow(volume_type_id, project_id))
+
+    return project_ids
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[int(round(q * (len(values) - 1)))]
+
+
+def schedule(access_filter, backends, project_id):
+    filter_properties = {'context': RequestContext(project_id)}
+    return [backend for backend in backends
+            if access_filter.backend_passes(backend, filter_properties)]
+
+
+def run(module, database, backends, project_ids, requests, candidates,
+        seed):
+    rng = random.Random(seed)
+    latencies = []
+    calls = []
+    passed = 0
+
+    for _ in range(requests):
+        project_id = rng.choice(project_ids)
+        pools = rng.sample(backends, min(candidates, len(backends)))
+        before = database.calls
+
+        start = time.perf_counter()
+        passed += len(schedule(module.AccessFilter(), pools, project_id))
+        latencies.append(time.perf_counter() - start)
+
+        calls.append(database.calls - before)
+
+    return latencies, calls, passed
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+
+    parser.add_argument(
+        "--pools",
+        default=200,
+        type=int,
+        help="number of backend pools",
+    )
+
+    parser.add_argument(
+        "--private-types",
+        default=150,
+        type=int,
+        help="number of pools with a private volume type",
+    )
+
+    parser.add_argument(
+        "--projects",
+        default=5000,
+        type=int,
+        help="number of projects",
+    )
+
+    parser.add_argument(
+        "--access-rows",
+        default=50000,
+        type=int,
+        help="number of volume type access rows",
+    )
+
+    parser.add_argument(
+        "--candidates",
+        default=200,
+        type=int,
+        help="number of pools checked by every request, the other filters "
+             "having ruled out the rest",
+    )
+
+    parser.add_argument(
+        "--requests",
+        default=200,
+        type=int,
+        help="number of scheduling requests",
+    )
+
+    parser.add_argument(
+        "--db-latency",
+        default=0.0,
+        type=float,
+        help="simulated round trip time of a database call in ms",
+    )
+
+    parser.add_argument(
+        "--seed",
+        default=0,
+        type=int,
+        help="seed of the synthetic access rows and projects",
+    )
+
+    args = parser.parse_args()
+
+    if args.private_types > args.pools:
+        parser.error("--private-types can not exceed --pools")
+
+    database = StubDatabase(latency=args.db_latency / 1000.0)
+    install_stubs(database)
+    module = load_access_filter()
+
+    project_ids = populate(database, args.pools, args.private_types,
+                           args.projects, args.access_rows, args.seed)
+    backends = [BackendState(name) for name in sorted(database.types)]
+
+    print('{} pools, {} private types, {} projects, {} access rows, '
+          '{} candidates, {} requests'.format(
+              args.pools, args.private_types, args.projects,
+              args.access_rows, args.candidates, args.requests))
+
+    # cold runs with a cache ttl of 0, i.e. every request reads the
+    # database, warm reuses the cache across requests
+    for mode in ['cold', 'warm']:
+        module._cache = module.AccessCache(ttl=0 if mode == 'cold' else None)
+        latencies, calls, passed = run(module, database, backends,
+                                       project_ids, args.requests,
+                                       args.candidates, args.seed)
+
+        print('  {:<5} p50 {:>10.3f} ms  p99 {:>10.3f} ms  '
+              '{:>8.1f} db calls/request  {:>6.1f} pools/request'.format(
+                  mode,
+                  percentile(latencies, 0.5) * 1000,
+                  percentile(latencies, 0.99) * 1000,
+                  sum(calls) / float(len(calls)),
+                  passed / float(args.requests)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+# Copyright 2020, Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark generate-ansible-inventory.py against synthetic topologies
+
+usage: benchmarks/ansible_inventory.py [--sizes 10,1000,10000]
+"""
+
+import argparse
+import importlib.util
+import os
+import sys
+import time
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+bin_dir = os.path.join(root, 'virtual', 'bin')
+script = os.path.join(bin_dir, 'generate-ansible-inventory.py')
+
+sys.path.insert(0, bin_dir)
+
+spec = importlib.util.spec_from_file_location('inventory', script)
+inventory = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(inventory)
+
+GROUPS = ['bootstraps', 'headnodes', 'worknodes', 'storagenodes']
+
+
+def synthetic_topology(size):
+
+    nodes = []
+    ssh_config = []
+
+    for i in range(size):
+
+        host = 'r{}n{}'.format(i // 64 + 1, i % 64)
+
+        nodes.append({
+            'host': host,
+            'group': GROUPS[i % len(GROUPS)],
+            'hardware_profile': 'worknode',
+            'host_vars': {
+                'bgp': {'asn': 4200858801},
+                'interfaces': {
+                    'service': {'ip': '10.65.{}.{}'.format(i // 250, i % 250)},
+                },
+                'run_list': ['role[worknode]'],
+            },
+        })
+
+        ssh_config.append({
+            'Host': host,
+            'HostName': '127.0.0.1',
+            'User': 'vagrant',
+            'Port': str(2200 + i),
+        })
+
+    return ssh_config, nodes
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+
+    parser.add_argument(
+        "--sizes",
+        default="10,1000,10000",
+        type=lambda x: [int(s) for s in x.split(',')],
+        help="comma separated list of topology sizes (number of nodes)",
+    )
+
+    parser.add_argument(
+        "--repeat",
+        default=5,
+        type=int,
+        help="number of runs per topology size, the best one is reported",
+    )
+
+    args = parser.parse_args()
+
+    print('{:>8} {:>12} {:>14}'.format('nodes', 'best (ms)', 'per node (us)'))
+
+    for size in args.sizes:
+
+        ssh_config, nodes = synthetic_topology(size)
+        timings = []
+
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            inventory.get_inventory_data(ssh_config, nodes)
+            timings.append(time.perf_counter() - start)
+
+        best = min(timings)
+        print('{:>8} {:>12.3f} {:>14.3f}'.format(
+            size, best * 1000, best * 1000000 / size))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+# Copyright 2020, Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark the transit_interfaces filter against synthetic ansible facts
+
+usage: benchmarks/transit_interfaces.py [--interfaces 5000]
+"""
+
+import argparse
+import copy
+import importlib.util
+import os
+import time
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+plugin = os.path.join(root, 'ansible', 'playbooks', 'roles', 'common',
+                      'filter_plugins', 'util.py')
+
+spec = importlib.util.spec_from_file_location('util', plugin)
+util = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(util)
+
+
+def mac(i):
+    return ':'.join('{:02x}'.format(b) for b in (i + 0x080027000000)
+                    .to_bytes(6, 'big'))
+
+
+def synthetic_facts(count):
+
+    # the transit interfaces come last, after all the veth, vlan and bond
+    # interfaces, which is the worst case for a linear scan
+    facts = {'interfaces': ['lo']}
+    facts['lo'] = {'device': 'lo'}
+
+    for i in range(count):
+        name = 'cali{:011x}'.format(i)
+        facts['interfaces'].append(name)
+        facts[name] = {'device': name, 'macaddress': mac(i)}
+
+    transits = []
+
+    for i, name in enumerate(['eno1', 'eno2']):
+        facts['interfaces'].append(name)
+        facts[name] = {'device': name, 'macaddress': mac(count + i)}
+        transits.append({'ip': '10.121.84.{}/28'.format(i + 2),
+                         'mac': mac(count + i)})
+
+    return facts, transits
+
+
+def scan(facts, macaddress):
+
+    # the linear scan done by find_interface before it used an index
+    for interface in facts['interfaces']:
+        if interface == 'lo':
+            continue
+        if facts.get(interface, {}).get('macaddress', None) == macaddress:
+            return facts[interface]
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+
+    parser.add_argument(
+        "--interfaces",
+        default=5000,
+        type=int,
+        help="number of synthetic interfaces in the facts",
+    )
+
+    parser.add_argument(
+        "--calls",
+        default=1000,
+        type=int,
+        help="number of filter calls against the same facts",
+    )
+
+    args = parser.parse_args()
+
+    facts, transits = synthetic_facts(args.interfaces)
+
+    start = time.perf_counter()
+    for _ in range(args.calls):
+        for transit in transits:
+            scan(facts, transit['mac'])
+    scanned = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(args.calls):
+        util.transit_interfaces(copy.deepcopy(transits), facts)
+    indexed = time.perf_counter() - start
+
+    print('{} interfaces, {} transits, {} calls'.format(
+        args.interfaces, len(transits), args.calls))
+    print('  linear scan      {:>10.3f} us/call'.format(
+        scanned * 1000000 / args.calls))
+    print('  indexed          {:>10.3f} us/call (index built per call)'
+          .format(indexed * 1000000 / args.calls))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+# Copyright 2020, Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compare the yaml loaders and dumpers used by virtual/bin
+
+usage: benchmarks/yaml_io.py [FILE ...]
+
+defaults to the largest topology files in virtual/topology
+"""
+
+import argparse
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import time
+import yaml
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(root, 'virtual', 'bin'))
+
+from lib import yaml_io # noqa
+
+
+def best_of(repeat, func):
+
+    timings = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    return min(timings)
+
+
+def benchmark(path, repeat):
+
+    with open(path) as f:
+        content = f.read()
+
+    data = yaml.load(content, Loader=yaml.SafeLoader)
+
+    # cache into a scratch directory rather than the user's cache
+    tmp_dir = tempfile.mkdtemp()
+    yaml_io.CACHE_DIR = os.path.join(tmp_dir, 'cache')
+    yaml_io.load_file(path)
+
+    results = [
+        ('SafeLoader', best_of(
+            repeat, lambda: yaml.load(content, Loader=yaml.SafeLoader))),
+        ('yaml_io.Loader', best_of(
+            repeat, lambda: yaml_io.load(content))),
+        ('yaml_io.load_file', best_of(
+            repeat, lambda: yaml_io.load_file(path))),
+        ('SafeDumper', best_of(
+            repeat, lambda: yaml.dump(data, Dumper=yaml.SafeDumper,
+                                      default_flow_style=False, indent=2))),
+        ('yaml_io.Dumper', best_of(
+            repeat, lambda: yaml_io.dump(data))),
+    ]
+
+    shutil.rmtree(tmp_dir)
+
+    return results
+
+
+def main():
+
+    default_files = sorted(
+        glob.glob(os.path.join(root, 'virtual', 'topology', '*.yml')),
+        key=os.path.getsize, reverse=True
+    )[:3]
+
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+
+    parser.add_argument(
+        "files",
+        nargs="*",
+        default=default_files,
+        metavar="FILE",
+        help="yaml files to load and dump",
+    )
+
+    parser.add_argument(
+        "--repeat",
+        default=50,
+        type=int,
+        help="number of runs per file, the best one is reported",
+    )
+
+    args = parser.parse_args()
+
+    print('libyaml available: {}'.format(yaml.__with_libyaml__))
+
+    for path in args.files:
+
+        print('\n{} ({} bytes)'.format(path, os.path.getsize(path)))
+
+        for name, best in benchmark(path, args.repeat):
+            print('  {:<20} {:>10.3f} ms'.format(name, best * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -12,6 +12,17 @@ default['bcpc']['cinder']['rbd_flatten_volume_from_snapshot'] = true
 default['bcpc']['cinder']['rbd_max_clone_depth'] = 5
 default['bcpc']['cinder']['database']['max_overflow'] = 10
 default['bcpc']['cinder']['database']['max_pool_size'] = 5
+
+# AccessFilter decision logging and metrics (emitter is none, statsd or file)
+default['bcpc']['cinder']['access_filter']['log_sample_rate'] = 0.01
+default['bcpc']['cinder']['access_filter']['metrics']['emitter'] = 'none'
+default['bcpc']['cinder']['access_filter']['metrics']['statsd_address'] = '127.0.0.1:8125'
+default['bcpc']['cinder']['access_filter']['metrics']['file'] = '/var/lib/cinder/access_filter_metrics.json'
+default['bcpc']['cinder']['access_filter']['metrics']['interval'] = 10
+
+# seconds the AccessFilter reuses volume types and their access lists for, a
+# revoked project can still be scheduled to a private pool for this long
+default['bcpc']['cinder']['access_filter']['cache_ttl'] = 30
 default['bcpc']['cinder']['quota'] = {
   'volumes' => -1,
   'snapshots' => 10,
@@ -18,6 +18,14 @@ default['bcpc']['powerdns']['receiver_threads'] = 3
 default['bcpc']['powerdns']['webserver']['address'] = '127.0.0.1'
 default['bcpc']['powerdns']['webserver']['port'] = 8081
 
+# catalog zone synchronization daemon, in seconds
+default['bcpc']['powerdns']['catalog_zone']['watch']['interval'] = 2
+default['bcpc']['powerdns']['catalog_zone']['watch']['max_interval'] = 60
+default['bcpc']['powerdns']['catalog_zone']['watch']['debounce'] = 5
+
+# seconds after which the catalog zone synchronization lease expires
+default['bcpc']['powerdns']['catalog_zone']['lock_ttl'] = 60
+
 # name servers
 default['bcpc']['powerdns']['nameservers']['ns1'] = node['bcpc']['cloud']['vip']
 
@@ -12,6 +12,18 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import bisect
+import collections
+import contextlib
+import json
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+
+from oslo_config import cfg
 from oslo_log import log as logging
 
 from cinder import context
@@ -22,20 +34,377 @@ from cinder.volume import volume_types
 
 LOG = logging.getLogger(__name__)
 
+access_filter_opts = [
+    cfg.FloatOpt('log_sample_rate',
+                 default=0.01,
+                 min=0.0,
+                 max=1.0,
+                 help='Fraction of the access decisions that are logged'),
+    cfg.StrOpt('metrics_emitter',
+               default='none',
+               choices=['none', 'statsd', 'file'],
+               help='Where the access filter metrics are sent to'),
+    cfg.StrOpt('statsd_address',
+               default='127.0.0.1:8125',
+               help='host:port of the statsd server'),
+    cfg.StrOpt('statsd_prefix',
+               default='cinder.scheduler.access_filter',
+               help='Prefix of the metric names sent to statsd'),
+    cfg.StrOpt('metrics_file',
+               default='/var/lib/cinder/access_filter_metrics.json',
+               help='Path of the json file the metrics are written to'),
+    cfg.IntOpt('metrics_interval',
+               default=10,
+               help='Seconds between two emissions of the metrics'),
+    cfg.IntOpt('cache_ttl',
+               default=30,
+               min=0,
+               help='Seconds the volume types and their access lists are '
+                    'reused across scheduling requests. A project whose '
+                    'access to a private volume type was revoked can still '
+                    'be scheduled to its pools for up to this long. A '
+                    'project denied a private type by cached access lists '
+                    'has them read again once per scheduling request, so '
+                    'new grants are seen at once. Each read costs one '
+                    'database call for the types plus one per private type '
+                    'among the candidate pools, 0 pays it on every '
+                    'scheduling request'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(access_filter_opts, group='access_filter')
+
+# upper bounds in ms of the buckets of the timing histograms
+HISTOGRAM_BUCKETS = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500]
+
+# number of timings kept for the statsd emitter between two emissions
+MAX_PENDING_TIMINGS = 1000
+
+# counter of every decision of the filter by its result and reason
+DECISION_COUNTERS = dict(
+    ((decision, reason), 'decision.{}.{}'.format(decision, reason))
+    for decision in ['pass', 'reject']
+    for reason in ['volume_type', 'no_context', 'no_project', 'unknown_type',
+                   'public_type', 'allowed', 'no_access']
+)
+
+# number of scheduling requests whose snapshot is remembered, requests are
+# handled concurrently by the scheduler greenthreads
+CACHED_REQUESTS = 64
+
+
+class Histogram(object):
+
+    def __init__(self):
+        self.counts = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, ms):
+        self.counts[bisect.bisect_left(HISTOGRAM_BUCKETS, ms)] += 1
+        self.count += 1
+        self.total += ms
+
+    def as_dict(self):
+        bounds = [str(bound) for bound in HISTOGRAM_BUCKETS] + ['+Inf']
+        return {
+            'buckets': dict(zip(bounds, self.counts)),
+            'count': self.count,
+            'sum_ms': self.total,
+        }
+
+
+class StatsdEmitter(object):
+
+    """send the counters and timings to a statsd server over udp"""
+
+    def __init__(self, address, prefix):
+        host, port = address.rsplit(':', 1)
+        self.address = (host, int(port))
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def emit(self, counters, histograms, deltas, timings):
+        lines = ['{}.{}:{}|c'.format(self.prefix, name, value)
+                 for name, value in sorted(deltas.items()) if value]
+        lines.extend('{}.{}:{:.3f}|ms'.format(self.prefix, name, ms)
+                     for name, ms in timings)
+
+        # keep the datagrams under the usual 512 bytes mtu of statsd
+        packet = []
+        for line in lines:
+            if packet and len('\n'.join(packet + [line])) > 512:
+                self.send(packet)
+                packet = []
+            packet.append(line)
+        if packet:
+            self.send(packet)
+
+    def send(self, lines):
+        try:
+            self.socket.sendto('\n'.join(lines).encode(), self.address)
+        except socket.error as e:
+            LOG.debug("could not send access filter metrics: %s", e)
+
+
+class FileEmitter(object):
+
+    """write the counters and histograms as json to a local file"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def emit(self, counters, histograms, deltas, timings):
+        data = {
+            'counters': counters,
+            'histograms': dict((name, histogram.as_dict())
+                               for name, histogram in histograms.items()),
+            'time': time.time(),
+        }
+
+        try:
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.path),
+                                       suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f, indent=2, sort_keys=True)
+            os.rename(tmp, self.path)
+        except (IOError, OSError) as e:
+            LOG.debug("could not write access filter metrics: %s", e)
+
+
+class NullEmitter(object):
+
+    def emit(self, counters, histograms, deltas, timings):
+        pass
+
+
+def emitter():
+    options = CONF.access_filter
+
+    if options.metrics_emitter == 'statsd':
+        return StatsdEmitter(options.statsd_address, options.statsd_prefix)
+    if options.metrics_emitter == 'file':
+        return FileEmitter(options.metrics_file)
+    return NullEmitter()
+
+
+class Metrics(object):
+
+    """
+    counters and timing histograms of the filter, handed to the emitter at
+    most every metrics_interval seconds from the scheduling path
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = collections.defaultdict(int)
+        self.emitted = {}
+        self.histograms = collections.defaultdict(Histogram)
+        self.timings = []
+        self.emitter = None
+        self.emitted_at = time.time()
+
+    def incr(self, name, value=1):
+        # the scheduler runs the filters in green threads, which are not
+        # preempted in the middle of the increment
+        self.counters[name] += value
+
+    def timing(self, name, seconds):
+        ms = seconds * 1000
+        with self.lock:
+            self.histograms[name].add(ms)
+            if len(self.timings) < MAX_PENDING_TIMINGS:
+                self.timings.append((name, ms))
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.timing(name, time.time() - start)
+
+    def maybe_emit(self):
+        now = time.time()
+        if now - self.emitted_at < CONF.access_filter.metrics_interval:
+            return
+
+        with self.lock:
+            if self.emitter is None:
+                self.emitter = emitter()
+
+            counters = dict(self.counters)
+            deltas = dict((name, value - self.emitted.get(name, 0))
+                          for name, value in counters.items())
+            timings, self.timings = self.timings, []
+            histograms = dict(self.histograms)
+            self.emitted = counters
+            self.emitted_at = now
+
+        self.emitter.emit(counters, histograms, deltas, timings)
+
+
+METRICS = Metrics()
+
+
+class AccessSnapshot(object):
+
+    """
+    volume types and the projects allowed to use each private type, as
+    read from the database at one point in time. the access list of a
+    private type is only read the first time one of its pools is checked,
+    and kept as a set of projects so that each check is a single lookup
+    """
+
+    def __init__(self, reloaded=False):
+        self.created_at = time.time()
+        self.admin_context = context.get_admin_context()
+        self.types = None
+        self.access = {}
+        self.reloaded = reloaded
+
+    def backend_types(self):
+        if self.types is None:
+            METRICS.incr('db.calls')
+            with METRICS.timer('db.get_all_types'):
+                self.types = volume_types.get_all_types(self.admin_context)
+        return self.types
+
+    def projects(self, backend_type_id):
+        if backend_type_id not in self.access:
+            METRICS.incr('db.calls')
+            with METRICS.timer('db.volume_type_access_get_all'):
+                backend_type_access = db.volume_type_access_get_all(
+                    self.admin_context, backend_type_id)
+            self.access[backend_type_id] = frozenset(
+                access.project_id for access in backend_type_access)
+        return self.access[backend_type_id]
+
+    def allowed(self, project_id, backend_type_info):
+        """whether project_id is allowed to use the private type"""
+        return project_id in self.projects(backend_type_info['id'])
+
+
+class Request(object):
+
+    """the snapshot a scheduling request is checked against"""
+
+    def __init__(self, snapshot, started_at):
+        self.snapshot = snapshot
+        self.started_at = started_at
+        self.reloaded = False
+
+
+class AccessCache(object):
+
+    """
+    hands out the snapshot every backend of a scheduling request is checked
+    against. all the backends of a request see the same snapshot, and a new
+    snapshot is only taken for a new request once the previous one is
+    older than ttl seconds (the cache_ttl option unless given)
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.current = None
+        self.requests = collections.OrderedDict()
+
+    def snapshot(self, request_id):
+        with self.lock:
+            if request_id is not None and request_id in self.requests:
+                return self.requests[request_id].snapshot
+
+            ttl = self.ttl
+            if ttl is None:
+                ttl = CONF.access_filter.cache_ttl
+
+            now = time.time()
+
+            if self.current is None or now - self.current.created_at >= ttl:
+                self.current = AccessSnapshot()
+
+            if request_id is not None:
+                self.requests[request_id] = Request(self.current, now)
+                while len(self.requests) > CACHED_REQUESTS:
+                    self.requests.popitem(last=False)
+
+            return self.current
+
+    def reload(self, snapshot, request_id, stale_only=False):
+        """
+        replace the snapshot of a request by a fresh one, at most once per
+        request. used when a backend refers to a volume type that was
+        created after the snapshot was taken, and with stale_only when a
+        project is denied a type by a snapshot taken before the request
+        started, e.g. right after the project was granted access to it. a
+        snapshot taken by another request since this one started is reused
+        """
+        with self.lock:
+            request = self.requests.get(request_id)
+
+            # without a request id the snapshot itself is only reloaded once
+            if request is None:
+                if snapshot.reloaded or self.current is not snapshot:
+                    return snapshot
+
+                snapshot.reloaded = True
+                self.current = AccessSnapshot(reloaded=True)
+                return self.current
+
+            if request.reloaded:
+                return request.snapshot
+
+            if stale_only and \
+                    request.snapshot.created_at >= request.started_at:
+                return request.snapshot
+
+            request.reloaded = True
+
+            if self.current is request.snapshot or \
+                    self.current.created_at < request.started_at:
+                self.current = AccessSnapshot()
+
+            request.snapshot = self.current
+            return self.current
+
+
+_cache = AccessCache()
+
 
 class AccessFilter(filters.BaseBackendFilter):
 
+    def decide(self, passes, reason, backend_type_name, project_id=None):
+        """
+        count the decision and log a sample of them, lazily formatted since
+        most of them are filtered out by the log level
+        """
+        decision = 'pass' if passes else 'reject'
+        METRICS.incr(DECISION_COUNTERS[decision, reason])
+        METRICS.maybe_emit()
+
+        if random.random() < CONF.access_filter.log_sample_rate:
+            LOG.info("access filter decision=%(decision)s reason=%(reason)s "
+                     "backend=%(backend)s project=%(project)s",
+                     {'decision': decision, 'reason': reason,
+                      'backend': backend_type_name, 'project': project_id})
+
+        return passes
+
     def backend_passes(self, backend_state, filter_properties):
         # get the volume type from the filter properties or return None
         volume_type = filter_properties.get('volume_type', None)
 
+        # get the type name from the backend state
+        backend_type_name = backend_state.pool_name
+
         """
         if the user passed a volume type then this filter has nothing to do
         so just return True with the assumption that the other mechanisms in
         place will determine if this is possible or not
         """
         if volume_type is not None:
-            return True
+            return self.decide(True, 'volume_type', backend_type_name)
 
         # get the request context object
         r_context = filter_properties.get('context')
@@ -43,7 +412,7 @@ class AccessFilter(filters.BaseBackendFilter):
         # we can't do anything without the request context
         if r_context is None:
             LOG.fatal("context not found in filter_properties")
-            return False
+            return self.decide(False, 'no_context', backend_type_name)
 
         # get the project id from the request context
         project_id = None
@@ -54,52 +423,53 @@ class AccessFilter(filters.BaseBackendFilter):
         # we can't do anything without a project id
         if project_id is None:
             LOG.fatal("project id not found in the request context")
-            return False
+            return self.decide(False, 'no_project', backend_type_name)
 
-        # we need the admin context to fetch the list of backend types
-        # and access ids
-        admin_context = context.get_admin_context()
+        # the backend types and access lists are read and indexed by project
+        # once per scheduling request (and at most every cache_ttl seconds)
+        # instead of once per backend
+        request_id = getattr(r_context, 'request_id', None)
+        snapshot = _cache.snapshot(request_id)
 
         # get all backend types
-        backend_types = volume_types.get_all_types(admin_context)
-
-        # get the type name from the backend state
-        backend_type_name = backend_state.pool_name
+        backend_types = snapshot.backend_types()
 
         # get backend state information
         backend_type_info = backend_types.get(backend_type_name)
 
+        # the backend type may have been created after the snapshot was taken
+        if backend_type_info is None:
+            snapshot = _cache.reload(snapshot, request_id)
+            backend_type_info = snapshot.backend_types().get(
+                backend_type_name)
+
         # we can't do anything without the backend type information
         if backend_type_info is None:
-            LOG.info(
-                "no backend type information found for {}. "
-                "skipping".format(backend_type_name))
-            return False
+            return self.decide(False, 'unknown_type', backend_type_name,
+                               project_id)
 
         # we're only looking for private backend types
         if backend_type_info['is_public']:
-            LOG.info(
-                "backend type {} is not private. "
-                "skipping".format(backend_type_name))
-            return False
-
-        # get the backend type id
-        backend_type_id = backend_type_info['id']
-
-        # get list of access ids for current backend type
-        backend_type_access = db.volume_type_access_get_all(
-            admin_context, backend_type_id)
+            return self.decide(False, 'public_type', backend_type_name,
+                               project_id)
 
-        # look for project id in list of access ids
-        backend_type_found = [access for access in backend_type_access
-                              if access.project_id == project_id]
+        # look for the project in the set of projects allowed to use the
+        # backend type
+        if snapshot.allowed(project_id, backend_type_info):
+            return self.decide(True, 'allowed', backend_type_name,
+                               project_id)
 
-        if len(backend_type_found) > 0:
-            LOG.info("{} is a valid backend type".format(backend_type_name))
-            return True
+        # the project may have been granted access to the backend type after
+        # the snapshot was taken
+        reloaded = _cache.reload(snapshot, request_id, stale_only=True)
 
-        LOG.info(
-            "could not find project id {} in the {} backend type. "
-            "skipping".format(project_id, backend_type_name))
+        if reloaded is not snapshot:
+            backend_type_info = reloaded.backend_types().get(
+                backend_type_name)
+            if backend_type_info is not None and \
+                    not backend_type_info['is_public'] and \
+                    reloaded.allowed(project_id, backend_type_info):
+                return self.decide(True, 'allowed', backend_type_name,
+                                   project_id)
 
-        return False
+        return self.decide(False, 'no_access', backend_type_name, project_id)
@@ -0,0 +1,183 @@
+# Copyright 2020, Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+authenticated session against the openstack apis, shared by the openstack
+helper scripts
+"""
+
+import http.client
+import json
+import os
+import ssl
+import threading
+import urllib.parse
+
+
+class OpenStackError(Exception):
+    pass
+
+
+class OpenStackSession(object):
+
+    """
+    authenticates against keystone once using the OS_* variables from the
+    environment (see the osadmin filter) and sends requests to the
+    endpoints of the service catalog with the resulting token. every thread
+    keeps its connections open across requests
+
+    used by os-reconcile (chef openstack files) and import-cloud-images
+    (ansible headnode role), which installs this module from the cookbook
+    """
+
+    def __init__(self, environ=None):
+        self.environ = os.environ if environ is None else environ
+        self.token = None
+        self.catalog = []
+        self.local = threading.local()
+
+        self.ssl_context = ssl.create_default_context(
+            cafile=self.environ.get('OS_CACERT'))
+
+        if self.environ.get('OS_INSECURE', '').lower() in ['1', 'true']:
+            self.ssl_context.check_hostname = False
+            self.ssl_context.verify_mode = ssl.CERT_NONE
+
+    def connection(self, url, fresh=False):
+        url = urllib.parse.urlsplit(url)
+        connections = self.local.__dict__.setdefault('connections', {})
+        key = (url.scheme, url.netloc)
+
+        if fresh and key in connections:
+            connections.pop(key).close()
+
+        if key not in connections:
+            if url.scheme == 'https':
+                connections[key] = http.client.HTTPSConnection(
+                    url.netloc, context=self.ssl_context)
+            else:
+                connections[key] = http.client.HTTPConnection(url.netloc)
+
+        return connections[key]
+
+    def request(self, method, url, body=None, headers=None):
+        """
+        send a request and return the response status, headers and json
+        decoded body. a body that is neither bytes nor a dict is sent as a
+        stream of chunks using chunked transfer encoding
+        """
+        headers = dict(headers or {})
+        chunked = False
+
+        if self.token is not None:
+            headers['X-Auth-Token'] = self.token
+
+        if isinstance(body, dict):
+            body = json.dumps(body).encode()
+            headers.setdefault('Content-Type', 'application/json')
+        elif body is not None and not isinstance(body, bytes):
+            chunked = True
+
+        parts = urllib.parse.urlsplit(url)
+        path = urllib.parse.urlunsplit(('', '', parts.path or '/',
+                                        parts.query, ''))
+
+        # a kept alive connection may have been closed by the server in the
+        # meantime, the request is retried once on a new connection unless
+        # its body is a stream that was already consumed
+        for fresh in [False] if chunked else [False, True]:
+            conn = self.connection(url, fresh=fresh)
+            try:
+                conn.request(method, path, body=body, headers=headers,
+                             encode_chunked=chunked)
+                response = conn.getresponse()
+                data = response.read()
+                break
+            except (http.client.RemoteDisconnected, BrokenPipeError,
+                    ConnectionResetError):
+                conn.close()
+                if fresh or chunked:
+                    raise
+            except Exception:
+                conn.close()
+                raise
+
+        if response.status >= 400:
+            msg = "{} {} failed with {}: {}"
+            msg = msg.format(method, url, response.status,
+                             data.decode(errors='replace'))
+            raise OpenStackError(msg)
+
+        try:
+            data = json.loads(data.decode()) if data else None
+        except ValueError:
+            pass
+
+        return response.status, response.headers, data
+
+    def get(self, url):
+        return self.request('GET', url)[2]
+
+    def authenticate(self):
+        env = self.environ
+
+        body = {
+            'auth': {
+                'identity': {
+                    'methods': ['password'],
+                    'password': {
+                        'user': {
+                            'name': env['OS_USERNAME'],
+                            'domain': {'id': env['OS_USER_DOMAIN_ID']},
+                            'password': env['OS_PASSWORD'],
+                        }
+                    }
+                },
+                'scope': {
+                    'project': {
+                        'name': env['OS_PROJECT_NAME'],
+                        'domain': {'id': env['OS_PROJECT_DOMAIN_ID']},
+                    }
+                }
+            }
+        }
+
+        url = '{}/auth/tokens'.format(self.identity_url())
+        _, headers, data = self.request('POST', url, body=body)
+
+        self.token = headers['X-Subject-Token']
+        self.catalog = data['token'].get('catalog', [])
+
+    def identity_url(self):
+        url = self.environ['OS_AUTH_URL'].rstrip('/')
+        return url if url.endswith('/v3') else url + '/v3'
+
+    def endpoint(self, service_type):
+        interface = self.environ.get('OS_INTERFACE', 'public')
+        region = self.environ.get('OS_REGION_NAME')
+
+        for service in self.catalog:
+            if service['type'] != service_type:
+                continue
+
+            for endpoint in service['endpoints']:
+                if endpoint['interface'] != interface:
+                    continue
+                if region and region not in [endpoint.get('region_id'),
+                                             endpoint.get('region')]:
+                    continue
+                return endpoint['url'].rstrip('/')
+
+        msg = "no {} endpoint for the {} interface found"
+        raise OpenStackError(msg.format(service_type, interface))
@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+
+# Copyright 2020, Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+reconcile openstack resources with a declarative description of them
+
+the description is a json (or yaml) document such as
+
+    {
+      "projects": [{"name": "admin", "domain": "default",
+                    "description": "admin project"}],
+      "roles": [{"name": "heat_stack_owner"}],
+      "endpoints": [{"service": "nova", "type": "compute",
+                     "interface": "public", "region": "RegionOne",
+                     "url": "https://openstack.example.com:8774/v2.1"}],
+      "flavors": [{"name": "generic1.tiny", "vcpus": 1, "ram": 512,
+                   "disk": 1}],
+      "quotas": {"compute": {"admin": {"cores": -1, "ram": -1}}}
+    }
+
+every section is optional. the tool authenticates once, lists each kind
+of resource with a single request and only creates or updates what
+differs from the description. nothing that is missing from the
+description is deleted.
+"""
+
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+# catalog service type and quota api of each quota section
+QUOTA_SERVICES = {
+    'compute': ('compute', '/os-quota-sets/{}', 'quota_set'),
+    'volume': ('volumev3', '/os-quota-sets/{}', 'quota_set'),
+    'network': ('network', '/v2.0/quotas/{}', 'quota'),
+}
+
+# flavor attributes compared with the description and their defaults
+FLAVOR_DEFAULTS = {
+    'vcpus': 1,
+    'ram': 512,
+    'disk': 0,
+    'swap': 0,
+    'OS-FLV-EXT-DATA:ephemeral': 0,
+    'os-flavor-access:is_public': True,
+}
+
+FLAVOR_ALIASES = {
+    'ephemeral': 'OS-FLV-EXT-DATA:ephemeral',
+    'is_public': 'os-flavor-access:is_public',
+}
+
+# flavor attributes nova reports as an empty string when they are 0
+FLAVOR_EMPTY_AS_ZERO = ['swap', 'OS-FLV-EXT-DATA:ephemeral']
+
+
+# the session module is installed next to this script, as it is in the
+# cookbook
+here = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, here)
+
+from openstack_session import OpenStackError, OpenStackSession  # noqa: E402
+
+
+def flavor_attribute(flavor, key, default=None):
+    value = flavor.get(key, default)
+
+    if key in FLAVOR_EMPTY_AS_ZERO and value in ['', None]:
+        return 0
+
+    return value
+
+
+class Change(object):
+
+    def __init__(self, description, apply):
+        self.description = description
+        self.apply = apply
+
+    def __str__(self):
+        return self.description
+
+
+class Reconciler(object):
+
+    """
+    compares the description with the resources listed from the apis and
+    returns the changes that make them match. projects, roles and services
+    are reconciled first since endpoints and quotas refer to them
+    """
+
+    def __init__(self, session, dry_run=False):
+        self.session = session
+        self.dry_run = dry_run
+        self.keystone = session.identity_url()
+        self.projects = {}
+        self.services = {}
+
+    def list_projects(self):
+        data = self.session.get('{}/projects'.format(self.keystone))
+        self.projects = {(p['name'], p['domain_id']): p
+                         for p in data['projects']}
+        return self.projects
+
+    def project_id(self, name, domain='default'):
+        try:
+            return self.projects[name, domain]['id']
+        except KeyError:
+            msg = "project {} not found in domain {}"
+            raise OpenStackError(msg.format(name, domain))
+
+    def plan_projects(self, wanted):
+        existing = self.list_projects()
+        url = '{}/projects'.format(self.keystone)
+        changes = []
+
+        for project in wanted:
+            project = dict(project)
+            domain = project.pop('domain', 'default')
+            current = existing.get((project['name'], domain))
+
+            if current is None:
+                body = dict(project, domain_id=domain)
+                changes.append(Change(
+                    "create project {}".format(project['name']),
+                    self.creator(url, 'project', body, self.projects,
+                                 (project['name'], domain))))
+                continue
+
+            update = {key: value for key, value in project.items()
+                      if current.get(key) != value}
+            if update:
+                changes.append(Change(
+                    "update project {}: {}".format(project['name'],
+                                                   sorted(update)),
+                    self.updater('PATCH', '{}/{}'.format(url, current['id']),
+                                 {'project': update})))
+
+        return changes
+
+    def plan_roles(self, wanted):
+        url = '{}/roles'.format(self.keystone)
+        existing = {role['name'] for role in self.session.get(url)['roles']}
+
+        return [
+            Change("create role {}".format(role['name']),
+                   self.updater('POST', url, {'role': role}))
+            for role in wanted if role['name'] not in existing
+        ]
+
+    def plan_services(self, endpoints):
+        url = '{}/services'.format(self.keystone)
+        self.services = {(s['name'], s['type']): s
+                         for s in self.session.get(url)['services']}
+        changes = []
+        wanted = sorted({(e['service'], e['type']) for e in endpoints})
+
+        for name, service_type in wanted:
+            if (name, service_type) not in self.services:
+                body = {'name': name, 'type': service_type, 'enabled': True}
+                changes.append(Change(
+                    "create service {} ({})".format(name, service_type),
+                    self.creator(url, 'service', body, self.services,
+                                 (name, service_type))))
+
+        return changes
+
+    def plan_endpoints(self, wanted):
+        url = '{}/endpoints'.format(self.keystone)
+        existing = {}
+
+        for endpoint in self.session.get(url)['endpoints']:
+            key = (endpoint['service_id'], endpoint['interface'],
+                   endpoint.get('region_id') or endpoint.get('region'))
+            existing[key] = endpoint
+
+        changes = []
+
+        for endpoint in wanted:
+            service = self.services.get((endpoint['service'],
+                                         endpoint['type']))
+            name = "{} endpoint {} of {}".format(
+                endpoint['interface'], endpoint['url'], endpoint['service'])
+
+            # a dry run does not create the services the endpoints need
+            if service is None and self.dry_run:
+                changes.append(Change("create " + name, None))
+                continue
+
+            region = endpoint.get('region')
+            current = existing.get((service['id'], endpoint['interface'],
+                                    region))
+
+            if current is None:
+                body = {'endpoint': {
+                    'service_id': service['id'],
+                    'interface': endpoint['interface'],
+                    'region_id': region,
+                    'url': endpoint['url'],
+                    'enabled': True,
+                }}
+                changes.append(Change("create " + name,
+                                      self.updater('POST', url, body)))
+            elif current['url'] != endpoint['url']:
+                changes.append(Change(
+                    "update " + name,
+                    self.updater('PATCH',
+                                 '{}/{}'.format(url, current['id']),
+                                 {'endpoint': {'url': endpoint['url']}})))
+
+        return changes
+
+    def plan_flavors(self, wanted):
+        nova = self.session.endpoint('compute')
+        url = '{}/flavors/detail?is_public=None'.format(nova)
+        existing = {}
+
+        while url:
+            data = self.session.get(url)
+            existing.update((f['name'], f) for f in data['flavors'])
+            url = next((link['href'] for link in data.get('flavors_links', [])
+                        if link.get('rel') == 'next'), None)
+
+        changes = []
+
+        for flavor in wanted:
+            spec = dict(FLAVOR_DEFAULTS)
+            for key, value in flavor.items():
+                spec[FLAVOR_ALIASES.get(key, key)] = value
+
+            current = existing.get(flavor['name'])
+
+            if current is None:
+                changes.append(Change(
+                    "create flavor {}".format(flavor['name']),
+                    self.updater('POST', '{}/flavors'.format(nova),
+                                 {'flavor': spec})))
+                continue
+
+            # flavors can not be modified, a flavor that differs is only
+            # reported since instances may be using it
+            differs = sorted(
+                key for key in FLAVOR_DEFAULTS
+                if flavor_attribute(current, key, spec[key]) !=
+                flavor_attribute(spec, key))
+            if differs:
+                msg = "flavor {} differs from its description: {}"
+                print(msg.format(flavor['name'], differs), file=sys.stderr)
+
+        return changes
+
+    def plan_quotas(self, wanted, executor):
+        changes = []
+        reads = []
+
+        for section, projects in sorted(wanted.items()):
+            service_type, path, key = QUOTA_SERVICES[section]
+            base = self.session.endpoint(service_type)
+
+            for project, limits in sorted(projects.items()):
+                if project not in [name for name, _ in self.projects]:
+                    if self.dry_run:
+                        changes.append(Change("set {} quotas of {}: {}".format(
+                            section, project, sorted(limits)), None))
+                        continue
+
+                url = base + path.format(self.project_id(project))
+                reads.append((section, project, url, key, limits,
+                              executor.submit(self.session.get, url)))
+
+        for section, project, url, key, limits, future in reads:
+            current = future.result()[key]
+            update = {name: limit for name, limit in limits.items()
+                      if current.get(name) != limit}
+
+            if update:
+                changes.append(Change(
+                    "set {} quotas of {}: {}".format(section, project,
+                                                     sorted(update)),
+                    self.updater('PUT', url, {key: update})))
+
+        return changes
+
+    def creator(self, url, kind, body, index, key):
+        """create a resource and record it in index"""
+        def apply():
+            _, _, data = self.session.request('POST', url, {kind: body})
+            index[key] = data[kind]
+        return apply
+
+    def updater(self, method, url, body):
+        def apply():
+            self.session.request(method, url, body)
+        return apply
+
+
+def apply_changes(changes, executor, dry_run=False):
+    for change in changes:
+        print(("would " if dry_run else "") + str(change))
+
+    if dry_run:
+        return
+
+    # wait for every change and raise the first error
+    futures = [executor.submit(change.apply) for change in changes]
+    for future in futures:
+        future.result()
+
+
+def load_description(path):
+    with open(path) as f:
+        if path.endswith(('.yml', '.yaml')):
+            import yaml
+            return yaml.safe_load(f) or {}
+        return json.load(f)
+
+
+def reconcile(session, description, workers=4, dry_run=False):
+    reconciler = Reconciler(session, dry_run=dry_run)
+    endpoints = description.get('endpoints', [])
+    changes = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        first = []
+        if 'projects' in description or 'quotas' in description:
+            first += reconciler.plan_projects(description.get('projects', []))
+        if 'roles' in description:
+            first += reconciler.plan_roles(description['roles'])
+        if endpoints:
+            first += reconciler.plan_services(endpoints)
+
+        apply_changes(first, executor, dry_run)
+
+        second = []
+        if endpoints:
+            second += reconciler.plan_endpoints(endpoints)
+        if 'flavors' in description:
+            second += reconciler.plan_flavors(description['flavors'])
+        if 'quotas' in description:
+            second += reconciler.plan_quotas(description['quotas'], executor)
+
+        apply_changes(second, executor, dry_run)
+        changes = len(first) + len(second)
+
+    return changes
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description="Reconcile OpenStack resources with a description")
+
+    parser.add_argument(
+        "description",
+        help="Path to the json or yaml description of the resources",
+        metavar="FILE",
+    )
+
+    parser.add_argument(
+        "--workers",
+        default=4,
+        type=int,
+        help="Number of concurrent requests (default: %(default)s)",
+    )
+
+    parser.add_argument(
+        "--dry-run",
+        action='store_true',
+        help="Only print the changes that would be made",
+    )
+
+    parser.add_argument(
+        "--check",
+        action='store_true',
+        help="Like --dry-run, but exit with status 2 when changes are needed",
+    )
+
+    args = parser.parse_args()
+
+    try:
+        description = load_description(args.description)
+
+        session = OpenStackSession()
+        session.authenticate()
+
+        changes = reconcile(session, description, workers=args.workers,
+                            dry_run=args.dry_run or args.check)
+
+        if not changes:
+            print("nothing to do")
+        elif args.check:
+            sys.exit(2)
+
+    except (OSError, KeyError, ValueError, OpenStackError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -14,17 +14,34 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import ssl
 import sys
+import json
 import time
+import fcntl
+import threading
+import base64
+import signal
+import socket
 import hashlib
 import dns.name
 import argparse
 import configparser
-from jinja2 import Template
-from subprocess import call, check_output
+import tempfile
+import contextlib
+import urllib.error
+import urllib.request
+import jinja2
+from subprocess import PIPE, call, check_output, run
+
+CONFIG_FILE = '/usr/local/etc/catalog-zone/catalog-zone.conf'
 
 config = configparser.ConfigParser()
-config.read('/usr/local/etc/catalog-zone/catalog-zone.conf')
+config.read(CONFIG_FILE)
+
+# ttl of the records managed through the pdns api, see catalog-zone.j2
+CATALOG_TTL = 3600
 
 
 def nzfsum(zone):
@@ -32,39 +49,801 @@ def nzfsum(zone):
     return hashlib.sha1(dns_name.to_wire()).hexdigest()
 
 
+class NzfsumCache(object):
+
+    """
+    nzfsum of every zone, persisted as json beside the zone file so that
+    the zone names are only hashed once. the entries of the zones that were
+    not looked up since the cache was loaded are dropped when it is saved
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.sums = {}
+        self.used = set()
+        self.dirty = False
+
+        try:
+            with open(path) as f:
+                self.sums = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def get(self, zone):
+        zone = absolute(zone)
+        self.used.add(zone)
+
+        try:
+            return self.sums[zone]
+        except KeyError:
+            self.sums[zone] = nzfsum(zone)
+            self.dirty = True
+            return self.sums[zone]
+
+    def save(self):
+        if len(self.used) != len(self.sums):
+            self.sums = {zone: self.sums[zone] for zone in self.used}
+            self.dirty = True
+
+        self.used = set()
+
+        if not self.dirty:
+            return
+
+        # the cache is only an optimization, failing to write it is not an
+        # error
+        try:
+            atomic_write(self.path, lambda f: json.dump(self.sums, f))
+            self.dirty = False
+        except OSError:
+            pass
+
+
+class Timings(object):
+
+    """wall clock time spent in each phase of a synchronization"""
+
+    def __init__(self):
+        self.phases = []
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - start))
+
+    def reset(self):
+        self.phases = []
+
+    def report(self, stream=None):
+        stream = stream or sys.stderr
+        for name, seconds in self.phases:
+            print("{:<24} {:>10.3f}s".format(name, seconds), file=stream)
+        total = sum(seconds for _, seconds in self.phases)
+        print("{:<24} {:>10.3f}s".format('total', total), file=stream)
+
+
+timings = Timings()
+
+_nzfsums = None
+_templates = {}
+
+
+def nzfsums():
+    global _nzfsums
+
+    if _nzfsums is None:
+        directory, name = os.path.split(config.get('DEFAULT', 'zone_file'))
+        path = os.path.join(directory, '.{}.nzfsum.json'.format(name))
+        _nzfsums = NzfsumCache(path)
+
+    return _nzfsums
+
+
+def zone_template(path):
+    """
+    load the zone template, the compiled template is cached in memory and
+    as bytecode beside the zone file so it is only compiled once
+    """
+    if path not in _templates:
+        directory = os.path.dirname(config.get('DEFAULT', 'zone_file'))
+        environment = jinja2.Environment(
+            loader=jinja2.FileSystemLoader(os.path.dirname(path)),
+            bytecode_cache=jinja2.FileSystemBytecodeCache(
+                directory, '.%s.jinja2.cache'),
+        )
+        _templates[path] = environment.get_template(os.path.basename(path))
+
+    return _templates[path]
+
+
+def atomic_write(path, write, mode=0o600):
+    """
+    call write with a temporary file in the directory of path and move the
+    file into place once it is complete
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                               suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            write(f)
+        os.chmod(tmp, mode)
+        os.rename(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
 def synchronize_catalog_zone():
     # use pdnsutil list-all-zones command to get all the zones
     # and then convert that list into an array
-    all_zones = check_output('/usr/bin/pdnsutil list-all-zones'.split(' '))
-    all_zones = all_zones.split()
+    with timings.phase('list zones'):
+        all_zones = check_output(['/usr/bin/pdnsutil', 'list-all-zones'],
+                                 universal_newlines=True)
+        all_zones = all_zones.split()
 
     # loop over the array of zones and turn it into an array of hashes that
     # include the zone name and its nzf (new zone file) hash sum
     zones = []
     catalog_zone = config.get('DEFAULT', 'zone')
-    for zone in all_zones:
-        # don't include the catalog zone in the list of zones to be included
-        # in the catalog zone
-        if zone == catalog_zone:
-            continue
-        zones.append({'zone': zone, 'nzfsum': nzfsum(zone)})
+    with timings.phase('nzfsum'):
+        sums = nzfsums()
+        for zone in all_zones:
+            # don't include the catalog zone in the list of zones to be
+            # included in the catalog zone
+            if absolute(zone) == absolute(catalog_zone):
+                continue
+            zones.append({'zone': zone.rstrip('.'), 'nzfsum': sums.get(zone)})
+        sums.save()
+
+    # the serial only changes with the content of the catalog zone so that
+    # loading the same zones again does not trigger transfers
+    with timings.phase('read catalog zone'):
+        current = list_catalog_zone(catalog_zone)
+
+    wanted = {
+        member_name(z['zone'], catalog_zone): absolute(z['zone'])
+        for z in zones
+    }
 
-    # parse the jinja2 zone template
-    catalog_zone_tmpl = config.get('DEFAULT', 'zone_template')
-    with open(catalog_zone_tmpl) as tmpl:
-        template = Template(tmpl.read())
+    if current is None:
+        serial = 1
+    else:
+        serial, members = current
+        if members == wanted:
+            return False
+        serial = next_serial(serial or 0)
 
-    # render the zone file
-    serial = int(time.time())
+    # load the precompiled jinja2 zone template
+    with timings.phase('load template'):
+        template = zone_template(config.get('DEFAULT', 'zone_template'))
+
+    # render the zone file, streaming it into a temporary file which replaces
+    # the zone file once it is complete
     catalog_zone_file = config.get('DEFAULT', 'zone_file')
-    with open(catalog_zone_file, 'w') as f:
-        f.write(template.render(zone=catalog_zone, zones=zones, serial=serial))
+    with timings.phase('render zone file'):
+        stream = template.stream(zone=catalog_zone, zones=zones,
+                                 serial=serial)
+        atomic_write(catalog_zone_file, stream.dump, mode=0o644)
 
     # load the zone file using pdnsutil
-    load_zone = "/usr/bin/pdnsutil load-zone {zone} {zone_file}"
-    load_zone = load_zone.format(zone=catalog_zone,
-                                 zone_file=catalog_zone_file)
-    call(load_zone.split(' '))
+    with timings.phase('load zone'):
+        call(['/usr/bin/pdnsutil', 'load-zone', catalog_zone,
+              catalog_zone_file])
+
+    return True
+
+
+def list_catalog_zone(catalog_zone):
+    """
+    return the serial and the members of the catalog zone as loaded in pdns
+    or None if the zone does not exist
+    """
+    result = run(['/usr/bin/pdnsutil', 'list-zone', catalog_zone],
+                 stdout=PIPE, stderr=PIPE, universal_newlines=True)
+
+    if result.returncode != 0:
+        return None
+
+    serial = None
+    rrsets = {}
+
+    for line in result.stdout.splitlines():
+        fields = line.split(None, 4)
+        if len(fields) != 5 or fields[2] != 'IN':
+            continue
+
+        name, _, _, rtype, content = fields
+        if rtype == 'SOA':
+            serial = int(content.split()[2])
+        rrsets.setdefault((absolute(name), rtype), []).append(content)
+
+    rrsets = [
+        {
+            'name': name,
+            'type': rtype,
+            'records': [{'content': content} for content in contents],
+        }
+        for (name, rtype), contents in rrsets.items()
+    ]
+
+    return serial, catalog_members(rrsets, catalog_zone)
+
+
+def next_serial(serial):
+    """the serial following serial in rfc 1982 arithmetic, skipping 0"""
+    return serial + 1 if serial < 0xffffffff else 1
+
+
+class PowerDNSAPI(object):
+
+    """minimal client of the pdns http api"""
+
+    def __init__(self, url, key, server_id='localhost', timeout=10):
+        self.url = '{}/api/v1/servers/{}'.format(url.rstrip('/'), server_id)
+        self.key = key
+        self.timeout = timeout
+
+    def request(self, method, path, body=None):
+        data = None
+        headers = {'X-API-Key': self.key, 'Accept': 'application/json'}
+
+        if body is not None:
+            data = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+
+        request = urllib.request.Request(self.url + path, data=data,
+                                         headers=headers, method=method)
+
+        with urllib.request.urlopen(request, timeout=self.timeout) as r:
+            content = r.read()
+
+        return json.loads(content.decode()) if content else None
+
+    def zones(self):
+        return [zone['name'] for zone in self.request('GET', '/zones')]
+
+    def zone(self, zone):
+        """return the zone with its rrsets or None if it does not exist"""
+        try:
+            return self.request('GET', '/zones/{}'.format(zone))
+        except urllib.error.HTTPError as e:
+            if e.code in [404, 422]:
+                return None
+            raise
+
+    def create_zone(self, zone, rrsets):
+        body = {'name': zone, 'kind': 'Native', 'rrsets': rrsets}
+        return self.request('POST', '/zones', body)
+
+    def patch_rrsets(self, zone, rrsets):
+        body = {'rrsets': rrsets}
+        return self.request('PATCH', '/zones/{}'.format(zone), body)
+
+
+def absolute(name):
+    return name if name.endswith('.') else name + '.'
+
+
+def member_name(zone, catalog_zone):
+    return '{}.zones.{}'.format(nzfsums().get(zone), absolute(catalog_zone))
+
+
+def catalog_members(rrsets, catalog_zone):
+    """return the zones listed in the catalog zone by their ptr owner name"""
+    suffix = '.zones.' + absolute(catalog_zone)
+    members = {}
+
+    for rrset in rrsets:
+        if rrset['type'] != 'PTR' or not rrset['name'].endswith(suffix):
+            continue
+        for record in rrset['records']:
+            members[rrset['name']] = record['content']
+
+    return members
+
+
+def catalog_diff(members, zones, catalog_zone):
+    """
+    compare the catalog members with the zones that should be listed in
+    the catalog zone and return the owner names to add (with the zone they
+    point to) and the owner names to remove
+    """
+    wanted = {
+        member_name(zone, catalog_zone): absolute(zone)
+        for zone in zones
+        if absolute(zone) != absolute(catalog_zone)
+    }
+
+    added = {
+        name: zone for name, zone in wanted.items()
+        if members.get(name) != zone
+    }
+    removed = sorted(name for name in members if name not in wanted)
+
+    return added, removed
+
+
+def rrset(name, rtype, content):
+    return {
+        'name': name,
+        'type': rtype,
+        'ttl': CATALOG_TTL,
+        'records': [{'content': content, 'disabled': False}],
+    }
+
+
+def bump_serial(soa):
+    """return the soa record content with its serial bumped"""
+    fields = soa.split()
+    fields[2] = str(next_serial(int(fields[2])))
+    return ' '.join(fields)
+
+
+def catalog_rrsets(catalog_zone, zones, serial):
+    """rrsets of a new catalog zone, the same records as catalog-zone.j2"""
+    origin = absolute(catalog_zone)
+
+    rrsets = [
+        rrset(origin, 'SOA', '. . {} 3600 3600 86400 3600'.format(serial)),
+        rrset(origin, 'NS', 'nop.'),
+        rrset('version.' + origin, 'TXT', '"1"'),
+    ]
+
+    added, _ = catalog_diff({}, zones, catalog_zone)
+    for name, zone in sorted(added.items()):
+        rrsets.append(rrset(name, 'PTR', zone))
+
+    return rrsets
+
+
+def pdns_api():
+    return PowerDNSAPI(config.get('DEFAULT', 'api_url'),
+                       config.get('DEFAULT', 'api_key'),
+                       config.get('DEFAULT', 'server_id',
+                                  fallback='localhost'))
+
+
+def synchronize_catalog_zone_incremental(api=None, zones=None):
+    """
+    synchronize the catalog zone through the pdns api, only adding and
+    removing the ptr records of the zones that changed. the soa serial is
+    bumped in the same patch and left alone when nothing changed. returns
+    the owner names that were added and removed
+    """
+    api = api or pdns_api()
+    catalog_zone = absolute(config.get('DEFAULT', 'zone'))
+
+    with timings.phase('list zones'):
+        if zones is None:
+            zones = api.zones()
+
+    with timings.phase('read catalog zone'):
+        catalog = api.zone(catalog_zone)
+
+    if catalog is None:
+        with timings.phase('create catalog zone'):
+            rrsets = catalog_rrsets(catalog_zone, zones, 1)
+            api.create_zone(catalog_zone, rrsets)
+        nzfsums().save()
+        return sorted(rrset['name'] for rrset in rrsets
+                      if rrset['type'] == 'PTR'), []
+
+    with timings.phase('diff'):
+        rrsets = catalog.get('rrsets', [])
+        members = catalog_members(rrsets, catalog_zone)
+        added, removed = catalog_diff(members, zones, catalog_zone)
+        nzfsums().save()
+
+    if not added and not removed:
+        return [], []
+
+    changes = []
+
+    for name, zone in sorted(added.items()):
+        change = rrset(name, 'PTR', zone)
+        change['changetype'] = 'REPLACE'
+        changes.append(change)
+
+    for name in removed:
+        changes.append({'name': name, 'type': 'PTR', 'changetype': 'DELETE'})
+
+    for soa in rrsets:
+        if soa['type'] == 'SOA' and soa['name'] == catalog_zone:
+            change = rrset(catalog_zone, 'SOA',
+                           bump_serial(soa['records'][0]['content']))
+            change['changetype'] = 'REPLACE'
+            changes.append(change)
+
+    with timings.phase('patch catalog zone'):
+        api.patch_rrsets(catalog_zone, changes)
+
+    return sorted(added), removed
+
+
+class FileLock(object):
+
+    """leadership held through an exclusive lock on a local file"""
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+
+    def acquire(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+
+        self.fd = fd
+        return True
+
+    def release(self):
+        if self.fd is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+            self.fd = None
+
+
+class EtcdLease(object):
+
+    """
+    leadership held through a key attached to an etcd lease, using the json
+    gateway of the etcd v3 api. the key is only created when it does not
+    exist, so a single node holds it until it releases it or the lease
+    expires because the node went away in the middle of a synchronization.
+    while it is held the lease is kept alive every third of its ttl, so a
+    synchronization may take longer than the ttl
+    """
+
+    def __init__(self, endpoints, key, ttl=60, cacert=None, cert=None,
+                 cert_key=None, api='/v3beta', timeout=5):
+        self.endpoints = endpoints
+        self.key = key
+        self.ttl = ttl
+        self.api = api
+        self.timeout = timeout
+        self.lease = None
+        self.lost = False
+        self.released = threading.Event()
+        self.keepalive_thread = None
+
+        self.ssl_context = ssl.create_default_context(cafile=cacert)
+        if cert is not None:
+            self.ssl_context.load_cert_chain(cert, cert_key)
+
+    def request(self, path, body):
+        """send the request to the first endpoint that answers"""
+        error = None
+
+        for endpoint in self.endpoints:
+            request = urllib.request.Request(
+                '{}{}{}'.format(endpoint.rstrip('/'), self.api, path),
+                data=json.dumps(body).encode(),
+                headers={'Content-Type': 'application/json'},
+                method='POST')
+
+            context = None
+            if endpoint.startswith('https:'):
+                context = self.ssl_context
+
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout,
+                                            context=context) as r:
+                    return json.loads(r.read().decode())
+            except urllib.error.HTTPError:
+                raise
+            except (urllib.error.URLError, OSError) as e:
+                error = e
+
+        raise error
+
+    @staticmethod
+    def encode(value):
+        return base64.b64encode(value.encode()).decode()
+
+    def acquire(self):
+        lease = self.request('/lease/grant', {'TTL': self.ttl})['ID']
+
+        # create the key unless another node already holds it
+        key = self.encode(self.key)
+        txn = self.request('/kv/txn', {
+            'compare': [{
+                'key': key,
+                'result': 'EQUAL',
+                'target': 'CREATE',
+                'create_revision': '0',
+            }],
+            'success': [{
+                'request_put': {
+                    'key': key,
+                    'value': self.encode(socket.getfqdn()),
+                    'lease': lease,
+                },
+            }],
+        })
+
+        if not txn.get('succeeded'):
+            self.request('/kv/lease/revoke', {'ID': lease})
+            return False
+
+        self.lease = lease
+        self.lost = False
+        self.released.clear()
+        self.keepalive_thread = threading.Thread(target=self.keepalive,
+                                                 args=(lease,), daemon=True)
+        self.keepalive_thread.start()
+        return True
+
+    def keepalive(self, lease):
+        while not self.released.wait(self.ttl / 3.0):
+            try:
+                response = self.request('/lease/keepalive', {'ID': lease})
+            except (urllib.error.URLError, OSError, ValueError) as e:
+                print("keeping the etcd lease alive failed: {}".format(e),
+                      file=sys.stderr, flush=True)
+                continue
+
+            # the gateway omits the ttl of an expired lease
+            if int(response.get('result', response).get('TTL', 0)) <= 0:
+                self.lost = True
+                print("etcd lease expired, leadership lost",
+                      file=sys.stderr, flush=True)
+                return
+
+    def release(self):
+        self.released.set()
+        if self.keepalive_thread is not None:
+            self.keepalive_thread.join()
+            self.keepalive_thread = None
+
+        # revoking the lease deletes the key
+        if self.lease is not None:
+            self.request('/kv/lease/revoke', {'ID': self.lease})
+            self.lease = None
+
+
+class NoLock(object):
+
+    def acquire(self):
+        return True
+
+    def release(self):
+        pass
+
+
+class FallbackLock(object):
+
+    """
+    a lock that falls back to another one when it can not be reached, e.g.
+    to a local file lock when etcd is down
+    """
+
+    def __init__(self, lock, fallback):
+        self.lock = lock
+        self.fallback = fallback
+
+    def acquire(self):
+        try:
+            return self.lock.acquire()
+        except urllib.error.HTTPError:
+            raise
+        except (urllib.error.URLError, OSError) as e:
+            msg = "warning: lock unavailable ({}), using {} instead"
+            print(msg.format(e, type(self.fallback).__name__),
+                  file=sys.stderr, flush=True)
+            self.lock = self.fallback
+            return self.lock.acquire()
+
+    def release(self):
+        self.lock.release()
+
+
+def catalog_zone_lock(fallback=False):
+    """
+    the lock a node has to hold to synchronize the catalog zone, the lock
+    option selects between etcd, file and none. with fallback, a one-shot
+    synchronization does not fail when etcd is unreachable but takes the
+    local lock_file (if configured) instead
+    """
+    backend = config.get('DEFAULT', 'lock', fallback='none')
+
+    if backend == 'etcd':
+        endpoints = config.get('DEFAULT', 'etcd_endpoints').split(',')
+        lock = EtcdLease(
+            [endpoint.strip() for endpoint in endpoints],
+            config.get('DEFAULT', 'lock_key',
+                       fallback='/catalog-zone/leader'),
+            ttl=config.getint('DEFAULT', 'lock_ttl', fallback=60),
+            cacert=config.get('DEFAULT', 'etcd_cacert', fallback=None),
+            cert=config.get('DEFAULT', 'etcd_cert', fallback=None),
+            cert_key=config.get('DEFAULT', 'etcd_key', fallback=None),
+        )
+
+        if not fallback:
+            return lock
+
+        lock_file = config.get('DEFAULT', 'lock_file', fallback=None)
+        local = FileLock(lock_file) if lock_file else NoLock()
+        return FallbackLock(lock, local)
+
+    if backend == 'file':
+        return FileLock(config.get('DEFAULT', 'lock_file'))
+
+    if backend == 'none':
+        return NoLock()
+
+    msg = "unknown lock backend {}"
+    raise ValueError(msg.format(backend))
+
+
+@contextlib.contextmanager
+def leadership(lock):
+    """yield whether this node holds the lock and may synchronize"""
+    acquired = lock.acquire()
+
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            lock.release()
+
+
+class CatalogZoneWatcher(object):
+
+    """
+    poll the list of zones through the pdns api and synchronize the catalog
+    zone when it changes. the changes seen within the debounce window that
+    starts with the first change are applied together. polling and failed
+    synchronizations back off exponentially up to max_interval. a node that
+    does not hold the lock keeps trying until it holds it and finds the
+    catalog zone up to date, so the changes are not lost when the leader
+    fails to apply them
+    """
+
+    def __init__(self, api, interval=2, debounce=5, max_interval=60,
+                 stats_file=None, lock=None):
+        self.api = api
+        self.lock = lock or NoLock()
+        self.interval = interval
+        self.debounce = debounce
+        self.max_interval = max_interval
+        self.stats_file = stats_file
+        self.stopped = False
+
+        self.counters = {
+            'polls': 0,
+            'poll_errors': 0,
+            'syncs': 0,
+            'sync_errors': 0,
+            'syncs_skipped': 0,
+            'release_errors': 0,
+            'zones_added': 0,
+            'zones_removed': 0,
+            'last_sync_latency': None,
+            'max_sync_latency': None,
+            'total_sync_latency': 0.0,
+            'last_sync': None,
+        }
+
+    def stop(self, *args):
+        self.stopped = True
+
+    def sleep(self, seconds):
+        deadline = time.monotonic() + seconds
+        while not self.stopped and time.monotonic() < deadline:
+            time.sleep(min(deadline - time.monotonic(), 0.5))
+
+    def poll(self):
+        self.counters['polls'] += 1
+        catalog_zone = absolute(config.get('DEFAULT', 'zone'))
+        zones = frozenset(absolute(zone) for zone in self.api.zones())
+        return zones - {catalog_zone}
+
+    def backoff(self, delay):
+        return min(delay * 2, self.max_interval)
+
+    def sync(self, zones, changed_at):
+        """
+        apply the changes and return whether they were applied, False when
+        another node holds the lock. errors of the synchronization are
+        raised, errors releasing the lock afterwards are only counted
+        """
+        timings.reset()
+
+        if not self.lock.acquire():
+            self.counters['syncs_skipped'] += 1
+            return False
+
+        try:
+            added, removed = synchronize_catalog_zone_incremental(
+                self.api, sorted(zones))
+        finally:
+            try:
+                self.lock.release()
+            except (urllib.error.URLError, OSError, ValueError) as e:
+                self.counters['release_errors'] += 1
+                msg = "releasing the catalog zone lock failed: {}"
+                print(msg.format(e), flush=True)
+
+        # the latency covers the debounce window, from the first change seen
+        # until the catalog zone was updated
+        latency = time.monotonic() - changed_at
+        counters = self.counters
+        counters['syncs'] += 1
+        counters['zones_added'] += len(added)
+        counters['zones_removed'] += len(removed)
+        counters['last_sync_latency'] = latency
+        counters['max_sync_latency'] = max(counters['max_sync_latency'] or 0,
+                                           latency)
+        counters['total_sync_latency'] += latency
+        counters['last_sync'] = time.time()
+
+        if added or removed:
+            msg = "catalog zone: {} added, {} removed in {:.2f}s"
+            print(msg.format(len(added), len(removed), latency), flush=True)
+
+        return True
+
+    def write_stats(self):
+        if self.stats_file is None:
+            return
+
+        tmp = '{}.tmp'.format(self.stats_file)
+        with open(tmp, 'w') as f:
+            json.dump(self.counters, f, indent=2, sort_keys=True)
+        os.rename(tmp, self.stats_file)
+
+    def run(self):
+        # the catalog zone is synchronized once at startup, whatever changed
+        # while nobody was watching is applied then
+        synced = None
+        changed_at = None
+        delay = self.interval
+        sync_delay = self.interval
+
+        while not self.stopped:
+            try:
+                zones = self.poll()
+            except (urllib.error.URLError, OSError, ValueError) as e:
+                self.counters['poll_errors'] += 1
+                delay = self.backoff(delay)
+                msg = "polling zones failed, retrying in {}s: {}"
+                print(msg.format(delay, e), flush=True)
+                self.write_stats()
+                self.sleep(delay)
+                continue
+
+            delay = self.interval
+
+            if zones == synced:
+                changed_at = None
+            elif changed_at is None:
+                changed_at = time.monotonic()
+
+            if changed_at is not None and \
+                    time.monotonic() - changed_at >= self.debounce:
+                try:
+                    if self.sync(zones, changed_at):
+                        synced = zones
+                        changed_at = None
+                    sync_delay = self.interval
+                except (urllib.error.URLError, OSError, ValueError) as e:
+                    self.counters['sync_errors'] += 1
+                    sync_delay = self.backoff(sync_delay)
+                    msg = "catalog zone sync failed, retrying in {}s: {}"
+                    print(msg.format(sync_delay, e), flush=True)
+                    self.write_stats()
+                    self.sleep(sync_delay)
+                    continue
+                self.write_stats()
+
+            self.sleep(self.interval)
 
 
 def main():
@@ -76,15 +855,97 @@ def main():
         help="synchronize catalog zone"
     )
 
+    parser.add_argument(
+        "--incremental",
+        action='store_true',
+        help="only add and remove the changed zones through the pdns api "
+             "instead of reloading the whole catalog zone"
+    )
+
+    parser.add_argument(
+        "--watch",
+        action='store_true',
+        help="keep polling the pdns api and incrementally synchronize the "
+             "catalog zone whenever zones are added or removed"
+    )
+
+    parser.add_argument(
+        "--interval",
+        default=2,
+        type=float,
+        help="seconds between two polls in watch mode (default: %(default)s)"
+    )
+
+    parser.add_argument(
+        "--max-interval",
+        default=60,
+        type=float,
+        help="longest backoff between two failed polls in watch mode "
+             "(default: %(default)s)"
+    )
+
+    parser.add_argument(
+        "--debounce",
+        default=5,
+        type=float,
+        help="seconds during which changes are batched before they are "
+             "applied in watch mode (default: %(default)s)"
+    )
+
+    parser.add_argument(
+        "--stats-file",
+        help="path of the json file the watch mode counters are written to"
+    )
+
+    parser.add_argument(
+        "--benchmark",
+        action='store_true',
+        help="print the time spent in each phase of the synchronization"
+    )
+
+    parser.add_argument(
+        "--config",
+        default=CONFIG_FILE,
+        help="path to the configuration file (default: %(default)s)"
+    )
+
     args = parser.parse_args()
 
-    if len(sys.argv) <= 1:
+    if not args.sync and not args.watch:
         parser.print_usage()
         sys.exit(1)
 
+    config.read(args.config)
+
+    if args.watch:
+        watcher = CatalogZoneWatcher(pdns_api(),
+                                     interval=args.interval,
+                                     debounce=args.debounce,
+                                     max_interval=args.max_interval,
+                                     stats_file=args.stats_file,
+                                     lock=catalog_zone_lock())
+
+        signal.signal(signal.SIGTERM, watcher.stop)
+        signal.signal(signal.SIGINT, watcher.stop)
+
+        watcher.run()
+        sys.exit(0)
+
     if args.sync:
         try:
-            synchronize_catalog_zone()
+            with leadership(catalog_zone_lock(fallback=True)) as leader:
+                if not leader:
+                    print("catalog zone is being synchronized by another "
+                          "node, skipping")
+                    sys.exit(0)
+                elif args.incremental:
+                    added, removed = synchronize_catalog_zone_incremental()
+                    msg = "catalog zone: {} added, {} removed"
+                    print(msg.format(len(added), len(removed)))
+                elif not synchronize_catalog_zone():
+                    print("catalog zone unchanged")
+            if args.benchmark:
+                timings.report()
             sys.exit(0)
         except Exception as e:
             print(e)
@@ -23,17 +23,50 @@ execute 'wait for flavors' do
   command 'openstack flavor list'
 end
 
-node['bcpc']['openstack']['flavors'].each do |flavor, spec|
+# install the reconciler that creates the missing flavors, it lists the
+# existing flavors once instead of running a flavor show for each of them
+directory '/usr/local/lib/os-reconcile' do
+  action :create
+end
+
+cookbook_file '/usr/local/lib/os-reconcile/os-reconcile' do
+  source 'openstack/os-reconcile.py'
+  mode '0755'
+end
+
+cookbook_file '/usr/local/lib/os-reconcile/openstack_session.py' do
+  source 'openstack/openstack_session.py'
+  mode '0644'
+end
+
+link '/usr/local/bin/os-reconcile' do
+  to '/usr/local/lib/os-reconcile/os-reconcile'
+end
+
+directory '/usr/local/etc/os-reconcile' do
+  action :create
+end
+
+flavors = node['bcpc']['openstack']['flavors'].reject do |flavor, _spec|
   # skip over the boolean we use to enable/disable this recipe
-  next if flavor == 'enabled'
-  execute "create #{flavor} flavor" do
-    environment os_adminrc
-    command <<-DOC
-      openstack flavor create "#{flavor}" \
-        --vcpus #{spec['vcpus']} \
-        --ram #{spec['ram']} \
-        --disk #{spec['disk']}
-    DOC
-    not_if "openstack flavor show #{flavor}"
-  end
+  flavor == 'enabled'
+end
+
+file '/usr/local/etc/os-reconcile/flavors.json' do
+  content JSON.pretty_generate(
+    'flavors' => flavors.map do |flavor, spec|
+      {
+        'name' => flavor,
+        'vcpus' => spec['vcpus'],
+        'ram' => spec['ram'],
+        'disk' => spec['disk'],
+      }
+    end
+  )
+end
+
+execute 'create flavors' do
+  environment os_adminrc
+  command 'os-reconcile /usr/local/etc/os-reconcile/flavors.json'
+  not_if 'os-reconcile --check /usr/local/etc/os-reconcile/flavors.json'
 end
@@ -161,6 +161,7 @@ end
 cookbook_file '/usr/local/sbin/catalog-zone-manage' do
   source 'powerdns/catalog-zone-manage.py'
   mode '0755'
+  notifies :restart, 'service[catalog-zone-manage]', :delayed
 end
 
 directory '/usr/local/lib/catalog-zone' do
@@ -177,17 +178,45 @@ end
 
 template '/usr/local/etc/catalog-zone/catalog-zone.conf' do
   source 'powerdns/catalog-zone.conf.erb'
+  mode '0600'
 
   zone = "catalog.#{node['bcpc']['cloud']['domain']}"
+  webserver = node['bcpc']['powerdns']['webserver']
 
   variables(
     zone: zone,
     zone_file: "#{Chef::Config[:file_cache_path]}/#{zone}.zone",
-    zone_template: '/usr/local/lib/catalog-zone/zone.j2'
+    zone_template: '/usr/local/lib/catalog-zone/zone.j2',
+    api_url: "http://#{webserver['address']}:#{webserver['port']}",
+    api_key: config['powerdns']['creds']['api']['key'],
+    etcd_endpoints: ['https://127.0.0.1:2379'],
+    lock_ttl: node['bcpc']['powerdns']['catalog_zone']['lock_ttl']
   )
+
+  notifies :restart, 'service[catalog-zone-manage]', :delayed
 end
 
-# create/synchronize the catalog zone
+# create/synchronize the catalog zone once now, the catalog-zone-manage
+# service keeps it up to date when zones are added or removed afterwards
 execute 'sync catalog zone' do
-  command '/usr/local/sbin/catalog-zone-manage --sync'
+  command '/usr/local/sbin/catalog-zone-manage --sync --incremental'
+end
+
+template '/etc/systemd/system/catalog-zone-manage.service' do
+  source 'powerdns/catalog-zone-manage.service.erb'
+  variables(
+    watch: node['bcpc']['powerdns']['catalog_zone']['watch']
+  )
+
+  notifies :run, 'execute[reload systemd]', :immediately
+  notifies :restart, 'service[catalog-zone-manage]', :delayed
+end
+
+execute 'reload systemd' do
+  action :nothing
+  command 'systemctl daemon-reload'
+end
+
+service 'catalog-zone-manage' do
+  action [:enable, :start]
 end
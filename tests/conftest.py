@@ -0,0 +1,98 @@
+import importlib.util
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_script(path):
+    """import a helper script of the repository by its path"""
+    name = os.path.splitext(os.path.basename(path))[0].replace('-', '_')
+    spec = importlib.util.spec_from_file_location(
+        name, os.path.join(ROOT, path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+
+    """
+    request handler of the fake api servers, subclasses implement
+    handle_request(method, path, body) returning a status and a json body
+    """
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self, method):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+
+        # chunked uploads are handed over as the concatenated chunks
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            body = b''
+            while True:
+                line = self.rfile.readline().strip()
+                # the client gave up on the upload
+                if not line:
+                    self.close_connection = True
+                    return
+                size = int(line, 16)
+                chunk = self.rfile.read(size + 2)[:size]
+                if not size:
+                    break
+                body += chunk
+
+        self.server.requests.append((method, self.path))
+        status, data, headers = self.handle_request(method, self.path, body)
+
+        data = b'' if data is None else json.dumps(data).encode()
+        self.send_response(status)
+        for header, value in (headers or {}).items():
+            self.send_header(header, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self.respond('GET')
+
+    def do_POST(self):
+        self.respond('POST')
+
+    def do_PUT(self):
+        self.respond('PUT')
+
+    def do_PATCH(self):
+        self.respond('PATCH')
+
+    def do_DELETE(self):
+        self.respond('DELETE')
+
+
+@pytest.fixture
+def fake_server():
+    """start fake servers for handler classes and return their url"""
+    servers = []
+
+    def start(handler):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        server.requests = []
+        servers.append(server)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server, 'http://127.0.0.1:{}'.format(server.server_port)
+
+    yield start
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,89 @@
+import sys
+
+import pytest
+
+from conftest import load_script
+
+
+@pytest.fixture
+def bench():
+    """the stub cinder modules of the benchmark, removed after the test"""
+    bench = load_script('benchmarks/access_filter.py')
+    modules = dict(sys.modules)
+
+    yield bench
+
+    for name in list(sys.modules):
+        if name not in modules:
+            del sys.modules[name]
+        else:
+            sys.modules[name] = modules[name]
+
+
+@pytest.fixture
+def database(bench):
+    database = bench.StubDatabase()
+    bench.install_stubs(database)
+
+    for i in range(10):
+        name = 'private-{}'.format(i)
+        database.types[name] = {'id': i, 'name': name, 'is_public': False}
+        database.access[i] = [bench.AccessRow(i, 'p{}'.format(i))]
+    database.types['public'] = {'id': 10, 'name': 'public',
+                                'is_public': True}
+
+    return database
+
+
+@pytest.fixture
+def module(bench, database):
+    return bench.load_access_filter()
+
+
+def schedule(bench, module, project_id, pools):
+    backends = [bench.BackendState(name) for name in pools]
+    return [backend.pool_name
+            for backend in bench.schedule(module.AccessFilter(), backends,
+                                          project_id)]
+
+
+def test_only_candidate_access_lists_are_read(bench, module, database):
+    module._cache = module.AccessCache(ttl=0)
+
+    pools = ['private-1', 'private-2', 'public']
+    assert schedule(bench, module, 'p2', pools) == ['private-2']
+
+    # the types and the access lists of the two private candidates
+    assert database.calls == 3
+
+
+def test_grant_then_schedule(bench, module, database):
+    pools = ['private-1', 'private-2']
+    assert schedule(bench, module, 'p2', pools) == ['private-2']
+
+    # the project is granted access right before creating its volume,
+    # within the cache ttl
+    database.access[1].append(bench.AccessRow(1, 'p2'))
+    calls = database.calls
+
+    assert schedule(bench, module, 'p2', pools) == ['private-1', 'private-2']
+
+    # a single reload, the types and the access lists read again
+    assert database.calls - calls == 3
+
+
+def test_denials_reload_once_per_request(bench, module, database):
+    pools = ['private-{}'.format(i) for i in range(10)]
+    assert schedule(bench, module, 'p2', pools) == ['private-2']
+
+    # the snapshot was taken for this request, it is not reloaded
+    assert database.calls == 11
+
+    assert schedule(bench, module, 'p3', pools) == ['private-3']
+    assert database.calls == 22
+
+    # a revoked access is seen when the snapshot expires, or is reloaded
+    # because another candidate was denied
+    database.access[3] = []
+    assert schedule(bench, module, 'p3', ['private-3']) == ['private-3']
+    assert schedule(bench, module, 'p3', pools) == []
@@ -0,0 +1,212 @@
+import base64
+import copy
+import glob
+import os
+import re
+import sys
+
+import pytest
+from Crypto.PublicKey import RSA
+from cryptography import x509
+from OpenSSL import crypto
+
+from conftest import ROOT
+
+sys.path.insert(0, os.path.join(ROOT, 'virtual', 'bin'))
+
+from lib.bcc_chef_databags import BCCChefDatabags  # noqa: E402
+
+
+def databag(databags, name):
+    return next(databag for databag in databags['chef_databags']
+                if databag['id'] == name)
+
+
+def certificate(value):
+    return x509.load_pem_x509_certificate(base64.b64decode(value))
+
+
+def private_key(value):
+    return crypto.load_privatekey(crypto.FILETYPE_PEM,
+                                  base64.b64decode(value))
+
+
+def public_key(key):
+    return crypto.dump_publickey(crypto.FILETYPE_PEM, key)
+
+
+def certificate_public_key(cert):
+    return public_key(crypto.PKey.from_cryptography_key(cert.public_key()))
+
+
+@pytest.fixture(scope='module')
+def generated():
+    return BCCChefDatabags().generate()
+
+
+@pytest.fixture
+def existing(generated):
+    return copy.deepcopy(generated)
+
+
+def test_merge_keeps_etcd_certificates_signed_by_the_ca(existing):
+    config = databag(existing, 'config')
+    del config['etcd']['ssl']['server']
+
+    ssl = databag(BCCChefDatabags().merge(existing), 'config')['etcd']['ssl']
+
+    ca = certificate(ssl['ca']['crt'])
+
+    for name in ['server', 'client-ro', 'client-rw']:
+        cert = certificate(ssl[name]['crt'])
+        cert.verify_directly_issued_by(ca)
+        assert certificate_public_key(cert) == \
+            public_key(private_key(ssl[name]['key']))
+
+
+def test_merge_keeps_ssh_key_pair_matching(existing):
+    config = databag(existing, 'config')
+    public = config['nova']['ssh']['crt']
+    del config['nova']['ssh']['key']
+
+    ssh = databag(BCCChefDatabags().merge(existing), 'config')['nova']['ssh']
+    key = RSA.import_key(base64.b64decode(ssh['key']))
+
+    assert key.publickey().exportKey('OpenSSH') == \
+        base64.b64decode(ssh['crt'])
+    assert ssh['crt'] != public
+
+
+def test_merge_keeps_values_of_complete_components(existing):
+    config = databag(existing, 'config')
+    del config['apache']['status']['password']
+
+    merged = databag(BCCChefDatabags().merge(existing), 'config')
+
+    assert merged['ssl'] == config['ssl']
+    assert merged['etcd']['ssl'] == config['etcd']['ssl']
+    assert merged['apache']['status']['password']
+
+
+def test_generate_only_keeps_the_selected_sections():
+    databags = BCCChefDatabags().generate(only=['ceph', 'zones'])
+
+    assert [databag['id'] for databag in databags['chef_databags']] == \
+        ['config', 'zones']
+    assert set(databag(databags, 'config')) == {'id', 'ceph'}
+    assert databag(databags, 'config')['ceph']['fsid']
+
+
+def test_generate_only_rejects_unknown_sections():
+    with pytest.raises(ValueError) as e:
+        BCCChefDatabags().generate(only=['ceph', 'bogus'])
+
+    assert 'unknown sections: bogus' in str(e.value)
+    assert 'ceph' in str(e.value).split('valid sections:')[1]
+
+
+def test_rotate_fernet_moves_keys_along_the_schedule(existing):
+    keys = databag(existing, 'config')['keystone']['fernet']['keys']
+
+    rotated, changed = BCCChefDatabags().rotate(existing, ['fernet'])
+    rotated_keys = databag(rotated, 'config')['keystone']['fernet']['keys']
+
+    assert rotated_keys['primary'] == keys['staged']
+    assert rotated_keys['secondary'] == keys['primary']
+    assert rotated_keys['staged'] not in keys.values()
+    assert databag(rotated, 'config')['keystone']['db'] == \
+        databag(existing, 'config')['keystone']['db']
+    assert BCCChefDatabags().recipes(changed) == ['bcpc::keystone']
+
+
+def test_rotate_passwords_keeps_everything_else(existing):
+    config = databag(existing, 'config')
+
+    rotated, changed = BCCChefDatabags().rotate(existing, ['passwords'])
+    rotated_config = databag(rotated, 'config')
+
+    assert rotated_config['glance']['creds']['db']['password'] != \
+        config['glance']['creds']['db']['password']
+    assert rotated_config['glance']['creds']['db']['username'] == 'glance'
+    assert rotated_config['powerdns']['creds']['api'] == \
+        config['powerdns']['creds']['api']
+    assert rotated_config['ceph'] == config['ceph']
+    assert rotated_config['etcd'] == config['etcd']
+    assert rotated_config['keystone'] == config['keystone']
+    assert all(path[-1] == 'password' and 'creds' in path
+               for path in changed)
+
+    recipes = BCCChefDatabags().recipes(changed)
+    assert 'bcpc::glance' in recipes
+    assert 'bcpc::powerdns' in recipes
+    assert 'bcpc::keystone' not in recipes
+
+
+def test_rotate_etcd_ssl_reissues_the_certificates(existing):
+    ssl = databag(existing, 'config')['etcd']['ssl']
+
+    rotated, changed = BCCChefDatabags().rotate(existing, ['etcd-ssl'])
+    rotated_config = databag(rotated, 'config')
+    rotated_ssl = rotated_config['etcd']['ssl']
+
+    ca = certificate(rotated_ssl['ca']['crt'])
+    for name in ['server', 'client-ro', 'client-rw']:
+        certificate(rotated_ssl[name]['crt']).verify_directly_issued_by(ca)
+        assert rotated_ssl[name] != ssl[name]
+    assert rotated_config['etcd']['users'] == \
+        databag(existing, 'config')['etcd']['users']
+    assert 'bcpc::powerdns' in BCCChefDatabags().recipes(changed)
+
+
+def test_rotate_without_config_databag_raises_value_error(existing):
+    existing['chef_databags'] = [
+        databag for databag in existing['chef_databags']
+        if databag['id'] != 'config'
+    ]
+
+    with pytest.raises(ValueError) as e:
+        BCCChefDatabags().rotate(existing, ['fernet'])
+
+    assert 'chef_databags/config' in str(e.value)
+
+
+def test_rotate_rejects_unknown_targets(existing):
+    with pytest.raises(ValueError):
+        BCCChefDatabags().rotate(existing, ['bogus'])
+
+
+def cookbook_section_recipes(sections):
+    """sections each recipe (or a template it renders) of the cookbook uses"""
+    cookbook = os.path.join(ROOT, 'chef', 'cookbooks', 'bcpc')
+    used = {}
+
+    for path in glob.glob(os.path.join(cookbook, 'recipes', '*.rb')):
+        recipe = os.path.basename(path)[:-len('.rb')]
+        with open(path) as file:
+            text = file.read()
+
+        for source in re.findall(r"source\s+'([^']+\.erb)'", text):
+            template = os.path.join(cookbook, 'templates', 'default', source)
+            if os.path.isfile(template):
+                with open(template) as file:
+                    text += file.read()
+
+        found = set(re.findall(r"config\['([\w-]+)'\]", text))
+        if re.search(r"\['etcd'\]\['(ca|server|client-r[ow])'\]", text):
+            found.add('etcd')
+        if 'ZoneConfig' in text:
+            found.add('zones')
+
+        for section in found & sections:
+            used.setdefault(section, set()).add(recipe)
+
+    return used
+
+
+def test_section_recipes_cover_the_cookbook(generated):
+    sections = {key for databag in generated['chef_databags']
+                for key in databag if key != 'id'} | {'zones'}
+
+    for section, recipes in cookbook_section_recipes(sections).items():
+        missing = recipes - set(BCCChefDatabags.SECTION_RECIPES[section])
+        assert not missing, section
@@ -0,0 +1,623 @@
+import json
+import os
+import socket
+import subprocess
+import time
+import urllib.error
+
+import dns.zone
+import jinja2
+import pytest
+
+from conftest import ROOT, FakeHandler, load_script
+
+
+@pytest.fixture(scope='module')
+def manage():
+    return load_script('chef/cookbooks/bcpc/files/default/powerdns/'
+                       'catalog-zone-manage.py')
+
+
+@pytest.fixture
+def config(manage):
+    saved = dict(manage.config['DEFAULT'])
+    manage.config['DEFAULT'].clear()
+    yield manage.config['DEFAULT']
+    manage.config['DEFAULT'].clear()
+    manage.config['DEFAULT'].update(saved)
+
+
+class EtcdHandler(FakeHandler):
+
+    """leases and keys of the etcd v3 json gateway"""
+
+    def handle_request(self, method, path, body):
+        etcd = self.server
+        body = json.loads(body)
+        now = time.monotonic()
+
+        # expired leases delete the keys attached to them
+        for lease, (ttl, expires) in list(etcd.leases.items()):
+            if expires <= now:
+                del etcd.leases[lease]
+                for key in [k for k, v in etcd.keys.items() if v == lease]:
+                    del etcd.keys[key]
+
+        if path == '/v3beta/lease/grant':
+            etcd.next_lease += 1
+            lease = str(etcd.next_lease)
+            etcd.leases[lease] = (body['TTL'], now + body['TTL'])
+            return 200, {'ID': lease, 'TTL': str(body['TTL'])}, None
+
+        if path == '/v3beta/lease/keepalive':
+            etcd.keepalives += 1
+            if body['ID'] not in etcd.leases:
+                return 200, {'result': {'ID': body['ID']}}, None
+            ttl, _ = etcd.leases[body['ID']]
+            etcd.leases[body['ID']] = (ttl, now + ttl)
+            return 200, {'result': {'ID': body['ID'], 'TTL': str(ttl)}}, None
+
+        if path == '/v3beta/kv/lease/revoke':
+            etcd.leases.pop(body['ID'], None)
+            for key in [k for k, v in etcd.keys.items() if v == body['ID']]:
+                del etcd.keys[key]
+            return 200, {}, None
+
+        if path == '/v3beta/kv/txn':
+            key = body['compare'][0]['key']
+            if key in etcd.keys:
+                return 200, {'succeeded': False}, None
+            etcd.keys[key] = body['success'][0]['request_put']['lease']
+            return 200, {'succeeded': True}, None
+
+        return 404, {}, None
+
+
+@pytest.fixture
+def etcd(fake_server):
+    server, url = fake_server(EtcdHandler)
+    server.leases = {}
+    server.keys = {}
+    server.next_lease = 0
+    server.keepalives = 0
+    return server, url
+
+
+def closed_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def test_lease_is_exclusive(manage, etcd):
+    server, url = etcd
+    first = manage.EtcdLease([url], '/catalog-zone/leader', ttl=10)
+    second = manage.EtcdLease([url], '/catalog-zone/leader', ttl=10)
+
+    assert first.acquire()
+    assert not second.acquire()
+
+    first.release()
+    assert server.keys == {}
+    assert second.acquire()
+    second.release()
+
+
+def test_lease_is_kept_alive_beyond_its_ttl(manage, etcd):
+    server, url = etcd
+    lease = manage.EtcdLease([url], '/catalog-zone/leader', ttl=1)
+
+    assert lease.acquire()
+    time.sleep(2.5)
+
+    assert server.keys and not lease.lost
+    assert server.keepalives >= 3
+    assert not manage.EtcdLease([url], '/catalog-zone/leader').acquire()
+
+    lease.release()
+    assert server.keys == {}
+
+
+def test_lease_endpoints_fall_back(manage, etcd):
+    _, url = etcd
+    dead = 'http://127.0.0.1:{}'.format(closed_port())
+    lease = manage.EtcdLease([dead, url], '/catalog-zone/leader')
+
+    assert lease.acquire()
+    lease.release()
+
+
+def test_one_shot_sync_falls_back_to_the_lock_file(manage, config, tmp_path,
+                                                   capsys):
+    config.update({
+        'lock': 'etcd',
+        'etcd_endpoints': 'http://127.0.0.1:{}'.format(closed_port()),
+        'lock_file': str(tmp_path / 'lock'),
+    })
+
+    with pytest.raises(OSError):
+        manage.catalog_zone_lock().acquire()
+
+    lock = manage.catalog_zone_lock(fallback=True)
+    with manage.leadership(lock) as leader:
+        assert leader
+        assert isinstance(lock.lock, manage.FileLock)
+
+        # the lock file is held until the synchronization is done
+        other = manage.FileLock(str(tmp_path / 'lock'))
+        assert not other.acquire()
+
+    assert 'using FileLock instead' in capsys.readouterr().err
+
+
+class PowerDNSHandler(FakeHandler):
+
+    """zones and rrsets of the pdns http api"""
+
+    def handle_request(self, method, path, body):
+        zones = self.server.zones
+        body = json.loads(body) if body else None
+        prefix = '/api/v1/servers/localhost/zones'
+
+        if self.headers.get('X-API-Key') != 'secret':
+            return 401, {'error': 'Unauthorized'}, None
+
+        if path == prefix and method == 'GET':
+            return 200, [{'name': name} for name in sorted(zones)], None
+
+        if path == prefix and method == 'POST':
+            zones[body['name']] = {'name': body['name'],
+                                   'rrsets': body['rrsets']}
+            return 201, zones[body['name']], None
+
+        name = path[len(prefix) + 1:]
+
+        if name not in zones:
+            return 404, {'error': 'Could not find domain'}, None
+
+        if method == 'GET':
+            return 200, zones[name], None
+
+        rrsets = zones[name]['rrsets']
+        for change in body['rrsets']:
+            rrsets[:] = [r for r in rrsets
+                         if (r['name'], r['type']) !=
+                         (change['name'], change['type'])]
+            if change.pop('changetype') == 'REPLACE':
+                rrsets.append(change)
+        return 204, None, None
+
+
+@pytest.fixture
+def pdns(fake_server, manage, config, tmp_path, monkeypatch):
+    server, url = fake_server(PowerDNSHandler)
+    server.zones = {}
+    config.update({
+        'zone': 'catalog.example',
+        'zone_file': str(tmp_path / 'catalog.example.zone'),
+        'api_url': url,
+        'api_key': 'secret',
+    })
+    monkeypatch.setattr(manage, '_nzfsums', None)
+    return server
+
+
+def ptr_records(zone):
+    return {rrset['name']: rrset['records'][0]['content']
+            for rrset in zone['rrsets'] if rrset['type'] == 'PTR'}
+
+
+def soa_serial(zone):
+    soa = next(r for r in zone['rrsets'] if r['type'] == 'SOA')
+    return int(soa['records'][0]['content'].split()[2])
+
+
+def test_catalog_diff(manage, pdns):
+    catalog = 'catalog.example.'
+    a = manage.member_name('a.example', catalog)
+    stale = '0' * 40 + '.zones.' + catalog
+
+    assert a == manage.nzfsum('a.example.') + '.zones.' + catalog
+
+    members = {a: 'a.example.', stale: 'gone.example.'}
+    added, removed = manage.catalog_diff(
+        members, ['a.example', 'b.example.', 'catalog.example'], catalog)
+
+    assert added == {manage.member_name('b.example', catalog): 'b.example.'}
+    assert removed == [stale]
+
+
+def test_incremental_sync_creates_the_catalog_zone(manage, pdns):
+    pdns.zones = {'a.example.': {}, 'b.example.': {}}
+
+    added, removed = manage.synchronize_catalog_zone_incremental()
+
+    catalog = pdns.zones['catalog.example.']
+    assert sorted(ptr_records(catalog).values()) == [
+        'a.example.', 'b.example.']
+    assert added == sorted(ptr_records(catalog))
+    assert removed == []
+    assert soa_serial(catalog) == 1
+
+
+def test_incremental_sync_patches_only_the_changes(manage, pdns,
+                                                   tmp_path):
+    pdns.zones = {'a.example.': {}, 'b.example.': {}}
+    manage.synchronize_catalog_zone_incremental()
+
+    del pdns.zones['a.example.']
+    pdns.zones['c.example.'] = {}
+    pdns.requests[:] = []
+
+    added, removed = manage.synchronize_catalog_zone_incremental()
+
+    catalog = pdns.zones['catalog.example.']
+    assert added == [manage.member_name('c.example', 'catalog.example')]
+    assert removed == [manage.member_name('a.example', 'catalog.example')]
+    assert sorted(ptr_records(catalog).values()) == [
+        'b.example.', 'c.example.']
+    assert soa_serial(catalog) == 2
+    assert [r[0] for r in pdns.requests] == ['GET', 'GET', 'PATCH']
+
+    # the nzfsums are persisted beside the zone file
+    sums = json.loads((tmp_path / '.catalog.example.zone.nzfsum.json')
+                      .read_text())
+    assert sorted(sums) == ['b.example.', 'c.example.']
+
+    # nothing changed, nothing is patched and the serial is kept
+    pdns.requests[:] = []
+    assert manage.synchronize_catalog_zone_incremental() == ([], [])
+    assert 'PATCH' not in [r[0] for r in pdns.requests]
+    assert soa_serial(catalog) == 2
+
+
+def test_incremental_sync_fails_with_wrong_api_key(manage, pdns, config):
+    config['api_key'] = 'wrong'
+
+    with pytest.raises(urllib.error.HTTPError):
+        manage.synchronize_catalog_zone_incremental()
+
+
+def soa_fields(content):
+    mname, rname, serial, refresh, retry, expire, minimum = content.split()
+    return {'serial': int(serial), 'refresh': int(refresh),
+            'retry': int(retry), 'expire': int(expire),
+            'minimum': int(minimum)}
+
+
+def test_catalog_soa_retries_before_it_expires(manage, pdns):
+    rrsets = manage.catalog_rrsets('catalog.example', ['a.example'], 7)
+    soa = next(r for r in rrsets if r['type'] == 'SOA')
+    fields = soa_fields(soa['records'][0]['content'])
+
+    assert fields['serial'] == 7
+    assert fields['refresh'] <= fields['retry'] < fields['expire']
+
+
+class Pdnsutil(object):
+
+    """list-all-zones, list-zone and load-zone of a fake pdnsutil"""
+
+    def __init__(self, zones):
+        self.zones = zones
+        self.catalog = None
+        self.loads = 0
+
+    def check_output(self, args, **kwargs):
+        assert args[1:] == ['list-all-zones']
+        return '\n'.join(self.zones + ['catalog.example.']) + '\n'
+
+    def run(self, args, **kwargs):
+        assert args[1:] == ['list-zone', 'catalog.example']
+        if self.catalog is None:
+            return subprocess.CompletedProcess(args, 1, '', 'not found')
+        lines = ['{}\t{}\tIN\t{}\t{}'.format(
+                     name, ttl, rdata.rdtype.name, rdata)
+                 for name, ttl, rdata in self.catalog.iterate_rdatas()]
+        return subprocess.CompletedProcess(args, 0, '\n'.join(lines), '')
+
+    def call(self, args):
+        assert args[1:3] == ['load-zone', 'catalog.example']
+        with open(args[3]) as f:
+            self.catalog = dns.zone.from_text(f.read(), 'catalog.example.',
+                                              relativize=False)
+        self.loads += 1
+        return 0
+
+    def soa(self):
+        return soa_fields(str(self.catalog.find_rdataset('@', 'SOA')[0]))
+
+
+@pytest.fixture
+def pdnsutil(manage, config, tmp_path, monkeypatch):
+    pdnsutil = Pdnsutil(['a.example.', 'b.example.'])
+    for name in ['check_output', 'run', 'call']:
+        monkeypatch.setattr(manage, name, getattr(pdnsutil, name))
+    monkeypatch.setattr(manage, '_nzfsums', None)
+    monkeypatch.setattr(manage, '_templates', {})
+    config.update({
+        'zone': 'catalog.example',
+        'zone_file': str(tmp_path / 'catalog.example.zone'),
+        'zone_template': os.path.join(
+            ROOT, 'chef/cookbooks/bcpc/files/default/powerdns/'
+            'catalog-zone.j2'),
+    })
+    return pdnsutil
+
+
+def test_full_sync_serial_follows_the_catalog_content(manage, pdnsutil):
+    assert manage.synchronize_catalog_zone()
+    assert pdnsutil.soa()['serial'] == 1
+    members = pdnsutil.catalog.find_rdataset(
+        manage.member_name('a.example', 'catalog.example'), 'PTR')
+    assert [str(r) for r in members] == ['a.example.']
+
+    # the same zones are not loaded again and keep their serial
+    assert not manage.synchronize_catalog_zone()
+    assert pdnsutil.loads == 1
+
+    pdnsutil.zones.append('c.example.')
+    assert manage.synchronize_catalog_zone()
+    assert pdnsutil.soa()['serial'] == 2
+    assert pdnsutil.loads == 2
+
+
+def test_template_has_the_records_of_catalog_rrsets(manage, pdnsutil):
+    manage.synchronize_catalog_zone()
+
+    rendered = sorted(
+        (str(name), rdata.rdtype.name, str(rdata))
+        for name, _, rdata in pdnsutil.catalog.iterate_rdatas())
+    created = sorted(
+        (r['name'], r['type'], r['records'][0]['content'])
+        for r in manage.catalog_rrsets('catalog.example', pdnsutil.zones, 1))
+
+    assert rendered == created
+
+
+class Clock(object):
+
+    """clock of the watcher, only advanced by its sleeps"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    def perf_counter(self):
+        return self.now
+
+
+class FakeAPI(object):
+
+    """in memory pdns api, each method fails as often as set in errors"""
+
+    def __init__(self, zones):
+        self.names = zones
+        self.catalog = None
+        self.errors = {}
+
+    def fail(self, method):
+        if self.errors.get(method):
+            self.errors[method] -= 1
+            raise urllib.error.URLError('connection refused')
+
+    def zones(self):
+        self.fail('zones')
+        return self.names + (['catalog.example.'] if self.catalog else [])
+
+    def zone(self, zone):
+        self.fail('zone')
+        return json.loads(json.dumps(self.catalog))
+
+    def create_zone(self, zone, rrsets):
+        self.fail('create_zone')
+        self.catalog = {'name': zone, 'rrsets': rrsets}
+
+    def patch_rrsets(self, zone, changes):
+        self.fail('patch_rrsets')
+        rrsets = self.catalog['rrsets']
+        for change in changes:
+            rrsets[:] = [r for r in rrsets
+                         if (r['name'], r['type']) !=
+                         (change['name'], change['type'])]
+            if change.pop('changetype') == 'REPLACE':
+                rrsets.append(change)
+
+    def members(self):
+        rrsets = self.catalog['rrsets']
+        return sorted(r['records'][0]['content'] for r in rrsets
+                      if r['type'] == 'PTR')
+
+
+class Lock(object):
+
+    """lock held by another node for the first refusals acquires"""
+
+    def __init__(self, refusals=0, release_error=None):
+        self.refusals = refusals
+        self.release_error = release_error
+        self.held = False
+
+    def acquire(self):
+        if self.refusals:
+            self.refusals -= 1
+            return False
+        self.held = True
+        return True
+
+    def release(self):
+        self.held = False
+        if self.release_error is not None:
+            raise self.release_error
+
+
+@pytest.fixture
+def watch(manage, config, tmp_path, monkeypatch):
+    """return a function running a watcher for a number of its sleeps"""
+    clock = Clock()
+    monkeypatch.setattr(manage, 'time', clock)
+    monkeypatch.setattr(manage, '_nzfsums', None)
+    config.update({
+        'zone': 'catalog.example',
+        'zone_file': str(tmp_path / 'catalog.example.zone'),
+    })
+
+    def run(watcher, sleeps, actions=None):
+        slept = []
+
+        def sleep(seconds):
+            slept.append(seconds)
+            clock.now += seconds
+            (actions or {}).get(len(slept), lambda: None)()
+            if len(slept) >= sleeps:
+                watcher.stop()
+
+        watcher.sleep = sleep
+        watcher.run()
+        return slept
+
+    return run
+
+
+def test_watcher_follower_retries_until_it_holds_the_lock(manage, watch):
+    api = FakeAPI(['a.example.'])
+    api.catalog = {'name': 'catalog.example.',
+                   'rrsets': manage.catalog_rrsets('catalog.example',
+                                                   ['a.example.'], 1)}
+    api.names.append('b.example.')
+
+    # the leader fails to apply the change and the lock becomes free
+    lock = Lock(refusals=3)
+    watcher = manage.CatalogZoneWatcher(api, interval=2, debounce=5,
+                                        lock=lock)
+    watch(watcher, 10)
+
+    assert api.members() == ['a.example.', 'b.example.']
+    assert watcher.counters['syncs_skipped'] == 3
+    assert watcher.counters['syncs'] == 1
+    assert not lock.held
+
+
+def test_watcher_backs_off_failed_syncs(manage, watch):
+    api = FakeAPI(['a.example.'])
+    api.errors['create_zone'] = 3
+    watcher = manage.CatalogZoneWatcher(api, interval=2, debounce=5,
+                                        max_interval=10, lock=Lock())
+
+    slept = watch(watcher, 8)
+
+    # polls at 0, 2 and 4, the first sync is attempted at 6
+    assert slept == [2, 2, 2, 4, 8, 10, 2, 2]
+    assert watcher.counters['sync_errors'] == 3
+    assert watcher.counters['syncs'] == 1
+    assert api.members() == ['a.example.']
+
+
+def test_watcher_counts_release_errors_apart(manage, watch):
+    api = FakeAPI(['a.example.'])
+    lock = Lock(release_error=OSError('etcd unreachable'))
+    watcher = manage.CatalogZoneWatcher(api, interval=2, debounce=5,
+                                        lock=lock)
+
+    watch(watcher, 6)
+
+    assert api.members() == ['a.example.']
+    assert watcher.counters['syncs'] == 1
+    assert watcher.counters['sync_errors'] == 0
+    assert watcher.counters['release_errors'] == 1
+
+
+def test_watcher_applies_changes_within_the_debounce_window_at_once(
+        manage, watch, tmp_path):
+    api = FakeAPI(['a.example.'])
+    stats = tmp_path / 'stats.json'
+    watcher = manage.CatalogZoneWatcher(api, interval=2, debounce=5,
+                                        stats_file=str(stats), lock=Lock())
+
+    def add(zone):
+        return lambda: api.names.append(zone)
+
+    # the first change is seen at 0, b and c come within the debounce
+    # window and are synchronized at 6 along with a, d is seen at 8 and
+    # synchronized at 14
+    watch(watcher, 12, {1: add('b.example.'), 2: add('c.example.'),
+                        4: add('d.example.')})
+
+    assert api.members() == ['a.example.', 'b.example.', 'c.example.',
+                             'd.example.']
+
+    # the stats are written after each synchronization
+    counters = json.loads(stats.read_text())
+    assert counters['polls'] == 8
+    assert counters['syncs'] == 2
+    assert counters['zones_added'] == 4
+    assert counters['last_sync_latency'] == 6
+    assert counters['max_sync_latency'] == 6
+    assert counters['total_sync_latency'] == 12
+
+
+def test_watcher_leaves_an_unchanged_catalog_alone(manage, watch):
+    api = FakeAPI(['a.example.'])
+    watcher = manage.CatalogZoneWatcher(api, interval=2, debounce=5,
+                                        lock=Lock())
+
+    watch(watcher, 20)
+
+    # only the synchronization at startup
+    assert watcher.counters['syncs'] == 1
+    assert watcher.counters['syncs_skipped'] == 0
+
+
+def test_watcher_backs_off_failed_polls(manage, watch, tmp_path):
+    api = FakeAPI(['a.example.'])
+    api.errors['zones'] = 4
+    stats = tmp_path / 'stats.json'
+    watcher = manage.CatalogZoneWatcher(api, interval=2, debounce=5,
+                                        max_interval=10,
+                                        stats_file=str(stats), lock=Lock())
+
+    slept = watch(watcher, 8)
+
+    assert slept == [4, 8, 10, 10, 2, 2, 2, 2]
+    assert json.loads(stats.read_text())['poll_errors'] == 4
+    assert api.members() == ['a.example.']
+
+
+def test_second_render_uses_the_bytecode_cache(manage, pdnsutil, tmp_path,
+                                               monkeypatch):
+    manage.synchronize_catalog_zone()
+    assert [p.name for p in tmp_path.glob('.*.jinja2.cache')]
+
+    # a new process finds the compiled template beside the zone file
+    def compile(*args, **kwargs):
+        raise AssertionError('template compiled again')
+
+    monkeypatch.setattr(manage, '_templates', {})
+    monkeypatch.setattr(jinja2.Environment, 'compile', compile)
+    pdnsutil.zones.append('c.example.')
+
+    assert manage.synchronize_catalog_zone()
+    assert pdnsutil.soa()['serial'] == 2
+
+
+def test_benchmark_prints_each_phase(manage, pdnsutil, tmp_path,
+                                     monkeypatch, capsys):
+    monkeypatch.setattr(manage.timings, 'phases', [])
+    monkeypatch.setattr('sys.argv', [
+        'catalog-zone-manage', '--sync', '--benchmark',
+        '--config', str(tmp_path / 'catalog-zone.conf')])
+
+    with pytest.raises(SystemExit) as e:
+        manage.main()
+    assert e.value.code == 0
+
+    phases = [line.rsplit(None, 1)[0]
+              for line in capsys.readouterr().err.splitlines()]
+    assert phases == [
+        'list zones', 'nzfsum', 'read catalog zone', 'load template',
+        'render zone file', 'load zone', 'total']
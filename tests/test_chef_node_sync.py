@@ -0,0 +1,172 @@
+import base64
+import copy
+import hashlib
+import json
+import urllib.parse
+
+import pytest
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+
+from conftest import FakeHandler, load_script
+
+ORG = '/organizations/bcpc'
+
+
+@pytest.fixture(scope='module')
+def sync():
+    return load_script('ansible/playbooks/roles/chef-node/files/'
+                       'chef-node-sync.py')
+
+
+@pytest.fixture(scope='module')
+def key(tmp_path_factory):
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    path = tmp_path_factory.mktemp('chef') / 'client.pem'
+    path.write_bytes(key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()))
+    return key, str(path)
+
+
+def chef_node(name, run_list=None):
+    return {'name': name, 'json_class': 'Chef::Node', 'chef_type': 'node',
+            'chef_environment': '_default', 'run_list': run_list or [],
+            'normal': {}, 'default': {}, 'override': {}, 'automatic': {}}
+
+
+def host_vars(ip, zone=None):
+    return {'interfaces': {'service': {'ip': ip}}, 'zone': zone,
+            'aggregate': None}
+
+
+class ChefHandler(FakeHandler):
+
+    """chef server verifying the v1.3 signature of every request"""
+
+    def verify(self, method, path, body):
+        headers = self.headers
+        signature = ''.join(
+            headers['X-Ops-Authorization-{}'.format(i)]
+            for i in range(1, 100)
+            if headers.get('X-Ops-Authorization-{}'.format(i)))
+
+        content_hash = base64.b64encode(hashlib.sha256(body).digest())
+        assert content_hash.decode() == headers['X-Ops-Content-Hash']
+        assert headers['X-Ops-Sign'] == 'algorithm=sha256;version=1.3'
+
+        canonical = '\n'.join([
+            'Method:' + method,
+            'Path:' + path,
+            'X-Ops-Content-Hash:' + headers['X-Ops-Content-Hash'],
+            'X-Ops-Sign:version=1.3',
+            'X-Ops-Timestamp:' + headers['X-Ops-Timestamp'],
+            'X-Ops-UserId:' + headers['X-Ops-Userid'],
+            'X-Ops-Server-API-Version:1',
+        ])
+
+        self.server.public_key.verify(
+            base64.b64decode(signature), canonical.encode(),
+            padding.PKCS1v15(), hashes.SHA256())
+
+    def handle_request(self, method, path, body):
+        url = urllib.parse.urlsplit(path)
+
+        try:
+            self.verify(method, url.path, body)
+        except Exception:
+            return 401, {'error': ['invalid signature']}, None
+
+        path = url.path[len(ORG):]
+
+        if path == '/search/node':
+            query = urllib.parse.parse_qs(url.query)
+            start = int(query['start'][0])
+            rows = int(query['rows'][0])
+            nodes = [node for _, node in sorted(self.server.index.items())]
+            return 200, {'total': len(nodes), 'start': start,
+                         'rows': nodes[start:start + rows]}, None
+
+        name = path.split('/')[-1]
+
+        if name not in self.server.nodes:
+            return 404, {'error': ['not found']}, None
+
+        if method == 'PUT':
+            self.server.nodes[name] = json.loads(body)
+
+        return 200, self.server.nodes[name], None
+
+
+@pytest.fixture
+def chef(fake_server, key, sync):
+    server, url = fake_server(ChefHandler)
+    server.public_key = key[0].public_key()
+    server.nodes = {}
+    server.index = {}
+    client = sync.ChefServer(url + ORG, 'operations', key[1], pool_size=2)
+    yield server, client
+    client.pool.close()
+
+
+def test_sync_saves_only_changed_nodes(sync, chef, monkeypatch):
+    server, client = chef
+    monkeypatch.setattr(sync, 'SEARCH_ROWS', 2)
+
+    for i in range(5):
+        name = 'node{}.example'.format(i)
+        node = chef_node(name)
+        if i % 2:
+            sync.update_chef_node_host_vars(node, host_vars('10.0.0.1'))
+        server.nodes[name] = server.index[name] = node
+
+    wanted = {'node{}.example'.format(i): host_vars('10.0.0.1')
+              for i in range(5)}
+
+    assert sync.sync_nodes(client, wanted) == [
+        'node0.example', 'node2.example', 'node4.example']
+    assert server.nodes['node0.example']['normal']['service_ip'] == '10.0.0.1'
+
+    # the search is paged, only the changed nodes are fetched and saved
+    searches = [r for r in server.requests if '/search/' in r[1]]
+    assert len(searches) == 3
+    assert [r[0] for r in server.requests].count('PUT') == 3
+
+    server.index = copy.deepcopy(server.nodes)
+    assert sync.sync_nodes(client, wanted) == []
+
+
+def test_sync_keeps_changes_missing_from_search(sync, chef):
+    server, client = chef
+
+    # the run list was set after the node was indexed by search
+    server.index['stale.example'] = chef_node('stale.example')
+    server.nodes['stale.example'] = chef_node('stale.example',
+                                              run_list=['role[headnode]'])
+    server.nodes['fresh.example'] = chef_node('fresh.example')
+
+    wanted = {'stale.example': host_vars('10.0.0.2', zone='z1'),
+              'fresh.example': host_vars('10.0.0.3')}
+
+    assert sync.sync_nodes(client, wanted) == ['fresh.example',
+                                               'stale.example']
+
+    stale = server.nodes['stale.example']
+    assert stale['run_list'] == ['role[headnode]']
+    assert stale['normal']['zone'] == 'z1'
+    assert server.nodes['fresh.example']['normal']['service_ip'] == '10.0.0.3'
+
+
+def test_sync_fails_with_wrong_key(sync, chef, tmp_path):
+    server, _ = chef
+    other = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    path = tmp_path / 'other.pem'
+    path.write_bytes(other.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()))
+
+    host = 'http://127.0.0.1:{}'.format(server.server_port)
+    client = sync.ChefServer(host + ORG, 'operations', str(path))
+
+    with pytest.raises(sync.ChefError, match='401'):
+        sync.sync_nodes(client, {})
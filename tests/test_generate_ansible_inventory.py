@@ -0,0 +1,125 @@
+import json
+import os
+import sys
+
+import pytest
+
+from conftest import ROOT, load_script
+
+sys.path.insert(0, os.path.join(ROOT, 'virtual', 'bin'))
+
+from lib import yaml_io  # noqa: E402
+
+SSH_CONFIG = '''
+Host r1n1
+  HostName 127.0.0.1
+  User vagrant
+  Port 2222
+'''
+
+TOPOLOGY = {
+    'nodes': [
+        {'host': 'r1n1', 'group': 'headnodes', 'host_vars': {'asn': 1}},
+    ]
+}
+
+
+@pytest.fixture(scope='module')
+def inventory():
+    return load_script('virtual/bin/generate-ansible-inventory.py')
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    ssh_config = tmp_path / 'ssh-config'
+    ssh_config.write_text(SSH_CONFIG)
+    topology = tmp_path / '.topology.compiled.json'
+    topology.write_text(json.dumps(TOPOLOGY))
+    return str(ssh_config), str(topology)
+
+
+@pytest.fixture
+def no_yaml(monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError('parsed the compiled topology as yaml')
+
+    monkeypatch.setattr(yaml_io, 'load', fail)
+    monkeypatch.setattr(yaml_io, 'load_file', fail)
+
+
+def test_compiled_topology_is_loaded_as_json(inventory, inputs, no_yaml):
+    assert inventory.parse_topology_config(inputs[1]) == TOPOLOGY
+
+
+def test_dynamic_inventory_loads_compiled_topology_as_json(
+        inventory, inputs, no_yaml, tmp_path):
+    dynamic = json.loads(inventory.load_dynamic_inventory(
+        inputs[0], inputs[1], str(tmp_path / 'cache')))
+
+    assert dynamic['headnodes']['hosts'] == ['r1n1']
+
+
+def cached(cache_dir):
+    return sorted(f for f in os.listdir(cache_dir) if f.endswith('.json'))
+
+
+def test_dynamic_inventory_is_cached(inventory, inputs, tmp_path,
+                                     monkeypatch):
+    cache_dir = str(tmp_path / 'cache')
+    dynamic = inventory.load_dynamic_inventory(*inputs, cache_dir)
+
+    def fail(*args):
+        raise AssertionError('rebuilt a cached inventory')
+
+    monkeypatch.setattr(inventory, 'get_inventory_data', fail)
+
+    assert inventory.load_dynamic_inventory(*inputs, cache_dir) == dynamic
+    assert len(cached(cache_dir)) == 1
+
+
+def test_upgraded_script_does_not_use_the_cache(inventory, inputs, tmp_path,
+                                                monkeypatch):
+    cache_dir = str(tmp_path / 'cache')
+    inventory.load_dynamic_inventory(*inputs, cache_dir)
+
+    upgraded = tmp_path / 'generate-ansible-inventory.py'
+    with open(inventory.__file__) as f:
+        upgraded.write_text(f.read() + '\n# upgraded\n')
+    monkeypatch.setattr(inventory, '__file__', str(upgraded))
+
+    inventory.load_dynamic_inventory(*inputs, cache_dir)
+    assert len(cached(cache_dir)) == 2
+
+    monkeypatch.setattr(inventory, 'INVENTORY_CACHE_VERSION', 2)
+    inventory.load_dynamic_inventory(*inputs, cache_dir)
+    assert len(cached(cache_dir)) == 3
+
+
+def test_cache_keeps_the_most_recently_used_entries(inventory, tmp_path):
+    cache_dir = tmp_path / 'cache'
+    cache_dir.mkdir()
+
+    for i in range(5):
+        entry = cache_dir / '{}.json'.format(i)
+        entry.write_text('{}')
+        os.utime(str(entry), (1000 + i, 1000 + i))
+    (cache_dir / 'tmpabc.tmp').write_text('')
+
+    inventory.prune_inventory_cache(str(cache_dir), 2)
+
+    assert sorted(os.listdir(str(cache_dir))) == \
+        ['3.json', '4.json', 'tmpabc.tmp']
+
+
+def test_cache_is_pruned_when_inputs_change(inventory, inputs, tmp_path,
+                                            monkeypatch):
+    monkeypatch.setattr(inventory, 'INVENTORY_CACHE_ENTRIES', 2)
+    cache_dir = str(tmp_path / 'cache')
+    ssh_config, topology = inputs
+
+    for i in range(4):
+        with open(ssh_config, 'a') as f:
+            f.write('# change {}\n'.format(i))
+        inventory.load_dynamic_inventory(ssh_config, topology, cache_dir)
+
+    assert len(cached(cache_dir)) == 2
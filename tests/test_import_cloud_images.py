@@ -0,0 +1,202 @@
+import json
+import lzma
+import os
+import uuid
+
+import pytest
+
+from conftest import FakeHandler, load_script
+
+
+@pytest.fixture(scope='module')
+def importer():
+    return load_script('ansible/playbooks/roles/headnode/files/'
+                       'import-cloud-images.py')
+
+
+class GlanceHandler(FakeHandler):
+
+    """keystone and the glance v2 images api of a single fake server"""
+
+    def handle_request(self, method, path, body):
+        images = self.server.images
+        path, _, query = path.partition('?')
+        parts = path.strip('/').split('/')
+
+        if path == '/v3/auth/tokens':
+            catalog = [{'type': 'image', 'endpoints': [
+                {'interface': 'public', 'region_id': 'RegionOne',
+                 'url': self.server.url + '/glance'}]}]
+            return 201, {'token': {'catalog': catalog}}, \
+                {'X-Subject-Token': 'token'}
+
+        if self.headers.get('X-Auth-Token') != 'token':
+            return 401, {}, None
+
+        if parts == ['glance', 'v2', 'images'] and method == 'GET':
+            # two images per page, the next link is relative to the endpoint
+            start = int(query.partition('marker=')[2] or 0)
+            page = list(images.values())[start:start + 2]
+            data = {'images': page}
+            if start + 2 < len(images):
+                data['next'] = '/v2/images?marker={}'.format(start + 2)
+            return 200, data, None
+
+        if parts == ['glance', 'v2', 'images']:
+            image = dict(json.loads(body), id=uuid.uuid4().hex,
+                         status='queued')
+            images[image['id']] = image
+            return 201, image, None
+
+        image = images.get(parts[3])
+
+        if image is None:
+            return 404, {}, None
+
+        if method == 'DELETE':
+            del images[image['id']]
+            return 204, None, None
+
+        if method == 'PUT':
+            self.server.chunked.append(
+                self.headers.get('Transfer-Encoding') == 'chunked')
+            image.update(status='active', size=len(body))
+            self.server.data[image['id']] = body
+            return 204, None, None
+
+        return 200, image, None
+
+
+@pytest.fixture
+def glance(fake_server, importer):
+    server, url = fake_server(GlanceHandler)
+    server.url = url
+    server.images = {}
+    server.data = {}
+    server.chunked = []
+
+    session = importer.OpenStackSession(environ={
+        'OS_AUTH_URL': url,
+        'OS_USERNAME': 'admin',
+        'OS_PASSWORD': 'secret',
+        'OS_USER_DOMAIN_ID': 'default',
+        'OS_PROJECT_DOMAIN_ID': 'default',
+        'OS_PROJECT_NAME': 'admin',
+        'OS_REGION_NAME': 'RegionOne',
+    })
+    session.authenticate()
+
+    return server, importer.Glance(session)
+
+
+def test_missing_images_follows_the_pagination(importer, glance):
+    server, client = glance
+    for i in range(5):
+        client.create_image('image{}'.format(i), 'raw')
+
+    images = [{'name': 'image{}'.format(i)} for i in range(7)]
+
+    assert importer.missing_images(client, images) == images[5:]
+    assert [r[1] for r in server.requests if r[0] == 'GET'] == [
+        '/glance/v2/images?limit=1000', '/glance/v2/images?marker=2',
+        '/glance/v2/images?marker=4']
+
+
+def test_import_uploads_the_image_in_chunks(importer, glance, tmp_path,
+                                            monkeypatch):
+    server, client = glance
+    monkeypatch.setattr(importer, 'CHUNK_SIZE', 1000)
+    data = os.urandom(10500)
+    (tmp_path / 'cirros.img').write_bytes(data)
+
+    image = {'name': 'cirros', 'type': 'raw', 'compression': None,
+             'filename': 'cirros.img'}
+    name, image_id, stages = importer.import_image(client, image,
+                                                   str(tmp_path))
+
+    assert name == 'cirros'
+    assert server.images[image_id]['status'] == 'active'
+    assert server.images[image_id]['disk_format'] == 'raw'
+    assert server.data[image_id] == data
+    assert server.chunked == [True]
+    assert [stage.name for stage in stages] == ['read', 'upload']
+    assert stages[-1].bytes == len(data)
+
+    # the work dir is removed once the image is uploaded
+    assert os.listdir(str(tmp_path)) == ['cirros.img']
+
+
+def xz_image(tmp_path, data, filename='cirros.img.xz'):
+    (tmp_path / filename).write_bytes(data)
+    return {'name': 'cirros', 'type': 'raw', 'compression': 'xz',
+            'filename': filename}
+
+
+def test_import_decompresses_concatenated_xz_streams(importer, glance,
+                                                     tmp_path, monkeypatch):
+    server, client = glance
+    monkeypatch.setattr(importer, 'CHUNK_SIZE', 1000)
+    data = os.urandom(4000) + bytes(20000)
+    image = xz_image(tmp_path, lzma.compress(data[:5000]) +
+                     lzma.compress(data[5000:]))
+
+    _, image_id, stages = importer.import_image(client, image,
+                                                str(tmp_path))
+
+    assert server.data[image_id] == data
+    assert [stage.name for stage in stages] == ['read', 'decompress',
+                                                'upload']
+
+
+@pytest.mark.parametrize('corrupt', [
+    lambda data: data[:len(data) // 2],
+    lambda data: data[:100] + bytes(100) + data[200:],
+], ids=['truncated', 'corrupt'])
+def test_import_deletes_the_image_of_a_corrupt_xz(importer, glance, tmp_path,
+                                                  monkeypatch, corrupt):
+    server, client = glance
+    monkeypatch.setattr(importer, 'CHUNK_SIZE', 1000)
+    image = xz_image(tmp_path, corrupt(lzma.compress(os.urandom(10000))))
+
+    with pytest.raises(lzma.LZMAError):
+        importer.import_image(client, image, str(tmp_path))
+
+    # the queued image is gone, so the next run imports it again
+    assert server.images == {}
+    assert [r[0] for r in server.requests].count('DELETE') == 1
+    assert importer.missing_images(client, [image]) == [image]
+    assert os.listdir(str(tmp_path)) == ['cirros.img.xz']
+
+
+def test_images_with_unknown_compression_are_skipped(importer, glance,
+                                                     tmp_path, monkeypatch,
+                                                     capsys):
+    server, _ = glance
+    manifest = tmp_path / 'cloud-images.json'
+    manifest.write_text(json.dumps({
+        'images': [{'file_asset': 'cirros', 'type': 'raw'},
+                   {'file_asset': 'bionic', 'type': 'raw',
+                    'compression': 'bz2'}],
+        'assets': {'cirros': {'filename': 'cirros.img'},
+                   'bionic': {'filename': 'bionic.img.bz2'}},
+    }))
+    (tmp_path / 'cirros.img').write_bytes(os.urandom(1000))
+
+    for key, value in [('OS_AUTH_URL', server.url), ('OS_USERNAME', 'admin'),
+                       ('OS_PASSWORD', 'secret'),
+                       ('OS_USER_DOMAIN_ID', 'default'),
+                       ('OS_PROJECT_DOMAIN_ID', 'default'),
+                       ('OS_PROJECT_NAME', 'admin'),
+                       ('OS_REGION_NAME', 'RegionOne')]:
+        monkeypatch.setenv(key, value)
+
+    for action in ['missing', 'import']:
+        monkeypatch.setattr('sys.argv', [
+            'import-cloud-images', action, str(manifest),
+            '--image-dir', str(tmp_path)])
+        importer.main()
+
+    out, err = capsys.readouterr()
+    assert out.splitlines()[0] == '["cirros"]'
+    assert 'skipping bionic: no handler for bz2 compression format' in err
+    assert [image['name'] for image in server.images.values()] == ['cirros']
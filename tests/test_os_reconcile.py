@@ -0,0 +1,217 @@
+import json
+import uuid
+
+import pytest
+
+from conftest import FakeHandler, load_script
+
+COLLECTIONS = ['projects', 'roles', 'services', 'endpoints']
+
+
+@pytest.fixture(scope='module')
+def reconcile():
+    return load_script('chef/cookbooks/bcpc/files/default/openstack/'
+                       'os-reconcile.py')
+
+
+class OpenStackHandler(FakeHandler):
+
+    """keystone, nova, cinder and neutron apis of a single fake server"""
+
+    def handle_request(self, method, path, body):
+        state = self.server.state
+        body = json.loads(body) if body else None
+        path, _, query = path.partition('?')
+        parts = path.strip('/').split('/')
+
+        if path == '/v3/auth/tokens':
+            password = body['auth']['identity']['password']['user']
+            if password['password'] != 'secret':
+                return 401, {}, None
+            return 201, {'token': {'catalog': self.server.catalog}}, \
+                {'X-Subject-Token': 'token'}
+
+        if self.headers.get('X-Auth-Token') != 'token':
+            return 401, {}, None
+
+        if parts[0] == 'v3' and parts[1] in COLLECTIONS:
+            collection = state[parts[1]]
+            kind = parts[1][:-1]
+            if method == 'GET':
+                return 200, {parts[1]: list(collection.values())}, None
+            if method == 'POST':
+                item = dict(body[kind], id=uuid.uuid4().hex)
+                collection[item['id']] = item
+                return 201, {kind: item}, None
+            collection[parts[2]].update(body[kind])
+            return 200, {kind: collection[parts[2]]}, None
+
+        if parts[:2] == ['nova', 'flavors']:
+            if method == 'POST':
+                flavor = dict(body['flavor'], id=uuid.uuid4().hex)
+                state['flavors'].append(flavor)
+                return 200, {'flavor': flavor}, None
+
+            # one flavor per page, nova reports no swap as ''
+            start = int(query.partition('marker=')[2] or 0)
+            flavors = [dict(flavor, swap=flavor['swap'] or '')
+                       for flavor in state['flavors'][start:start + 1]]
+            links = []
+            if start + 1 < len(state['flavors']):
+                links = [{'rel': 'next', 'href': '{}/nova/flavors/detail'
+                          '?is_public=None&marker={}'.format(
+                              self.server.url, start + 1)}]
+            return 200, {'flavors': flavors, 'flavors_links': links}, None
+
+        if 'os-quota-sets' in parts or parts[:2] == ['v2.0', 'quotas']:
+            key = 'quota' if parts[0] == 'v2.0' else 'quota_set'
+            quotas = state['quotas'].setdefault(
+                (parts[0], parts[-1]), {'cores': 20, 'gigabytes': 1000,
+                                        'port': 50})
+            if method == 'PUT':
+                quotas.update(body[key])
+            return 200, {key: quotas}, None
+
+        return 404, {}, None
+
+
+def adminrc(url):
+    return {
+        'OS_AUTH_URL': url + '/v3',
+        'OS_USERNAME': 'admin',
+        'OS_PASSWORD': 'secret',
+        'OS_USER_DOMAIN_ID': 'default',
+        'OS_PROJECT_DOMAIN_ID': 'default',
+        'OS_PROJECT_NAME': 'admin',
+        'OS_REGION_NAME': 'RegionOne',
+    }
+
+
+@pytest.fixture
+def openstack(fake_server, reconcile):
+    server, url = fake_server(OpenStackHandler)
+    server.url = url
+    server.catalog = [
+        {'type': service_type,
+         'endpoints': [{'interface': 'public', 'region_id': 'RegionOne',
+                        'url': url + prefix}]}
+        for service_type, prefix in [('compute', '/nova'),
+                                     ('volumev3', '/cinder'),
+                                     ('network', '')]
+    ]
+    server.state = {
+        'projects': {'p-admin': {'id': 'p-admin', 'name': 'admin',
+                                 'domain_id': 'default',
+                                 'description': ''}},
+        'roles': {'r-admin': {'id': 'r-admin', 'name': 'admin'}},
+        'services': {'s-nova': {'id': 's-nova', 'name': 'nova',
+                                'type': 'compute'}},
+        'endpoints': {'e-nova': {'id': 'e-nova', 'service_id': 's-nova',
+                                 'interface': 'public',
+                                 'region_id': 'RegionOne',
+                                 'url': 'http://nova.old'}},
+        'flavors': [],
+        'quotas': {},
+    }
+
+    session = reconcile.OpenStackSession(environ=adminrc(url))
+    session.authenticate()
+
+    return server, session
+
+
+DESCRIPTION = {
+    'projects': [{'name': 'admin', 'description': 'admin project'},
+                 {'name': 'service'}],
+    'roles': [{'name': 'admin'}, {'name': 'heat_stack_owner'}],
+    'endpoints': [
+        {'service': 'nova', 'type': 'compute', 'interface': 'public',
+         'region': 'RegionOne', 'url': 'http://nova'},
+        {'service': 'glance', 'type': 'image', 'interface': 'public',
+         'region': 'RegionOne', 'url': 'http://glance'},
+    ],
+    'flavors': [{'name': 'm1.{}'.format(i), 'vcpus': 1, 'ram': 512 * i,
+                 'disk': 1} for i in range(1, 4)],
+    'quotas': {
+        'compute': {'admin': {'cores': -1}, 'service': {'cores': 100}},
+        'volume': {'admin': {'gigabytes': -1}},
+        'network': {'admin': {'port': -1}},
+    },
+}
+
+
+def changes(server):
+    return [request for request in server.requests
+            if request[0] != 'GET' and 'auth' not in request[1]]
+
+
+def test_dry_run_changes_nothing(reconcile, openstack, capsys):
+    server, session = openstack
+
+    assert reconcile.reconcile(session, DESCRIPTION, dry_run=True) == 13
+    assert changes(server) == []
+    assert 'would create flavor m1.3' in capsys.readouterr().out
+
+
+def test_reconcile_applies_only_the_differences(reconcile, openstack,
+                                                capsys):
+    server, session = openstack
+
+    assert reconcile.reconcile(session, DESCRIPTION, workers=4) == 13
+
+    state = server.state
+    projects = {p['name']: p for p in state['projects'].values()}
+    assert projects['admin']['description'] == 'admin project'
+    assert state['endpoints']['e-nova']['url'] == 'http://nova'
+    assert len(state['endpoints']) == 2
+    flavors = sorted(flavor['name'] for flavor in state['flavors'])
+    assert flavors == ['m1.1', 'm1.2', 'm1.3']
+    assert state['quotas']['nova', projects['service']['id']]['cores'] == 100
+    assert state['quotas']['v2.0', 'p-admin']['port'] == -1
+
+    # each kind of resource is listed once
+    lists = [request[1] for request in server.requests
+             if request[0] == 'GET' and '/v3/' in request[1]]
+    assert sorted(lists) == ['/v3/endpoints', '/v3/projects', '/v3/roles',
+                             '/v3/services']
+
+    capsys.readouterr()
+    server.requests[:] = []
+
+    assert reconcile.reconcile(session, DESCRIPTION) == 0
+    assert changes(server) == []
+    assert 'differs' not in capsys.readouterr().err
+
+
+def test_reconcile_reports_differing_flavors(reconcile, openstack, capsys):
+    server, session = openstack
+    server.state['flavors'].append({'id': 'f1', 'name': 'm1.1', 'vcpus': 2,
+                                    'ram': 512, 'disk': 1, 'swap': 0})
+
+    description = {'flavors': DESCRIPTION['flavors'][:1]}
+    assert reconcile.reconcile(session, description) == 0
+    assert "flavor m1.1 differs from its description: ['vcpus']" in \
+        capsys.readouterr().err
+
+
+def test_check_exits_2_while_changes_are_needed(reconcile, openstack,
+                                                tmp_path, monkeypatch):
+    server, _ = openstack
+    path = tmp_path / 'flavors.json'
+    path.write_text(json.dumps({'flavors': DESCRIPTION['flavors']}))
+    for name, value in adminrc(server.url).items():
+        monkeypatch.setenv(name, value)
+
+    def main(*args):
+        monkeypatch.setattr('sys.argv', ['os-reconcile'] + list(args))
+        try:
+            reconcile.main()
+        except SystemExit as e:
+            return e.code
+        return 0
+
+    assert main('--check', str(path)) == 2
+    assert changes(server) == []
+
+    assert main(str(path)) == 0
+    assert main('--check', str(path)) == 0
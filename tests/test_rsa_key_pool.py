@@ -0,0 +1,135 @@
+import os
+import stat
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+
+import pytest
+
+from conftest import ROOT
+
+sys.path.insert(0, os.path.join(ROOT, 'virtual', 'bin'))
+
+from lib import rsa_key_pool  # noqa: E402
+from lib.bcc_chef_databags import BCCChefDatabags, RSA_KEYS  # noqa: E402
+from lib.rsa_key_pool import RSAKeyPool  # noqa: E402
+
+SCRIPT = os.path.join(ROOT, 'virtual', 'bin', 'generate-chef-databags.py')
+
+WANTED = Counter(RSA_KEYS.values())
+
+
+def fake_key(key_type, bits):
+    return '{}-{}-{}'.format(key_type, bits, os.urandom(8).hex()).encode()
+
+
+@pytest.fixture
+def pool(tmp_path):
+    return RSAKeyPool(str(tmp_path / 'pool'))
+
+
+def counts(pool):
+    return {spec: pool.count(*spec) for spec in WANTED}
+
+
+def test_keys_are_private_and_taken_once(pool):
+    pool.put('x509', 2048, b'one')
+    pool.put('x509', 2048, b'two')
+
+    assert stat.S_IMODE(os.stat(pool.path).st_mode) == 0o700
+    for root, _, files in os.walk(pool.path):
+        for f in files:
+            mode = os.stat(os.path.join(root, f)).st_mode
+            assert stat.S_IMODE(mode) == 0o600
+
+    taken = {pool.take('x509', 2048), pool.take('x509', 2048)}
+    assert taken == {b'one', b'two'}
+    assert pool.take('x509', 2048) is None
+    assert pool.take('ssh', 1024) is None
+
+
+def test_prefill_tops_up_to_the_target(pool, monkeypatch):
+    monkeypatch.setattr(rsa_key_pool, 'generate_rsa_key', fake_key)
+    pool.put('ssh', 1024, b'existing')
+
+    generated = pool.prefill(2)
+
+    assert counts(pool) == {spec: 2 * n for spec, n in WANTED.items()}
+    assert generated == 2 * sum(WANTED.values()) - 1
+    assert pool.prefill(2) == 0
+
+
+def test_concurrent_prefills_do_not_overshoot(pool, monkeypatch):
+    def slow_key(key_type, bits):
+        time.sleep(0.01)
+        return fake_key(key_type, bits)
+
+    monkeypatch.setattr(rsa_key_pool, 'generate_rsa_key', slow_key)
+
+    generated = []
+    threads = [
+        threading.Thread(target=lambda: generated.append(pool.prefill(1)))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sum(generated) == sum(WANTED.values())
+    assert counts(pool) == dict(WANTED)
+
+
+def test_reservations_of_dead_prefills_are_ignored(pool, monkeypatch):
+    monkeypatch.setattr(rsa_key_pool, 'generate_rsa_key', fake_key)
+
+    dead = subprocess.Popen(['true'])
+    dead.wait()
+    directory = os.path.join(pool.path, 'ssh-1024')
+    os.makedirs(directory, exist_ok=True)
+    stale = os.path.join(directory, '.{}-0.reserved'.format(dead.pid))
+    open(stale, 'w').close()
+
+    pool.prefill(1)
+
+    assert pool.count('ssh', 1024) == WANTED[('ssh', 1024)]
+    assert not os.path.exists(stale)
+
+
+def test_failed_prefill_releases_its_reservations(pool, monkeypatch):
+    def broken_key(key_type, bits):
+        raise RuntimeError('no entropy')
+
+    monkeypatch.setattr(rsa_key_pool, 'generate_rsa_key', broken_key)
+
+    with pytest.raises(RuntimeError):
+        pool.prefill(1)
+
+    for root, _, files in os.walk(pool.path):
+        assert not [f for f in files if f.endswith('.reserved')]
+
+
+def test_prefill_with_jobs_feeds_databag_generation(pool):
+    assert pool.prefill(1, jobs=2) == sum(WANTED.values())
+
+    databags = BCCChefDatabags(jobs=2, key_pool=pool).generate()
+
+    assert databags['chef_databags']
+    assert all(n == 0 for n in counts(pool).values())
+
+
+def test_background_prefill_returns_at_once(pool):
+    out = subprocess.check_output([
+        sys.executable, SCRIPT, '--key-pool', pool.path,
+        '--prefill', '1', '--jobs', '2', '--background'
+    ]).decode()
+
+    assert 'in the background' in out
+
+    deadline = time.time() + 120
+    while counts(pool) != dict(WANTED) and time.time() < deadline:
+        time.sleep(0.5)
+
+    assert counts(pool) == dict(WANTED)
@@ -0,0 +1,75 @@
+import copy
+
+import pytest
+
+from conftest import load_script
+
+
+@pytest.fixture(scope='module')
+def util():
+    return load_script('ansible/playbooks/roles/common/filter_plugins/util.py')
+
+
+def cloud_vars(password='secret'):
+    databags = [{'id': 'etcd', 'ssl': 'x' * 1000},
+                {'id': 'config',
+                 'openstack': {'admin': {'password': password}}},
+                {'id': 'config', 'openstack': {}}]
+    return {'chef': {'databags': databags},
+            'cloud': {'region': 'RegionOne', 'fqdn': 'openstack.example'}}
+
+
+def test_find_databag_returns_the_first_match(util):
+    databags = cloud_vars()['chef']['databags']
+
+    assert util.find_databag(databags, 'config') is databags[1]
+    with pytest.raises(ValueError, match='could not find databag bogus'):
+        util.find_databag(databags, 'bogus')
+
+
+def test_osadmin_is_memoized_by_content(util):
+    first = util.osadmin(cloud_vars())
+    assert first['OS_PASSWORD'] == 'secret'
+    assert first['OS_AUTH_URL'] == 'https://openstack.example:35357/v3'
+
+    # ansible renders cloud_vars anew for every task
+    first['OS_PASSWORD'] = 'changed'
+    assert util.osadmin(copy.deepcopy(cloud_vars()))['OS_PASSWORD'] == \
+        'secret'
+    assert len(util._osadmin_environments) == 1
+
+    assert util.osadmin(cloud_vars('rotated'))['OS_PASSWORD'] == 'rotated'
+
+
+def test_transit_interfaces_by_mac(util):
+    facts = {'interfaces': ['lo', 'eno1', 'eno1.100', 'eno2'],
+             'lo': {'device': 'lo'},
+             'eno1': {'device': 'eno1', 'macaddress': 'aa'},
+             'eno1.100': {'device': 'eno1.100', 'macaddress': 'aa'},
+             'eno2': {'device': 'eno2', 'macaddress': 'bb'}}
+    transits = [{'mac': 'bb'}, {'mac': 'aa'}]
+
+    assert [t['name'] for t in util.transit_interfaces(transits, facts)] == \
+        ['eno2', 'eno1']
+    with pytest.raises(ValueError):
+        util.transit_interfaces([{'mac': 'cc'}], facts)
+
+
+def test_find_asset_in_a_list_with_duplicates_returns_the_first(util):
+    assets = [{'name': 'chef_server', 'filename': 'a.deb'},
+              {'name': 'cirros', 'filename': 'cirros.img'},
+              {'name': 'chef_server', 'filename': 'b.deb'}]
+
+    assert util.find_asset('chef_server', assets) is assets[0]
+    assert util.find_asset('cirros', assets) is assets[1]
+    with pytest.raises(ValueError, match='could not find bogus'):
+        util.find_asset('bogus', assets)
+
+
+def test_find_asset_in_an_index(util):
+    assets = [{'name': 'chef_server'}, {'name': 'cirros'}]
+    index = util.file_asset_index(assets)
+
+    assert util.find_asset('cirros', index) is assets[1]
+    with pytest.raises(ValueError, match='could not find bogus'):
+        util.find_asset('bogus', index)
@@ -0,0 +1,79 @@
+import json
+import os
+import sys
+
+import pytest
+
+from conftest import ROOT
+
+sys.path.insert(0, os.path.join(ROOT, 'virtual', 'bin'))
+
+from lib import yaml_io  # noqa: E402
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    directory = str(tmp_path / 'cache')
+    monkeypatch.setattr(yaml_io, 'CACHE_DIR', directory)
+    return directory
+
+
+@pytest.fixture
+def document(tmp_path):
+    path = tmp_path / 'inputs' / 'topology.yml'
+    path.parent.mkdir()
+    path.write_text('nodes:\n  - host: r1n1\n    group: headnodes\n')
+    return str(path)
+
+
+def test_cache_is_json_in_a_private_directory(cache, document):
+    data = yaml_io.load_file(document)
+
+    assert data == {'nodes': [{'host': 'r1n1', 'group': 'headnodes'}]}
+    assert os.listdir(os.path.dirname(document)) == ['topology.yml']
+    assert os.stat(cache).st_mode & 0o777 == 0o700
+
+    with open(yaml_io.cache_file(document)) as f:
+        cached = json.load(f)
+    assert cached['data'] == data
+    assert cached['path'] == document
+
+
+def test_cache_is_used_until_the_file_changes(cache, document, monkeypatch):
+    yaml_io.load_file(document)
+
+    def fail(stream):
+        raise AssertionError('parsed a cached document')
+
+    monkeypatch.setattr(yaml_io, 'load', fail)
+    assert yaml_io.load_file(document)['nodes'][0]['host'] == 'r1n1'
+
+    monkeypatch.undo()
+    with open(document, 'a') as f:
+        f.write('  - host: r1n2\n')
+
+    assert len(yaml_io.load_file(document)['nodes']) == 2
+
+
+def test_shared_cache_directory_is_not_used(cache, document, monkeypatch):
+    os.makedirs(cache)
+    os.chmod(cache, 0o777)
+
+    def fail(sidecar, cached):
+        raise AssertionError('wrote to a shared cache directory')
+
+    monkeypatch.setattr(yaml_io, 'write_cache', fail)
+
+    assert yaml_io.cache_file(document) is None
+    assert yaml_io.load_file(document)['nodes']
+    assert os.listdir(cache) == []
+
+
+def test_documents_json_can_not_represent_are_not_cached(cache, tmp_path):
+    path = tmp_path / 'dates.yml'
+    path.write_text('built: 2020-01-01\n1: one\n')
+
+    data = yaml_io.load_file(str(path))
+
+    assert data[1] == 'one'
+    assert not os.path.exists(yaml_io.cache_file(str(path)))
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+
+# Copyright 2020, Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import os
+import sys
+from lib.topology import compiled_topology_file
+
+if __name__ == '__main__':
+    desc = "BCC Virtual Topology Compiler"
+    parser = argparse.ArgumentParser(description=desc)
+
+    virtual_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    parser.add_argument(
+        "-d", "--topology-dir",
+        default=os.path.join(virtual_dir, 'topology'),
+        help="directory of the topology and hardware files "
+             "(default: %(default)s)",
+        metavar="DIR",
+    )
+
+    parser.add_argument(
+        "-o", "--output",
+        help="path of the compiled topology "
+             "(default: .topology.compiled.json in the topology directory)",
+        metavar="FILE",
+    )
+
+    args = parser.parse_args()
+
+    try:
+        print(compiled_topology_file(args.topology_dir, output=args.output))
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
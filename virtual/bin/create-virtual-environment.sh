@@ -26,13 +26,10 @@ ssh_dir="${files_dir}/ssh"
 ssh_key_type="ed25519"
 ssh_private_key_file="${ssh_dir}/id_${ssh_key_type}"
 
-topology_file="${virtual_dir}/topology/topology.yml"
-topology_overrides_file="${virtual_dir}/topology/topology.overrides.yml"
 ssh_config_file=$(mktemp)
 
-if [ -f "${topology_overrides_file}" ]; then
-    topology_file=${topology_overrides_file}
-fi
+# merge the topology and hardware files with their overrides
+topology_file=$("${virtual_dir}/bin/compile-topology.py")
 
 if [ "${VAGRANT_DEFAULT_PROVIDER}" == "libvirt" ] ; then
     export VAGRANT_VAGRANTFILE=Vagrantfile.libvirt
@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 
 """
 Copyright 2018, Bloomberg Finance L.P.
@@ -16,76 +16,175 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-from __future__ import print_function
-
+import hashlib
+import json
 import os
-import yaml
+import re
+import shlex
+import sys
+import tempfile
+from lib import yaml_io
+from lib.topology import compiled_topology_file
+
+
+# canonical spelling of the ssh config keywords used when building the
+# inventory. openssh keywords are case-insensitive
+SSH_CONFIG_KEYWORDS = {
+    k.lower(): k for k in [
+        'CertificateFile', 'DynamicForward', 'Host', 'HostName',
+        'IdentitiesOnly', 'IdentityFile', 'LocalForward', 'LogLevel',
+        'Match', 'PasswordAuthentication', 'Port', 'RemoteForward',
+        'SendEnv', 'SetEnv', 'StrictHostKeyChecking', 'User',
+        'UserKnownHostsFile',
+    ]
+}
+
+# keywords that may be given more than once, all their values are used.
+# openssh uses the first value of any other keyword
+SSH_CONFIG_MULTI_VALUED = [
+    'CertificateFile', 'DynamicForward', 'IdentityFile', 'LocalForward',
+    'RemoteForward', 'SendEnv', 'SetEnv',
+]
+
+SSH_CONFIG_LINE = re.compile(r'^([^\s=]+)\s*(?:=|\s)\s*(.*)$')
+
+# bump when the layout of the cached dynamic inventory changes. the cache
+# key also covers this script, so an upgrade never serves a stale entry
+INVENTORY_CACHE_VERSION = 1
+
+# number of cached dynamic inventories kept, the least recently used ones
+# are removed
+INVENTORY_CACHE_ENTRIES = 16
 
 
 def is_valid_file(parser, arg):
 
+    if arg == '-':
+        return arg
+
     if not os.path.isfile(arg):
         parser.error('The file {} does not exist!'.format(arg))
     else:
         return arg
 
 
-def parse_ssh_config(ssh_config_file):
+def parse_ssh_config_line(line):
 
-    hosts = []
+    match = SSH_CONFIG_LINE.match(line)
 
-    with open(ssh_config_file) as f:
-        lines = f.readlines()
-        host = {}
+    if match is None:
+        raise ValueError("invalid ssh config line: {}".format(line))
+
+    key, value = match.groups()
+    key = SSH_CONFIG_KEYWORDS.get(key.lower(), key)
+
+    # keep quoted arguments together and drop the quotes around them
+    values = shlex.split(value)
+
+    return key, ' '.join(values)
+
+
+def iter_ssh_config(lines):
+
+    host = {}
 
-        for line in lines:
+    for line in lines:
 
-            line = line.strip()
+        line = line.strip()
 
-            if line != '':
-                key, value = line.split(' ')
-                host[key] = value
-            else:
-                hosts.append(host)
-                host = {}
+        if line == '' or line.startswith('#'):
+            continue
 
-    return hosts
+        key, value = parse_ssh_config_line(line)
+
+        # a Host or Match line starts a new block
+        if key in ['Host', 'Match']:
+            if 'Host' in host:
+                yield host
+            host = {}
+
+        # multi-valued keywords given more than once (e.g. IdentityFile)
+        # collect all of their values in a list, the first value of any
+        # other keyword wins
+        if key not in host:
+            host[key] = value
+        elif key in SSH_CONFIG_MULTI_VALUED:
+            if not isinstance(host[key], list):
+                host[key] = [host[key]]
+            host[key].append(value)
+
+    if 'Host' in host:
+        yield host
+
+
+def parse_ssh_config(ssh_config_file):
+
+    """
+    yield the host blocks of an ssh config file as they are read so the
+    config can be streamed in, e.g. from vagrant ssh-config on stdin (-)
+    """
+
+    if ssh_config_file == '-':
+        yield from iter_ssh_config(sys.stdin)
+        return
+
+    with open(ssh_config_file) as f:
+        yield from iter_ssh_config(f)
 
 
 def parse_topology_config(topology_config_file):
 
-    with open(topology_config_file) as f:
-        return yaml.safe_load(f)
+    # the compiled topology is json, only hand-written topologies need the
+    # yaml parser
+    if topology_config_file.endswith('.json'):
+        with open(topology_config_file) as f:
+            return json.load(f)
 
+    return yaml_io.load_file(topology_config_file)
 
-def get_group_hosts(group, ssh_config, nodes):
 
-    group_hosts = {}
+def index_nodes(nodes):
 
-    for host in ssh_config:
+    index = {}
 
-        node = list(
-          filter(
-            lambda node: host['Host'] == node.get('name', node['host']), nodes
-          )
-        )
+    for node in nodes:
 
-        if len(node) > 2:
+        name = node.get('name', node['host'])
+
+        if name in index:
             msg = "more than 1 node with the hostname {host} found"
-            msg = msg.format(host=host)
+            msg = msg.format(host=name)
             raise ValueError(msg)
 
-        node = node[0]
+        index[name] = node
+
+    return index
 
-        if node['group'] == group:
 
-            host_vars = node['host_vars']
-            host_vars.update({
-              'ansible_host': host['HostName'],
-              'ansible_port': host['Port'],
-            })
+def get_group_hosts(ssh_config, nodes):
 
-            group_hosts.update({node['host']: host_vars})
+    # build the hosts of every group in a single pass over the ssh config
+    # using an index of the nodes keyed by their host name
+    index = index_nodes(nodes)
+    group_hosts = {}
+
+    for host in ssh_config:
+
+        node = index.get(host['Host'])
+
+        if node is None:
+            msg = "no node with the hostname {host} found"
+            msg = msg.format(host=host['Host'])
+            raise ValueError(msg)
+
+        host_vars = dict(node['host_vars'])
+        host_vars.update({
+          'ansible_host': host['HostName'],
+          'ansible_port': host['Port'],
+        })
+
+        hosts = group_hosts.setdefault(node['group'], {})
+        hosts.update({node['host']: host_vars})
 
     return group_hosts
 
@@ -106,17 +205,125 @@ def get_inventory_data(ssh_config, nodes):
 
     cloud = {'children': {}}
 
-    for group in [n['group'] for n in nodes]:
+    for group, hosts in get_group_hosts(ssh_config, nodes).items():
+        cloud['children'].update({group: {'hosts': hosts}})
 
-        hosts = get_group_hosts(group, ssh_config, nodes)
+    if len(cloud['children']):
+        inventory['all']['children'].update({'cloud': cloud})
 
-        if len(hosts):
-            cloud['children'].update({group: {'hosts': hosts}})
+    return inventory
 
-        if len(cloud['children']):
-            inventory['all']['children'].update({'cloud': cloud})
 
-    return inventory
+def get_dynamic_inventory(inventory_data):
+
+    """
+    convert the inventory into the json layout expected from an ansible
+    dynamic inventory script, hostvars of all hosts included under _meta
+    """
+
+    dynamic = {'_meta': {'hostvars': {}}}
+
+    def add_group(name, group):
+
+        dynamic[name] = {}
+
+        hosts = group.get('hosts', {})
+        children = group.get('children', {})
+
+        if hosts:
+            dynamic[name]['hosts'] = sorted(hosts)
+            dynamic['_meta']['hostvars'].update(hosts)
+
+        if children:
+            dynamic[name]['children'] = sorted(children)
+
+        for child, child_group in children.items():
+            add_group(child, child_group)
+
+    add_group('all', inventory_data['all'])
+
+    return dynamic
+
+
+def read_input(path):
+
+    if path == '-':
+        return sys.stdin.buffer.read()
+
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def load_dynamic_inventory(ssh_conf, topology_conf, cache_dir):
+
+    """
+    return the dynamic inventory as json. results are cached on disk keyed
+    by the content of the ssh config, the topology and this script so that
+    the cached json is returned as-is as long as none of them has changed
+    """
+
+    ssh_config_data = read_input(ssh_conf)
+    topology_data = read_input(topology_conf)
+
+    with open(os.path.abspath(__file__), 'rb') as f:
+        script_data = f.read()
+
+    digest = hashlib.sha256(str(INVENTORY_CACHE_VERSION).encode())
+    for data in [script_data, ssh_config_data, topology_data]:
+        digest.update(hashlib.sha256(data).digest())
+
+    cache_file = os.path.join(cache_dir, '{}.json'.format(digest.hexdigest()))
+
+    try:
+        with open(cache_file) as f:
+            dynamic = f.read()
+        # mark the entry as recently used so pruning keeps it
+        os.utime(cache_file)
+        return dynamic
+    except FileNotFoundError:
+        pass
+
+    ssh_config = iter_ssh_config(ssh_config_data.decode().splitlines())
+    if topology_conf.endswith('.json'):
+        topology = json.loads(topology_data)
+    else:
+        topology = yaml_io.load(topology_data)
+    inventory_data = get_inventory_data(ssh_config, topology['nodes'])
+    dynamic = json.dumps(get_dynamic_inventory(inventory_data), indent=2)
+
+    # write to a temporary file first so concurrent readers never see a
+    # partially written cache file
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        f.write(dynamic)
+    os.rename(tmp, cache_file)
+
+    prune_inventory_cache(cache_dir, INVENTORY_CACHE_ENTRIES)
+
+    return dynamic
+
+
+def prune_inventory_cache(cache_dir, keep):
+
+    """remove all but the keep most recently used cached inventories"""
+
+    entries = []
+
+    for name in os.listdir(cache_dir):
+        if not name.endswith('.json'):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            entries.append((os.stat(path).st_mtime_ns, path))
+        except FileNotFoundError:
+            continue
+
+    for _, path in sorted(entries, reverse=True)[keep:]:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
 
 
 def main():
@@ -126,11 +333,14 @@ def main():
     desc = "Generate Ansible Inventory File"
     parser = argparse.ArgumentParser(description=desc)
 
+    # ansible runs dynamic inventory scripts with --list or --host only so
+    # the input files can also be passed through the environment
     parser.add_argument(
         "--ssh-config",
         dest="ssh_conf",
-        required=True,
-        help="Path to SSH config file",
+        default=os.environ.get('BCC_SSH_CONFIG'),
+        help="Path to SSH config file, - to read it from stdin "
+             "(default: $BCC_SSH_CONFIG)",
         metavar="FILE",
         type=lambda x: is_valid_file(parser, x)
     )
@@ -138,19 +348,65 @@ def main():
     parser.add_argument(
         "--topology-config",
         dest="topology_conf",
-        required=True,
-        help="Path to topology config file",
+        default=os.environ.get('BCC_TOPOLOGY_CONFIG'),
+        help="Path to topology config file (default: $BCC_TOPOLOGY_CONFIG "
+             "or the compiled topology of virtual/topology)",
         metavar="FILE",
         type=lambda x: is_valid_file(parser, x)
     )
 
+    parser.add_argument(
+        "--cache-dir",
+        default=os.environ.get(
+            'BCC_INVENTORY_CACHE_DIR',
+            os.path.expanduser('~/.cache/bcc/inventory')
+        ),
+        help="Directory of the dynamic inventory cache "
+             "(default: $BCC_INVENTORY_CACHE_DIR or %(default)s)",
+        metavar="DIR",
+    )
+
+    mode = parser.add_mutually_exclusive_group()
+
+    mode.add_argument(
+        "--list",
+        action="store_true",
+        help="Output the dynamic inventory as json",
+    )
+
+    mode.add_argument(
+        "--host",
+        help="Output the dynamic inventory variables of HOST as json",
+    )
+
     args = parser.parse_args()
 
+    if args.ssh_conf is None:
+        parser.error('--ssh-config is required')
+
+    if args.topology_conf is None:
+        virtual_dir = os.path.dirname(
+            os.path.dirname(os.path.abspath(__file__)))
+        topology_dir = os.path.join(virtual_dir, 'topology')
+        args.topology_conf = compiled_topology_file(topology_dir)
+
+    if args.list or args.host is not None:
+        dynamic = load_dynamic_inventory(
+            args.ssh_conf, args.topology_conf, args.cache_dir
+        )
+
+        if args.host is not None:
+            hostvars = json.loads(dynamic)['_meta']['hostvars']
+            dynamic = json.dumps(hostvars.get(args.host, {}), indent=2)
+
+        print(dynamic)
+        return
+
     ssh_config = parse_ssh_config(args.ssh_conf)
     topology = parse_topology_config(args.topology_conf)
     inventory_data = get_inventory_data(ssh_config, topology['nodes'])
 
-    print(yaml.dump(inventory_data, default_flow_style=False, indent=2))
+    print(yaml_io.dump(inventory_data))
 
 
 if __name__ == "__main__":
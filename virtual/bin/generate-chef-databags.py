@@ -15,10 +15,14 @@
 # limitations under the License.
 
 import argparse
+import difflib
+import os
+import subprocess
 import sys
-import yaml
 from builtins import FileExistsError
+from lib import yaml_io
 from lib.bcc_chef_databags import BCCChefDatabags
+from lib.rsa_key_pool import RSAKeyPool
 
 if __name__ == '__main__':
     desc = "BCC Chef Databag Generator"
@@ -38,15 +42,140 @@ if __name__ == '__main__':
         help="force databag overwrite if one already exists",
     )
 
+    parser.add_argument(
+        "-m", "--merge",
+        default=False,
+        action="store_true",
+        help="only generate the values missing from the existing databag",
+    )
+
+    parser.add_argument(
+        "-r", "--rotate",
+        metavar="TARGETS",
+        type=lambda x: [s.strip() for s in x.split(',') if s.strip()],
+        help="comma separated list of secrets to rotate in the existing "
+             "databag ({}). prints the changes and writes them with "
+             "--save".format(', '.join(BCCChefDatabags.ROTATION_TARGETS)),
+    )
+
+    parser.add_argument(
+        "-o", "--only",
+        metavar="SECTIONS",
+        type=lambda x: [s.strip() for s in x.split(',') if s.strip()],
+        help="comma separated list of sections to output, e.g. ceph,keystone",
+    )
+
+    parser.add_argument(
+        "-j", "--jobs",
+        default=1,
+        type=int,
+        help="number of processes used to generate the RSA keys",
+    )
+
+    parser.add_argument(
+        "-k", "--key-pool",
+        metavar="DIR",
+        help="take RSA keys from the key pool in DIR when available",
+    )
+
+    parser.add_argument(
+        "--prefill",
+        metavar="N",
+        type=int,
+        help="fill the key pool with RSA keys for N databags and exit",
+    )
+
+    parser.add_argument(
+        "-b", "--background",
+        default=False,
+        action="store_true",
+        help="run --prefill detached from the terminal and return at once",
+    )
+
     args = parser.parse_args()
-    bccdb = BCCChefDatabags()
+
+    key_pool = None
+
+    if args.key_pool:
+        key_pool = RSAKeyPool(args.key_pool)
+
+    if args.prefill is not None:
+        if key_pool is None:
+            parser.error('--prefill requires --key-pool')
+
+        if args.background:
+            cmd = [sys.executable, os.path.abspath(__file__),
+                   '--key-pool', key_pool.path,
+                   '--prefill', str(args.prefill),
+                   '--jobs', str(args.jobs)]
+            process = subprocess.Popen(cmd, start_new_session=True,
+                                       stdin=subprocess.DEVNULL,
+                                       stdout=subprocess.DEVNULL,
+                                       stderr=subprocess.DEVNULL)
+            print('filling {} in the background (pid {})'.format(
+                key_pool.path, process.pid))
+            sys.exit(0)
+
+        generated = key_pool.prefill(args.prefill, jobs=args.jobs)
+        print('generated {} keys in {}'.format(generated, key_pool.path))
+        sys.exit(0)
+
+    if args.background:
+        parser.error('--background requires --prefill')
+
+    if args.only is not None and (args.save or args.merge):
+        parser.error('--only can not be combined with --save or --merge')
+
+    if args.rotate is not None and (args.merge or args.only is not None):
+        parser.error('--rotate can not be combined with --merge or --only')
+
+    bccdb = BCCChefDatabags(jobs=args.jobs, key_pool=key_pool)
+
+    if args.rotate is not None:
+        try:
+            existing = bccdb.load()
+            rotated, changed = bccdb.rotate(existing, args.rotate)
+        except (OSError, ValueError) as e:
+            print(e)
+            sys.exit(1)
+
+        fp = bccdb.databags_file()
+        diff = difflib.unified_diff(
+            yaml_io.dump(existing).splitlines(True),
+            yaml_io.dump(rotated).splitlines(True),
+            fromfile=fp, tofile=fp
+        )
+        sys.stdout.writelines(diff)
+
+        if args.save:
+            bccdb.write(rotated)
+
+        recipes = ','.join('recipe[{}]'.format(r)
+                           for r in bccdb.recipes(changed))
+        print('recipes to converge: {}'.format(recipes), file=sys.stderr)
+        sys.exit(0)
 
     if args.save:
         try:
-            bccdb.save(force=args.force)
-            sys.exit(0)
+            bccdb.save(force=args.force, merge=args.merge)
         except FileExistsError as e:
             print(e)
             sys.exit(1)
+    else:
+        try:
+            if args.merge:
+                databags = bccdb.merge(bccdb.load())
+            else:
+                databags = bccdb.generate(only=args.only)
+        except (OSError, ValueError) as e:
+            print(e)
+            sys.exit(1)
+
+        print(yaml_io.dump(databags))
 
-    print(yaml.dump(bccdb.generate(), default_flow_style=False, indent=2))
+    # keys are only generated once they are needed so report the timings
+    # after the databags were produced
+    if args.jobs > 1 or key_pool is not None:
+        timings = bccdb.rsa_keys.timings
+        for name in sorted(timings):
+            print('{}: {:.3f}s'.format(name, timings[name]), file=sys.stderr)
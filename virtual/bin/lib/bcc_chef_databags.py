@@ -13,6 +13,7 @@
 # limitations under the License.
 
 import base64
+import copy
 import os
 import random
 import secrets
@@ -21,19 +22,116 @@ import struct
 import subprocess
 import time
 import uuid
-import yaml
 from builtins import FileExistsError
+from concurrent.futures import ProcessPoolExecutor
 from Crypto.PublicKey import RSA
 from OpenSSL import crypto
+from lib import yaml_io
+
+
+# name -> (type, bits) of every RSA key used in the databags
+RSA_KEYS = {
+    'api': ('x509', 4096),
+    'etcd-ca': ('x509', 2048),
+    'etcd-client-ro': ('x509', 2048),
+    'etcd-client-rw': ('x509', 2048),
+    'etcd-server': ('x509', 2048),
+    'nova-ssh': ('ssh', 1024),
+    'ssh': ('ssh', 1024),
+}
+
+
+def generate_rsa_key(key_type, bits):
+    if key_type == 'ssh':
+        return RSA.generate(bits).exportKey('PEM')
+
+    key = crypto.PKey()
+    key.generate_key(crypto.TYPE_RSA, bits)
+    return crypto.dump_privatekey(crypto.FILETYPE_PEM, key)
+
+
+def load_rsa_key(key_type, pem):
+    if key_type == 'ssh':
+        return RSA.import_key(pem)
+
+    return crypto.load_privatekey(crypto.FILETYPE_PEM, pem)
+
+
+def timed_generate_rsa_key(name, key_type, bits):
+    start = time.time()
+    pem = generate_rsa_key(key_type, bits)
+    return name, pem, time.time() - start
+
+
+class RSAKeys:
+
+    def __init__(self, jobs=1, pool=None):
+        self.__jobs = jobs
+        self.__pool = pool
+        self.__keys = {}
+        self.__timings = {}
+
+    @property
+    def timings(self):
+        return self.__timings
+
+    def get(self, name):
+        if name not in self.__keys:
+            self.pregenerate([name])
+        return self.__keys[name]
+
+    def pregenerate(self, names=None):
+        """
+        generate the named keys (all of them by default) up front, in a
+        process pool when more than one job was requested. keys travel
+        between processes PEM encoded since the key objects can't be pickled
+        """
+        if names is None:
+            names = RSA_KEYS.keys()
+
+        specs = [(name,) + RSA_KEYS[name]
+                 for name in sorted(set(names)) if name not in self.__keys]
+
+        # take what we can from the key pool and only generate the rest
+        if self.__pool is not None:
+            pooled = []
+
+            for name, key_type, bits in specs:
+                start = time.time()
+                pem = self.__pool.take(key_type, bits)
+
+                if pem is None:
+                    pooled.append((name, key_type, bits))
+                    continue
+
+                self.__keys[name] = load_rsa_key(key_type, pem)
+                self.__timings[name] = time.time() - start
+
+            specs = pooled
+
+        if self.__jobs > 1 and len(specs) > 1:
+            with ProcessPoolExecutor(max_workers=self.__jobs) as executor:
+                results = list(executor.map(timed_generate_rsa_key,
+                                            *zip(*specs)))
+        else:
+            results = [timed_generate_rsa_key(*spec) for spec in specs]
+
+        for name, pem, elapsed in results:
+            key_type = RSA_KEYS[name][0]
+            self.__keys[name] = load_rsa_key(key_type, pem)
+            self.__timings[name] = elapsed
 
 
 class APISSL:
 
-    def __init__(self):
+    def __init__(self, key=None):
 
         # create a key pair
-        self.__key = crypto.PKey()
-        self.__key.generate_key(crypto.TYPE_RSA, 4096)
+        if key is None:
+            key = crypto.PKey()
+            key.generate_key(crypto.TYPE_RSA, 4096)
+
+        self.__key = key
 
         # define alt_names
         self.__alt_names = ','.join([
@@ -73,13 +171,19 @@ class APISSL:
 
 class EtcdSSL:
 
-    def __init__(self):
+    def __init__(self, keys=None):
 
         self.__certs = {}
 
+        # keys that were not handed in are generated here
+        keys = keys or {}
+
         # create key
-        self.__key = crypto.PKey()
-        self.__key.generate_key(crypto.TYPE_RSA, 2048)
+        self.__key = keys.get('ca')
+
+        if self.__key is None:
+            self.__key = crypto.PKey()
+            self.__key.generate_key(crypto.TYPE_RSA, 2048)
 
         # create self-signed ca
         self.__ca = crypto.X509()
@@ -117,8 +221,11 @@ class EtcdSSL:
 
             # key
             self.__certs[client] = {}
-            self.__certs[client]['key'] = crypto.PKey()
-            self.__certs[client]['key'].generate_key(crypto.TYPE_RSA, 2048)
+            self.__certs[client]['key'] = keys.get(client)
+
+            if self.__certs[client]['key'] is None:
+                self.__certs[client]['key'] = crypto.PKey()
+                self.__certs[client]['key'].generate_key(crypto.TYPE_RSA, 2048) # noqa
 
             # cert
             rand_int = random.randint(50000000, 100000000)
@@ -208,8 +315,8 @@ class EtcdSSL:
 
 
 class SSH:
-    def __init__(self):
-        self.__key = RSA.generate(1024)
+    def __init__(self, key=None):
+        self.__key = key or RSA.generate(1024)
 
     @property
     def key(self):
@@ -224,30 +331,118 @@ class SSH:
         return base64.b64encode(key).decode()
 
 
+class Lazy:
+    """a databag value that is only generated once it is needed"""
+
+    def __init__(self, func, component=None):
+        self.func = func
+        self.component = component
+
+    def __call__(self):
+        return self.func()
+
+
 class BCCChefDatabags:
 
-    def __init__(self):
-        self.__etcd_ssl = EtcdSSL()
-        self.__nova_ssh = SSH()
-        self.__ssh = SSH()
-        self.__api_ssl = APISSL()
+    # rsa keys needed to build each of the certificate and ssh components
+    COMPONENT_KEYS = {
+        'api_ssl': ['api'],
+        'etcd_ssl': [
+            'etcd-ca', 'etcd-client-ro', 'etcd-client-rw', 'etcd-server'
+        ],
+        'nova_ssh': ['nova-ssh'],
+        'ssh': ['ssh'],
+    }
+
+    # secrets that can be rotated without regenerating the whole databag
+    ROTATION_TARGETS = ['ceph', 'etcd-ssl', 'fernet', 'passwords']
+
+    # chef recipes that consume each of the databag sections, either by
+    # reading the section or (etcd) by using the etcd client certificates.
+    # tests/test_bcc_chef_databags.py checks this against the cookbook
+    SECTION_RECIPES = {
+        'apache': ['apache2'],
+        'ceph': [
+            'ceph-mgr', 'ceph-mon', 'ceph-osd', 'cinder', 'glance',
+            'nova-compute'
+        ],
+        'cinder': ['cinder'],
+        'etcd': [
+            'calico-felix', 'calico-work', 'etcd-member', 'etcd-proxy',
+            'etcd-ssl', 'etcd3gw', 'neutron-head', 'powerdns'
+        ],
+        'glance': ['glance'],
+        'haproxy': ['haproxy'],
+        'heat': ['heat'],
+        'horizon': ['horizon'],
+        'keystone': ['keystone'],
+        'mysql': ['mysql'],
+        'neutron': ['neutron-head', 'nova-compute', 'nova-head'],
+        'nova': ['neutron-head', 'nova-compute', 'nova-head'],
+        'openstack': ['keystone', 'rally-deploy'],
+        'placement': ['nova-compute', 'nova-head'],
+        'powerdns': ['powerdns'],
+        'rabbit': [
+            'cinder', 'glance', 'heat', 'neutron-head', 'nova-compute',
+            'nova-head', 'rabbitmq', 'watcher'
+        ],
+        'ssh': ['nova-compute'],
+        'ssl': ['apache2', 'haproxy', 'nova-head', 'ssl'],
+        'zones': [
+            'ceph-osd', 'cinder', 'default', 'nova-compute', 'nova-head'
+        ],
+    }
+
+    def __init__(self, jobs=1, key_pool=None):
+        self.__rsa_keys = RSAKeys(jobs=jobs, pool=key_pool)
+        self.__etcd_ssl = None
+        self.__nova_ssh = None
+        self.__ssh = None
+        self.__api_ssl = None
+
+    @property
+    def rsa_keys(self):
+        return self.__rsa_keys
 
     @property
     def etcd_ssl(self):
+        if self.__etcd_ssl is None:
+            etcd_keys = {
+                client: self.__rsa_keys.get('etcd-{}'.format(client))
+                for client in ['ca', 'client-ro', 'client-rw', 'server']
+            }
+            self.__etcd_ssl = EtcdSSL(keys=etcd_keys)
         return self.__etcd_ssl
 
     @property
     def nova_ssh(self):
+        if self.__nova_ssh is None:
+            self.__nova_ssh = SSH(key=self.__rsa_keys.get('nova-ssh'))
         return self.__nova_ssh
 
     @property
     def ssh(self):
+        if self.__ssh is None:
+            self.__ssh = SSH(key=self.__rsa_keys.get('ssh'))
         return self.__ssh
 
     @property
     def api_ssl(self):
+        if self.__api_ssl is None:
+            self.__api_ssl = APISSL(key=self.__rsa_keys.get('api'))
         return self.__api_ssl
 
+    def __lazy(self, component, method):
+        return Lazy(lambda: getattr(getattr(self, component), method)(),
+                    component=component)
+
+    def __prepare(self, components):
+        # generate the rsa keys of all the components that are about to be
+        # built in one go so they can be generated in parallel
+        keys = [key for component in components
+                for key in self.COMPONENT_KEYS[component]]
+        self.__rsa_keys.pregenerate(keys)
+
     def generate_ceph_key(self):
         key = os.urandom(16)
         header = struct.pack('<hiih', 1, int(time.time()), 0, len(key))
@@ -262,68 +457,302 @@ class BCCChefDatabags:
     def generate_uuid(self):
         return str(uuid.uuid4())
 
-    def save(self, force=False):
+    def databags_file(self):
         cmd = 'git rev-parse --show-toplevel'
         root = subprocess.check_output(cmd.split(" ")).decode().rstrip('\n')
         fp = '{0}/{1}'.format(root, 'ansible/group_vars/all/chef_databags.yml')
+        return fp
+
+    def load(self):
+        with open(self.databags_file()) as file:
+            return yaml_io.load(file)
+
+    def save(self, force=False, merge=False):
+        fp = self.databags_file()
 
-        if os.path.isfile(fp) and not force:
+        if merge and os.path.isfile(fp):
+            data = self.merge(self.load())
+        elif os.path.isfile(fp) and not force:
             msg = '{} exists.\nWill not overwrite without force.'
             msg = msg.format(fp)
             raise FileExistsError(msg)
-
-        with open(fp, 'w') as file:
-            yaml.dump(
-                self.generate(),
-                file, default_flow_style=False, indent=2
-            )
-
-    def generate(self):
+        else:
+            data = self.generate()
+
+        self.write(data)
+
+    def write(self, data):
+        with open(self.databags_file(), 'w') as file:
+            yaml_io.dump(data, file)
+
+    def generate(self, only=None):
+        schema = self.schema()
+
+        if only is not None:
+            schema = self.select(schema, only)
+
+        self.__prepare(sorted(self.__components(schema)))
+        return self.resolve(schema)
+
+    def select(self, schema, sections):
+        """
+        reduce the schema to the given sections. a section is either a top
+        level key of a databag (e.g. ceph) or the id of a whole databag
+        """
+        valid = set()
+        for databag in schema['chef_databags']:
+            valid.add(databag['id'])
+            valid.update(key for key in databag if key != 'id')
+
+        unknown = set(sections) - valid
+        if unknown:
+            msg = 'unknown sections: {} (valid sections: {})'
+            msg = msg.format(', '.join(sorted(unknown)),
+                             ', '.join(sorted(valid)))
+            raise ValueError(msg)
+
+        databags = []
+
+        for databag in schema['chef_databags']:
+            if databag['id'] in sections:
+                databags.append(databag)
+                continue
+
+            selected = {k: v for k, v in databag.items() if k in sections}
+
+            if selected:
+                selected['id'] = databag['id']
+                databags.append(selected)
+
+        return {'chef_databags': databags}
+
+    def resolve(self, schema):
+        if isinstance(schema, dict):
+            return {k: self.resolve(v) for k, v in schema.items()}
+        if isinstance(schema, list):
+            return [self.resolve(v) for v in schema]
+        if callable(schema):
+            return schema()
+        return schema
+
+    def missing(self, schema, existing, path=()):
+        """
+        walk the schema alongside an existing databag and yield the path of
+        every value the existing databag does not have yet
+        """
+        if isinstance(schema, dict) and isinstance(existing, dict):
+            for key, value in schema.items():
+                if key not in existing:
+                    yield path + (key,)
+                else:
+                    yield from self.missing(value, existing[key],
+                                            path + (key,))
+
+        elif isinstance(schema, list) and isinstance(existing, list):
+            items = {self.__item_key(item, i): item
+                     for i, item in enumerate(existing)}
+            for i, value in enumerate(schema):
+                key = self.__item_key(value, i)
+                if key not in items:
+                    yield path + (key,)
+                else:
+                    yield from self.missing(value, items[key], path + (key,))
+
+    def merge(self, existing):
+        """
+        fill in the values an existing databag is missing, only building the
+        certificate and ssh components the missing values need. the keys and
+        certificates of a component have to match each other, so a component
+        missing any of its values is replaced as a whole (e.g. a missing etcd
+        server certificate re-issues the etcd ca and all its certificates)
+        """
+        schema = self.schema()
+        merged = copy.deepcopy(existing)
+        missing = list(self.missing(schema, merged))
+
+        components = set()
+        for path in missing:
+            components.update(self.__components(self.__get(schema, path)))
+        self.__prepare(sorted(components))
+
+        # the values of those components the databag still has are replaced
+        for path, leaf in self.__leaves(schema):
+            if self.__components(leaf) & components and \
+                    self.__has(merged, path):
+                self.__get(merged, path[:-1])[path[-1]] = leaf()
+
+        for path in missing:
+            value = self.resolve(self.__get(schema, path))
+            parent = self.__get(merged, path[:-1])
+            if isinstance(parent, list):
+                parent.append(value)
+            else:
+                parent[path[-1]] = value
+
+        return merged
+
+    def rotate(self, existing, targets):
+        """
+        return a copy of an existing databag with the secrets of the given
+        rotation targets replaced, along with the paths that changed
+
+        fernet keys move along the keystone key schedule: the staged key
+        is promoted to primary, the primary key becomes the secondary one
+        and a new key is staged. all other targets are regenerated. since
+        the etcd ca key is not stored, rotating the etcd certificates
+        re-issues the ca along with the server and client certificates
+        """
+        unknown = set(targets) - set(self.ROTATION_TARGETS)
+        if unknown:
+            raise ValueError('unknown rotation targets: {}'.format(
+                ', '.join(sorted(unknown))))
+
+        rotated = copy.deepcopy(existing)
+        changed = []
+
+        if 'fernet' in targets:
+            path = ('chef_databags', 'config', 'keystone', 'fernet', 'keys')
+            keys = self.__get(rotated, path)
+            keys.update({
+                'primary': keys['staged'],
+                'secondary': keys['primary'],
+                'staged': self.generate_fernet(),
+            })
+            changed.extend(path + (k,) for k in sorted(keys))
+
+        leaves = [(path, leaf)
+                  for path, leaf in self.__leaves(self.schema())
+                  if any(self.__rotates(t, path, leaf) for t in targets)
+                  and self.__has(rotated, path)]
+
+        components = set()
+        for path, leaf in leaves:
+            components.update(self.__components(leaf))
+        self.__prepare(sorted(components))
+
+        for path, leaf in leaves:
+            self.__get(rotated, path[:-1])[path[-1]] = leaf()
+            changed.append(path)
+
+        return rotated, changed
+
+    def recipes(self, paths):
+        """chef recipes that need to converge after the paths changed"""
+        recipes = set()
+
+        for path in paths:
+            for section in path[1:3]:
+                recipes.update(self.SECTION_RECIPES.get(section, []))
+
+        return ['bcpc::{}'.format(recipe) for recipe in sorted(recipes)]
+
+    def __rotates(self, target, path, leaf):
+        if target == 'ceph':
+            return leaf == self.generate_ceph_key
+        if target == 'etcd-ssl':
+            return path[2:4] == ('etcd', 'ssl')
+        if target == 'passwords':
+            return 'creds' in path and path[-1] == 'password'
+        return False
+
+    def __leaves(self, schema, path=()):
+        if isinstance(schema, dict):
+            for key, value in schema.items():
+                yield from self.__leaves(value, path + (key,))
+        elif isinstance(schema, list):
+            for i, value in enumerate(schema):
+                key = self.__item_key(value, i)
+                yield from self.__leaves(value, path + (key,))
+        elif callable(schema):
+            yield path, schema
+
+    def __has(self, data, path):
+        try:
+            self.__get(data, path)
+            return True
+        except ValueError:
+            return False
+
+    def __components(self, schema):
+        if isinstance(schema, dict):
+            schema = list(schema.values())
+        if isinstance(schema, list):
+            return set().union(*[self.__components(v) for v in schema])
+        if isinstance(schema, Lazy) and schema.component is not None:
+            return {schema.component}
+        return set()
+
+    def __item_key(self, item, index):
+        # list items are matched by their id (databags) or username (etcd
+        # users) and fall back to their position in the list
+        if isinstance(item, dict):
+            for key in ['id', 'username']:
+                if key in item:
+                    return item[key]
+        return index
+
+    def __get(self, data, path):
+        for depth, key in enumerate(path, 1):
+            if isinstance(data, list):
+                data = next((item for i, item in enumerate(data)
+                             if self.__item_key(item, i) == key), None)
+            elif isinstance(data, dict):
+                data = data.get(key)
+            else:
+                data = None
+
+            if data is None:
+                msg = 'could not find {} in the databags'
+                msg = msg.format('/'.join(str(k) for k in path[:depth]))
+                raise ValueError(msg)
+        return data
+
+    def schema(self):
 
         config = {
             'id': 'config',
             'openstack': {
                 'admin': {
-                    'password': self.generate_string()
+                    'password': self.generate_string
                 }
             },
             'apache': {
                 'status': {
                     'username': 'apache_status',
-                    'password': self.generate_string()
+                    'password': self.generate_string
                 }
             },
             'ceph': {
-                'fsid': self.generate_uuid(),
+                'fsid': self.generate_uuid,
                 'mon': {
-                    'key': self.generate_ceph_key()
+                    'key': self.generate_ceph_key
                 },
                 'bootstrap': {
                     'mds': {
-                        'key': self.generate_ceph_key()
+                        'key': self.generate_ceph_key
                     },
                     'mgr': {
-                        'key': self.generate_ceph_key()
+                        'key': self.generate_ceph_key
                     },
                     'osd': {
-                        'key': self.generate_ceph_key()
+                        'key': self.generate_ceph_key
                     },
                     'rgw': {
-                        'key': self.generate_ceph_key()
+                        'key': self.generate_ceph_key
                     },
                     'rbd': {
-                        'key': self.generate_ceph_key()
+                        'key': self.generate_ceph_key
                     },
                 },
                 'client': {
                     'admin': {
-                        'key': self.generate_ceph_key()
+                        'key': self.generate_ceph_key
                     },
                     'cinder': {
-                        'key': self.generate_ceph_key()
+                        'key': self.generate_ceph_key
                     },
                     'glance': {
-                        'key': self.generate_ceph_key()
+                        'key': self.generate_ceph_key
                     }
                 },
             },
@@ -331,36 +760,36 @@ class BCCChefDatabags:
                 'users': [
                     {
                         'username': 'root',
-                        'password': self.generate_string()
+                        'password': self.generate_string
                     },
                     {
                         'username': 'server',
-                        'password': self.generate_string()
+                        'password': self.generate_string
                     },
                     {
                         'username': 'client-ro',
-                        'password': self.generate_string()
+                        'password': self.generate_string
                     },
                     {
                         'username': 'client-rw',
-                        'password': self.generate_string()
+                        'password': self.generate_string
                     },
                 ],
                 'ssl': {
                     'ca': {
-                        'crt': self.etcd_ssl.ca_crt(),
+                        'crt': self.__lazy('etcd_ssl', 'ca_crt'),
                     },
                     'server': {
-                        'crt': self.etcd_ssl.server_crt(),
-                        'key': self.etcd_ssl.server_key(),
+                        'crt': self.__lazy('etcd_ssl', 'server_crt'),
+                        'key': self.__lazy('etcd_ssl', 'server_key'),
                     },
                     'client-ro': {
-                        'crt': self.etcd_ssl.client_ro_crt(),
-                        'key': self.etcd_ssl.client_ro_key(),
+                        'crt': self.__lazy('etcd_ssl', 'client_ro_crt'),
+                        'key': self.__lazy('etcd_ssl', 'client_ro_key'),
                     },
                     'client-rw': {
-                        'crt': self.etcd_ssl.client_rw_crt(),
-                        'key': self.etcd_ssl.client_rw_key(),
+                        'crt': self.__lazy('etcd_ssl', 'client_rw_crt'),
+                        'key': self.__lazy('etcd_ssl', 'client_rw_key'),
                     },
                 }
             },
@@ -368,22 +797,22 @@ class BCCChefDatabags:
                 'creds': {
                     'db': {
                         'username': 'pdns',
-                        'password': self.generate_string()
+                        'password': self.generate_string
                     },
-                    'webserver': {'password': self.generate_string()},
-                    'api': {'key': self.generate_string()},
+                    'webserver': {'password': self.generate_string},
+                    'api': {'key': self.generate_string},
                 }
             },
             'keystone': {
                 'db': {
                     'username': 'keystone',
-                    'password': self.generate_string()
+                    'password': self.generate_string
                 },
                 'fernet': {
                     'keys': {
-                        'primary': self.generate_fernet(),
-                        'secondary': self.generate_fernet(),
-                        'staged': self.generate_fernet(),
+                        'primary': self.generate_fernet,
+                        'secondary': self.generate_fernet,
+                        'staged': self.generate_fernet,
                     }
                 }
             },
@@ -391,11 +820,11 @@ class BCCChefDatabags:
                 'creds': {
                     'db': {
                         'username': 'glance',
-                        'password': self.generate_string()
+                        'password': self.generate_string
                     },
                     'os': {
                         'username': 'glance',
-                        'password': self.generate_string()
+                        'password': self.generate_string
                     },
                 }
             },
@@ -403,11 +832,11 @@ class BCCChefDatabags:
                 'creds': {
                     'db': {
                         'username': 'cinder',
-                        'password': self.generate_string()
+                        'password': self.generate_string
                     },
                     'os': {
                         'username': 'cinder',
-                        'password': self.generate_string()
+                        'password': self.generate_string
                     },
                 }
             },
@@ -415,25 +844,25 @@ class BCCChefDatabags:
                 'creds': {
                     'db': {
                         'username': 'heat',
-                        'password': self.generate_string()
+                        'password': self.generate_string
                     },
                     'os': {
                         'username': 'heat',
-                        'password': self.generate_string()
+                        'password': self.generate_string
                     },
                 }
             },
-            'horizon': {'secret': self.generate_string()},
-            'libvirt': {'secret': self.generate_uuid()},
+            'horizon': {'secret': self.generate_string},
+            'libvirt': {'secret': self.generate_uuid},
             'neutron': {
                 'creds': {
                     'db': {
                         'username': 'neutron',
-                        'password': self.generate_string()
+                        'password': self.generate_string
                     },
                     'os': {
                         'username': 'neutron',
-                        'password': self.generate_string()
+                        'password': self.generate_string
                     },
                 }
             },
@@ -441,47 +870,47 @@ class BCCChefDatabags:
                 'creds': {
                     'db': {
                         'username': 'nova',
-                        'password': self.generate_string()
+                        'password': self.generate_string
                     },
                     'os': {
                         'username': 'nova',
-                        'password': self.generate_string()
+                        'password': self.generate_string
                     },
                 },
                 'ssh': {
-                    'crt': self.nova_ssh.public(),
-                    'key': self.nova_ssh.private()
+                    'crt': self.__lazy('nova_ssh', 'public'),
+                    'key': self.__lazy('nova_ssh', 'private')
                 }
             },
             'placement': {
                 'creds': {
                     'os': {'username': 'placement',
-                           'password': self.generate_string()},
+                           'password': self.generate_string},
                 }
             },
             'mysql': {
                 'users': {
-                    'sst': {'password': self.generate_string()},
-                    'root': {'password': self.generate_string()},
-                    'check': {'password': self.generate_string()},
+                    'sst': {'password': self.generate_string},
+                    'root': {'password': self.generate_string},
+                    'check': {'password': self.generate_string},
                 }
             },
             'rabbit': {
                 'username': 'guest',
-                'password': self.generate_string(),
-                'cookie': self.generate_string()
+                'password': self.generate_string,
+                'cookie': self.generate_string
             },
             'haproxy': {
                 'username': 'haproxy',
-                'password': self.generate_string(),
+                'password': self.generate_string,
             },
             'ssh': {
-                'public': self.ssh.public(),
-                'private': self.ssh.private()
+                'public': self.__lazy('ssh', 'public'),
+                'private': self.__lazy('ssh', 'private')
             },
             'ssl': {
-                'key': self.api_ssl.key(),
-                'crt': self.api_ssl.crt(),
+                'key': self.__lazy('api_ssl', 'key'),
+                'crt': self.__lazy('api_ssl', 'crt'),
                 'intermediate': None
             }
         }
@@ -491,10 +920,10 @@ class BCCChefDatabags:
             'dev': {
                 'ceph': {
                     'client': {
-                        'cinder': {'key': self.generate_ceph_key()}
+                        'cinder': {'key': self.generate_ceph_key}
                     }
                 },
-                'libvirt': {'secret': self.generate_uuid()}
+                'libvirt': {'secret': self.generate_uuid}
             }
         }
 
@@ -0,0 +1,183 @@
+# Copyright 2020, Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextlib
+import fcntl
+import os
+import uuid
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from lib.bcc_chef_databags import RSA_KEYS, generate_rsa_key
+
+
+class RSAKeyPool:
+    """
+    on-disk pool of pre-generated RSA keys
+
+    keys are stored PEM encoded, one file per key, in a sub-directory per
+    key type and size (e.g. x509-2048). the pool directory is only
+    accessible by its owner and every key file is created with 0600
+    permissions. keys are moved into place with a rename so a reader never
+    sees a partially written key, and they are taken out of the pool under
+    an exclusive lock so that a key is handed out exactly once.
+
+    a prefill reserves the keys it is about to generate under the same
+    lock, so concurrent prefills never generate more keys than requested.
+    a reservation is a file named after the pid of the prefill and is
+    ignored once that process is gone.
+    """
+
+    def __init__(self, path):
+        self.__path = os.path.abspath(os.path.expanduser(path))
+        os.makedirs(self.__path, mode=0o700, exist_ok=True)
+        os.chmod(self.__path, 0o700)
+
+    @property
+    def path(self):
+        return self.__path
+
+    @contextlib.contextmanager
+    def __locked(self):
+        lock = os.path.join(self.__path, '.lock')
+        fd = os.open(lock, os.O_RDWR | os.O_CREAT, 0o600)
+
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def __directory(self, key_type, bits):
+        directory = os.path.join(self.__path,
+                                 '{}-{}'.format(key_type, bits))
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        return directory
+
+    def __keys(self, key_type, bits):
+        directory = self.__directory(key_type, bits)
+        return sorted(
+            os.path.join(directory, f) for f in os.listdir(directory)
+            if f.endswith('.pem')
+        )
+
+    def __reservations(self, key_type, bits):
+        """reservations of running prefills, stale ones are removed"""
+        directory = self.__directory(key_type, bits)
+        reservations = []
+
+        for f in os.listdir(directory):
+            if not f.endswith('.reserved'):
+                continue
+
+            path = os.path.join(directory, f)
+            pid = int(f[1:].split('-')[0])
+
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                os.unlink(path)
+                continue
+            except PermissionError:
+                pass
+
+            reservations.append(path)
+
+        return reservations
+
+    def __reserve(self, key_type, bits):
+        directory = self.__directory(key_type, bits)
+        name = '.{}-{}.reserved'.format(os.getpid(), uuid.uuid4().hex)
+        path = os.path.join(directory, name)
+
+        os.close(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600))
+        return path
+
+    def count(self, key_type, bits):
+        with self.__locked():
+            return len(self.__keys(key_type, bits))
+
+    def put(self, key_type, bits, pem):
+        directory = self.__directory(key_type, bits)
+        name = uuid.uuid4().hex
+        tmp = os.path.join(directory, '.{}.tmp'.format(name))
+
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(pem)
+
+        os.rename(tmp, os.path.join(directory, '{}.pem'.format(name)))
+
+    def take(self, key_type, bits):
+        """
+        remove a key from the pool and return it PEM encoded or None if the
+        pool has no key of the requested type and size
+        """
+        with self.__locked():
+            for path in self.__keys(key_type, bits):
+                try:
+                    with open(path, 'rb') as f:
+                        pem = f.read()
+                    os.unlink(path)
+                except FileNotFoundError:
+                    continue
+
+                return pem
+
+            return None
+
+    def prefill(self, count, jobs=1):
+        """
+        top up the pool so that it holds enough keys for count databag
+        generations and return the number of keys that were generated
+        """
+        wanted = Counter(RSA_KEYS.values())
+
+        # count the keys in the pool and those other prefills are still
+        # generating, and reserve the missing ones in one locked step
+        specs = []
+        with self.__locked():
+            for (key_type, bits), per_databag in sorted(wanted.items()):
+                available = len(self.__keys(key_type, bits)) + \
+                    len(self.__reservations(key_type, bits))
+                missing = count * per_databag - available
+                specs.extend(
+                    (key_type, bits, self.__reserve(key_type, bits))
+                    for _ in range(max(missing, 0))
+                )
+
+        if not specs:
+            return 0
+
+        key_types, sizes, reservations = zip(*specs)
+
+        try:
+            with contextlib.ExitStack() as stack:
+                if jobs > 1:
+                    executor = stack.enter_context(
+                        ProcessPoolExecutor(max_workers=jobs))
+                    pems = executor.map(generate_rsa_key, key_types, sizes)
+                else:
+                    pems = map(generate_rsa_key, key_types, sizes)
+
+                for (key_type, bits, reservation), pem in zip(specs, pems):
+                    self.put(key_type, bits, pem)
+                    os.unlink(reservation)
+        finally:
+            # release what is left when generating a key failed
+            for reservation in reservations:
+                if os.path.exists(reservation):
+                    os.unlink(reservation)
+
+        return len(specs)
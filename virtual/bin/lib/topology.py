@@ -0,0 +1,138 @@
+# Copyright 2020, Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import copy
+import hashlib
+import json
+import os
+import tempfile
+from lib import yaml_io
+
+# bump when the layout of the compiled topology changes
+COMPILER_VERSION = 1
+
+# base file and optional override file of each part of the topology
+SOURCES = [
+    ('topology.yml', 'topology.overrides.yml'),
+    ('hardware.yml', 'hardware.overrides.yml'),
+]
+
+COMPILED_FILE = '.topology.compiled.json'
+
+
+def deep_merge(base, override):
+    """
+    merge override into a copy of base. dictionaries are merged key by key,
+    any other value (lists included) in override replaces the one in base
+    """
+    if not isinstance(base, dict) or not isinstance(override, dict):
+        return copy.deepcopy(override)
+
+    merged = copy.deepcopy(base)
+
+    for key, value in override.items():
+        if key in merged:
+            merged[key] = deep_merge(merged[key], value)
+        else:
+            merged[key] = copy.deepcopy(value)
+
+    return merged
+
+
+def read_sources(topology_dir):
+
+    sources = {}
+
+    for base, override in SOURCES:
+        for name in [base, override]:
+            path = os.path.join(topology_dir, name)
+
+            if not os.path.isfile(path):
+                if name == base:
+                    raise FileNotFoundError('{} not found'.format(path))
+                continue
+
+            with open(path, 'rb') as f:
+                sources[name] = f.read()
+
+    return sources
+
+
+def compile_topology(sources):
+
+    """
+    merge the base and override files and resolve the hardware profile of
+    every node into its hardware key
+    """
+
+    parts = []
+
+    for base, override in SOURCES:
+        part = yaml_io.load(sources[base]) or {}
+
+        if override in sources:
+            part = deep_merge(part, yaml_io.load(sources[override]) or {})
+
+        parts.append(part)
+
+    topology, hardware = parts
+    profiles = hardware.get('profiles', {})
+
+    for node in topology.get('nodes', []):
+        profile = node.get('hardware_profile')
+
+        if profile not in profiles:
+            msg = "hardware profile {profile} of {host} not found"
+            msg = msg.format(profile=profile, host=node['host'])
+            raise ValueError(msg)
+
+        node['hardware'] = copy.deepcopy(profiles[profile])
+
+    topology['profiles'] = profiles
+
+    return topology
+
+
+def compiled_topology_file(topology_dir, output=None):
+
+    """
+    compile the topology in topology_dir unless the compiled file is still
+    up to date with its sources and return the path of the compiled file
+    """
+
+    sources = read_sources(topology_dir)
+    output = output or os.path.join(topology_dir, COMPILED_FILE)
+
+    checksums = {name: hashlib.sha256(data).hexdigest()
+                 for name, data in sources.items()}
+
+    try:
+        with open(output) as f:
+            compiled = json.load(f)
+        if compiled.get('compiler') == {'version': COMPILER_VERSION,
+                                        'sources': checksums}:
+            return output
+    except (OSError, ValueError):
+        pass
+
+    compiled = compile_topology(sources)
+    compiled['compiler'] = {'version': COMPILER_VERSION, 'sources': checksums}
+
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(output)),
+                               suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(compiled, f, indent=2, sort_keys=True)
+    os.rename(tmp, output)
+
+    return output
@@ -0,0 +1,148 @@
+# Copyright 2020, Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import os
+import stat
+import tempfile
+import yaml
+
+# use the libyaml bindings when pyyaml was built with them, they parse and
+# emit the same documents as the pure python implementation
+Loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+Dumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+# parsed documents are cached as json in a directory private to the user,
+# never next to the files they were parsed from
+CACHE_DIR = os.environ.get(
+    'BCC_YAML_CACHE_DIR', os.path.expanduser('~/.cache/bcc/yaml')
+)
+
+# bump when the layout of the cache files changes
+CACHE_VERSION = 2
+
+
+def load(stream):
+    return yaml.load(stream, Loader=Loader)
+
+
+def dump(data, stream=None):
+    return yaml.dump(data, stream, Dumper=Dumper,
+                     default_flow_style=False, indent=2)
+
+
+def cache_dir():
+    """
+    return the cache directory or None when it can not be created or is
+    not owned by and only accessible to the current user
+    """
+    try:
+        os.makedirs(CACHE_DIR, mode=0o700, exist_ok=True)
+        info = os.lstat(CACHE_DIR)
+    except OSError:
+        return None
+
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.geteuid() or \
+            stat.S_IMODE(info.st_mode) & 0o077:
+        return None
+
+    return CACHE_DIR
+
+
+def cache_file(path):
+    directory = cache_dir()
+    if directory is None:
+        return None
+
+    key = hashlib.sha256(os.path.abspath(path).encode()).hexdigest()
+    return os.path.join(directory, '{}.json'.format(key))
+
+
+def load_file(path, cache=True):
+    """
+    load a yaml file, using the parsed document cached in the user's cache
+    directory when the file has not changed since it was cached. the cache
+    is trusted when the file's size and mtime match and otherwise only when
+    the sha256 of its content still matches
+    """
+    sidecar = cache_file(path) if cache else None
+
+    if sidecar is None:
+        with open(path) as f:
+            return load(f)
+
+    info = os.stat(path)
+    cached = None
+
+    try:
+        with open(sidecar) as f:
+            cached = json.load(f)
+        if cached.get('version') != CACHE_VERSION or \
+                cached.get('path') != os.path.abspath(path):
+            cached = None
+    except (OSError, ValueError, AttributeError):
+        cached = None
+
+    if cached is not None and \
+            (cached['size'], cached['mtime']) == (info.st_size,
+                                                  info.st_mtime_ns):
+        return cached['data']
+
+    with open(path, 'rb') as f:
+        content = f.read()
+
+    sha256 = hashlib.sha256(content).hexdigest()
+
+    if cached is not None and cached['sha256'] == sha256:
+        data = cached['data']
+    else:
+        data = load(content)
+
+    write_cache(sidecar, {
+        'version': CACHE_VERSION,
+        'path': os.path.abspath(path),
+        'size': info.st_size,
+        'mtime': info.st_mtime_ns,
+        'sha256': sha256,
+        'data': data,
+    })
+
+    return data
+
+
+def write_cache(sidecar, cached):
+    # documents json can not represent faithfully (dates, non-string keys)
+    # are not cached
+    try:
+        content = json.dumps(cached)
+    except (TypeError, ValueError):
+        return
+
+    if json.loads(content)['data'] != cached['data']:
+        return
+
+    # the cache is only an optimization, failing to write it is not an error
+    try:
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(sidecar),
+                                   suffix='.tmp')
+    except OSError:
+        return
+
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        os.rename(tmp, sidecar)
+    except OSError:
+        os.unlink(tmp)
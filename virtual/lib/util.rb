@@ -12,6 +12,15 @@ module Util
     name + '_' + hash
   end
 
+  # returns the vm topology merged with its overrides and with the hardware
+  # profile of every node resolved into its 'hardware' key
+  def self.load_topology
+    require 'json'
+    compiled = `bin/compile-topology.py`.strip
+    raise 'failed to compile the vm topology' unless $?.success?
+    JSON.parse(File.read(compiled))
+  end
+
   def self.mount_apt_cache(config)
     if ENV.key?('BCC_DISABLE_APT_CACHE')
       return